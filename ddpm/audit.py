@@ -1,15 +1,16 @@
 
-from copy import copy
 from tabulate import tabulate
 from . import utils_ledger as ul
 from . import utils_time as ut
-from . import plots_ledger as plots
-from dateutil.parser import parse
-from datetime import datetime, timedelta
+from . import store_ledger
+from dateutil.parser import parse, ParserError
+import numpy as np
+import pandas as pd
+from datetime import datetime
 
 
 class Filter:
-    def __init__(self, ledger_accounts, dates, amounts):
+    def __init__(self, ledger_accounts, dates, amounts, fy_month=7):
         """
         Parameter
         ---------
@@ -19,6 +20,8 @@ class Filter:
             List of element types intrepreted as dates
         amounts : list
             List of element types interpreted as amounts
+        fy_month : int
+            First month of the fiscal year, for fy=... (see set_fiscal_year)
 
         Attributes
         ----------
@@ -29,9 +32,13 @@ class Filter:
             'type': amount_type keys, 'low'/'high': low/high values per amount_type key
         date : dict
             'type': date_type keys, 'start'/'stop': start/end values per date_type
+        other : dict
+            Values of other entry keys to allow (a list allows any of its values)
 
         """
         self.ledger_accounts = ledger_accounts
+        self.fiscal_calendar = ut.FiscalCalendar(fy_month)
+        self._predicate = None  # The compiled settings (see predicate), reset when they are changed
         self.absval = {}
         self.amount = {'type': amounts, 'low': {}, 'high': {}}
         self.date = {'type': dates, 'start': {}, 'stop': {}}
@@ -45,6 +52,7 @@ class Filter:
         for datt in self.date['type']:
             self.set_date(datt, 'all')
         self.other = {}
+        self._predicate = None
 
     def set(self, **kwargs):
         """
@@ -57,8 +65,11 @@ class Filter:
                 self.set_date(key, value)
             elif key in ['account', 'exclude']:
                 self.set_account(key, value)
+            elif key == 'fy':
+                self.set_fiscal_year(value)
             else:
                 self.other[key] = value
+                self._predicate = None
             
     def set_account(self ,key, val):
         if isinstance(val, str):
@@ -78,13 +89,14 @@ class Filter:
             print(f"{key} not an allowed date type")
             return
         val = 'all' if val is None else val
+        self._predicate = None
         self.date['start'][key] = datetime(year=2000, month=1, day=1).astimezone()
         self.date['stop'][key] = datetime(year=2100, month=12, day=31).astimezone()
         if val == 'all':
             return
         try:
             val = parse(val)
-        except parse.ParserError:
+        except ParserError:
             pass
         if isinstance(val, datetime):
             self.date['start'][key] = datetime(year=val.year, month=val.month, day=val.day, hour=0, minute=0, second=0).astimezone()
@@ -92,6 +104,21 @@ class Filter:
         else:
             self.date['start'][key], self.date['stop'][key] = [parse(x).astimezone() for x in val.split('_')]
 
+    def set_fiscal_year(self, val):
+        """
+        Set the date types to a fiscal year (e.g. 2025 or 'FY25') or range of fiscal years ('FY24_FY25').
+        """
+        if val is None or val == 'all':
+            for key in self.date['type']:
+                self.set_date(key, 'all')
+            return
+        first, last = str(val).split('_') if '_' in str(val) else (str(val), str(val))
+        start, stop = self.fiscal_calendar.bounds(first).start, self.fiscal_calendar.bounds(last).stop
+        for key in self.date['type']:
+            self.set_date(key, 'all')
+            self.date['start'][key] = start
+            self.date['stop'][key] = stop.replace(hour=23, minute=59, second=59)
+
     def set_amount(self, key, val):
         """
 
@@ -99,29 +126,31 @@ class Filter:
         if key not in self.amount['type']:
             print(f"{key} not an allowed amount type")
             return
+        self._predicate = None
         self.absval[key] = False
         self.amount['low'][key] = -1E15
         self.amount['high'][key] = 1E15
         val = 'all' if val is None else val
         if val == 'all':
             return
-        try:
-            val = float(val)
-        except ValueError:
-            pass
+        if not isinstance(val, str) or '_' not in val:  # float would read 'low_high' as one number
+            try:
+                val = float(val)
+            except ValueError:
+                pass
 
         if isinstance(val, str):
             if val.lower() == 'all':
                 return
             if '|' in val:
                 self.absval[key] = True
-                val.replace('|', '')
+                val = val.replace('|', '')
             if val.startswith('<'):
                 self.amount['high'][key] = float(val.replace(',', '').replace('$', '').replace('<', ''))
             elif val.startswith('>'):
                 self.amount['low'][key] = float(val.replace(',', '').replace('$', '').replace('>', ''))
             elif '_' in val:
-                self.amount['low'][key], self.amount['hight'][key] = [float(x.replace(',', '').replace('$', '')) for x in val.split('_')]
+                self.amount['low'][key], self.amount['high'][key] = [float(x.replace(',', '').replace('$', '')) for x in val.split('_')]
         else:  # Within a dollar
             self.amount['low'][key] = val - 1.0
             self.amount['high'][key] = val + 1.0
@@ -141,10 +170,53 @@ class Filter:
         for key, val in self.other.items():
             if isinstance(val, list) and data[key] not in val:
                 return False
-            elif data[key] != val:
+            elif not isinstance(val, list) and data[key] != val:
                 return False
         return True
 
+    @property
+    def predicate(self):
+        """
+        The settings compiled into a list of tests (key, (low, high, absval) or None, func or None), made
+        again only after they change.  Amounts are tested as arrays and the other keys by func(value).
+        """
+        if self._predicate is None:
+            self._predicate = []
+            for key in self.date['type']:
+                start, stop = self.date['start'][key], self.date['stop'][key]
+                self._predicate.append((key, None, lambda x, start=start, stop=stop: x is not None and start <= x <= stop))
+            for key in self.amount['type']:
+                limits = (self.amount['low'][key], self.amount['high'][key], self.absval[key])
+                if limits[:2] != (-1E15, 1E15):
+                    self._predicate.append((key, limits, None))
+            for key, val in self.other.items():
+                if isinstance(val, list):
+                    self._predicate.append((key, None, lambda x, val=val: x in val))
+                else:
+                    self._predicate.append((key, None, lambda x, val=val: x == val))
+        return self._predicate
+
+    def mask(self, entries):
+        """
+        Vectorized allow:  return a bool array of which entries pass.  For an EntryList (see store_ledger.py) the
+        funcs of the predicate are applied once per distinct value of a column, otherwise allow is used per entry.
+        Entries without a key that is tested (e.g. from a report type without dates) don't pass, where allow
+        raises a KeyError.
+        """
+        if not hasattr(entries, 'column'):
+            return np.array([self.allow(x) for x in entries], dtype=bool)
+        keep = np.ones(len(entries), dtype=bool)
+        for key, limits, func in self.predicate:
+            if not keep.any():
+                break
+            if func is not None:
+                keep &= entries.column(key, func=func).astype(bool)
+            else:
+                low, high, absval = limits
+                values = np.abs(entries.column(key)) if absval else entries.column(key)
+                keep &= ~((values < low) | (values > high))  # So NaN passes, as for allow
+        return keep
+
 class Audit():
     """
     Look at Ledger files
@@ -170,24 +242,38 @@ class Audit():
         self.ledger = ledger
         self.filter = Filter(ledger_accounts=list(ledger.data.keys()),
                              dates=list(ledger.date_types),
-                             amounts=list(ledger.amount_types))
+                             amounts=list(ledger.amount_types),
+                             fy_month=ledger.fy_month)
         self.chart_amounts = chart_amounts
 
-    def _get_sort_key(self, row, sort_by, use_absval):
-        key = []
-        for sb in sort_by:
-            val = row[sb]
+    def _sort_values(self, key, rows, use_absval):
+        """
+        Array to sort rows (ledger store rows) on key:  numbers are compared as int cents (abs if use_absval) and
+        anything else as is, with each distinct value converted and ranked only once.
+        """
+        store = self.ledger.store
+        if isinstance(store.columns[key], store_ledger.FloatColumn):
+            cents = np.trunc(store.column(key, rows) * 100.0)
+            return np.abs(cents) if use_absval else cents
+        codes, uniques = pd.factorize(store.column(key, rows), use_na_sentinel=False)
+        converted = []
+        for val in uniques.tolist():
             try:
                 val = int(float(val) * 100.0)
                 if use_absval:
                     val = abs(val)
             except (ValueError, TypeError):
                 pass
-            key.append(val)
-        key.append(self.total_lines)  # to ensure unique
-        return tuple(key)
-
-    def detail(self, sort_by='account,date', sort_reverse=False, cols_to_show='all', csv=False):
+            converted.append(val)
+        ranks = np.zeros(len(converted), dtype=np.int64)
+        rank, previous = 0, None
+        for n, i in enumerate(sorted(range(len(converted)), key=converted.__getitem__)):
+            if n and converted[i] != previous:
+                rank += 1
+            ranks[i], previous = rank, converted[i]
+        return ranks[codes] if len(codes) else np.empty(0, dtype=np.int64)
+
+    def detail(self, sort_by='account,date', sort_reverse=False, cols_to_show='all', csv=False, offset=0, limit=None):
         """
         Look at detail in a particular account with various filters and options.
 
@@ -201,12 +287,20 @@ class Audit():
             column keys used
         csv:  save the table as a csv file <True/False/'str'>
             if supplied,  uses 'str' as filename, if True uses default
+        offset : int
+            First (sorted) entry of table_data
+        limit : int or None
+            If not None, table_data has at most limit entries (see get_table).  The csv file has all of the entries
+            regardless, streamed in batches (see iter_table), so limit=0 writes it without keeping a table.
 
         Attributes
         ----------
-        rows : dict
+        rows : numpy array
+            Ledger store rows of the selected entries, in the sorted order
         subtotal : dict
         cadence : dict
+        cadence_arrays : dict
+            The cadences as aligned arrays (see get_cadences, in-filled by in_fill_cadence_cumulative)
         header : list
         table_data : list
 
@@ -220,14 +314,10 @@ class Audit():
             cols_to_show = list(self.ledger.columns)
         elif isinstance(cols_to_show, str):
             cols_to_show = cols_to_show.split(',')
+        self.cols_to_show = cols_to_show
 
-        self.total_lines = 0
-        self.rows = {}
         self.subtotal = {}
-        for amtt in self.ledger.amount_types:
-            self.subtotal[amtt] = 0.0
-        self.cadence = {'daily': {}, 'monthly': {}, 'quarterly': {}, 'yearly': {}}
-        now = datetime.now().astimezone().replace(hour=23, minute=59, second=0, microsecond=0)
+        accounts = []
         for account in self.filter.account:
             if account in self.filter.exclude:
                 continue
@@ -236,26 +326,25 @@ class Audit():
                 account = str(account)
             if account not in self.ledger.data.keys():
                 continue
-            for row in self.ledger.data[account]['entries']:
-                if not self.filter.allow(row):
-                    continue
-                for amtt in self.ledger.amount_types:
-                    self.subtotal[amtt] += row[amtt]
-                self.total_lines += 1
-                # Get row
-                key = self._get_sort_key(row=row, sort_by=sort_by, use_absval=use_absval)
-                self.rows[key] = copy(row)
-                # Get cadences
-                for cad in self.cadence.keys():
-                    cey = ut.cadence_keys(cad, row['date'])  # Last minute of that cadence
-                    if cey > now:
-                        cey = now
-                    if cey not in self.cadence[cad]:
-                        self.cadence[cad][cey]= {}
-                        for amtt in self.ledger.amount_types:
-                            self.cadence[cad][cey][amtt] = 0.0
-                    for amtt in self.ledger.amount_types:
-                        self.cadence[cad][cey][amtt] += row[amtt]
+            accounts.append(account)
+        db = getattr(self.ledger, 'db', None)
+        selected = None if db is None else db.select(self.filter, accounts)  # Filter in one query (see sqlite_ledger.py)
+        rows = []
+        for account in accounts:
+            if selected is None:
+                entries = self.ledger.data[account]['entries']
+                rows.append(entries.rows[self.filter.mask(entries)])
+            else:
+                rows.append(np.array(selected.get(account, []), dtype=np.int64))
+        self.rows = np.concatenate(rows) if len(rows) else np.empty(0, dtype=np.int64)
+        self.total_lines = len(self.rows)
+        for amtt in self.ledger.amount_types:
+            amounts = np.cumsum(self.ledger.store.column(amtt, self.rows))  # Summed in order, as before
+            self.subtotal[amtt] = float(amounts[-1]) if len(amounts) else 0.0
+        self.get_cadences(self.rows)
+        if len(self.rows):
+            order = np.lexsort([self._sort_values(key, self.rows, use_absval) for key in reversed(sort_by)])
+            self.rows = self.rows[order[::-1] if sort_reverse else order]  # Ties stay in the order found
         self.header = []
         for _x in cols_to_show:
             if _x in self.ledger.columns:
@@ -264,94 +353,171 @@ class Audit():
         self.in_fill_cadence_cumulative()
         if not len(self.rows):
             return 
-        for key in sorted(self.rows.keys(), reverse=sort_reverse):
-            row = []
-            for this_key in cols_to_show:
-                if this_key in self.rows[key]:
-                    if this_key in self.ledger.date_types:
-                        row.append(self.rows[key][this_key].strftime('%Y-%m-%d'))
-                    else:
-                        row.append(self.rows[key][this_key])
-            self.table_data.append(row)
+        self.table_data = self.get_table(offset, limit)
         if csv:
-            ul.write_to_csv(csv, self.table_data, self.header)
+            ul.write_to_csv(csv, self.table_data if offset == 0 and limit is None else self.iter_table(), self.header)
+
+    def get_table(self, offset=0, limit=None):
+        """
+        Make the table (cols_to_show of detail) of only the sorted entries [offset:offset + limit].
+
+        Return
+        ------
+        list
+            The table rows
 
-    def show_table(self):
         """
-        Shows the detail table and subtotals
+        store = self.ledger.store
+        rows = self.rows[offset:None if limit is None else offset + limit]
+
+        def date_str(x):
+            return x.strftime('%Y-%m-%d') if hasattr(x, 'strftime') else x
+
+        columns = []
+        for key in self.cols_to_show:
+            if key not in store.columns:
+                continue
+            has_key = np.isin(store.schema[rows], [i for i, keys in enumerate(store.schemas) if key in keys])
+            values = store.column(key, rows, func=date_str if key in self.ledger.date_types else None).tolist()
+            columns.append((has_key, values))
+        return [[values[i] for has_key, values in columns if has_key[i]] for i in range(len(rows))]
+
+    def iter_table(self, batch=50000):
+        """
+        Generate the rows of the whole table (see get_table), made batch entries at a time.
+
+        """
+        for offset in range(0, len(self.rows), batch):
+            yield from self.get_table(offset, batch)
+
+    def get_cadences(self, rows):
+        """
+        Sum the amounts of the selected entries for each cadence (daily/monthly/quarterly/yearly).  The cadence
+        key (see utils_time.period_keys, but no later than the end of today) is found once per distinct period
+        and the amounts are summed by key code in one step.
+
+        Parameter
+        ---------
+        rows : numpy array
+            Ledger store rows of the selected entries
+
+        Attributes
+        ----------
+        cadence_arrays : dict
+            Per cadence, 't' the sorted keys and per amount_type the aligned sums (numpy arrays)
+        cadence : dict
+            The same as cadence -> key -> amount_type -> sum (as used by in_fill_cadence_cumulative and the plots)
+
+        """
+        now = datetime.now().astimezone().replace(hour=23, minute=59, second=0, microsecond=0)
+        store = self.ledger.store
+        date_codes, dates = pd.factorize(store.column('date', rows), use_na_sentinel=False) if len(rows) else (rows, [])
+        amounts = {}
+        for amtt in self.ledger.amount_types:
+            amounts[amtt] = store.column(amtt, rows)
+        self.cadence_arrays = {}
+        self.cadence = {}
+        for cad in ['daily', 'monthly', 'quarterly', 'yearly']:
+            keys = ut.period_keys(dates, cad, stop=now).tolist()  # Last minute of that cadence
+            t = sorted(set(keys))
+            index = {key: i for i, key in enumerate(t)}
+            codes = np.array([index[key] for key in keys], dtype=np.int64)[date_codes]
+            self.cadence_arrays[cad] = {'t': np.array(t, dtype=object)}
+            for amtt in self.ledger.amount_types:
+                self.cadence_arrays[cad][amtt] = np.zeros(len(t))
+                np.add.at(self.cadence_arrays[cad][amtt], codes, amounts[amtt])  # In row order, as summed before
+            self.cadence[cad] = {}
+            for i, key in enumerate(t):
+                self.cadence[cad][key] = {amtt: float(self.cadence_arrays[cad][amtt][i]) for amtt in self.ledger.amount_types}
+
+    def show_table(self, offset=None, limit=None):
+        """
+        Shows the detail table and subtotals.  If offset or limit is supplied only those entries are shown (see get_table),
+        otherwise table_data.
 
         """
         print()
-        print(tabulate(self.table_data, headers=self.header, floatfmt='.2f'))
+        if offset is None and limit is None:
+            print(tabulate(self.table_data, headers=self.header, floatfmt='.2f'))
+        else:
+            offset = 0 if offset is None else offset
+            table_data = self.get_table(offset, limit)
+            print(tabulate(table_data, headers=self.header, floatfmt='.2f'))
+            print(f"\nEntries {offset + 1 if len(table_data) else offset}-{offset + len(table_data)} of {self.total_lines}")
         print(f"\nSub-total:") 
         for amtt in self.ledger.amount_types:
             print(f"\t{amtt}:  {self.subtotal[amtt]:.2f}")
 
     def show_plots(self, amounts=None):
         """
-        Plots the cadence and cumulative data.
+        Plots the cadence, cumulative and rate data.
 
         """
+        from . import plots_ledger as plots
         amounts = ul.get_amount_list(amounts=amounts, amount_types=self.ledger.amount_types, chart_amounts=self.chart_amounts)
         plots.cadences(self.cadence, amounts=amounts)
         plots.cumulative(self.cumulative, amounts=amounts)
+        plots.rates(self.cumulative, self.mean_rate, self.rate_span, amounts=amounts)
 
     def in_fill_cadence_cumulative(self):
         """
-        In-fill cadences that don't have data with a 0.0 and make the cumulative data on daily basis.
+        In-fill cadences that don't have data with a 0.0 and make the cumulative data on daily basis.  Each
+        cadence is reindexed onto its full calendar (see utils_time.cadence_calendar) in one pass.
 
         """
         self.cumulative = {'t': []}
         for amtt in self.ledger.amount_types:
             self.cumulative[amtt] = []
-        now = datetime.now().astimezone().replace(hour=23, minute=59, second=0, microsecond=0)
+        self.cadence_arrays = {}
         for this_cadence in ['daily', 'monthly', 'quarterly', 'yearly']:
             ordered_keys = sorted(self.cadence[this_cadence].keys())
             if not len(ordered_keys):
                 continue
-            this_time = copy(ordered_keys[0])
-            if this_cadence == 'daily':  # Start cumulative
-                self.cumulative['t'].append(this_time)
+            t = ut.cadence_calendar(this_cadence, ordered_keys[0], ordered_keys[-1])
+            index = {key: i for i, key in enumerate(t)}
+            self.cadence_arrays[this_cadence] = {'t': np.array(t, dtype=object)}
+            for amtt in self.ledger.amount_types:
+                self.cadence_arrays[this_cadence][amtt] = np.zeros(len(t))
+            for key, amounts in self.cadence[this_cadence].items():
                 for amtt in self.ledger.amount_types:
-                    self.cumulative[amtt].append(self.cadence['daily'][this_time][amtt])  # First one
-            ctr = 0
-            while this_time < ordered_keys[-1]:
-                this_time = ut.cadence_keys(this_cadence, this_time + timedelta(days=1))
-                if this_time > now:
-                    this_time = now
-                if this_time in ordered_keys:
-                    pass
-                else:
-                    self.cadence[this_cadence][this_time] = {}
+                    self.cadence_arrays[this_cadence][amtt][index[key]] = amounts[amtt]
+            for key in t:
+                if key not in self.cadence[this_cadence]:
+                    self.cadence[this_cadence][key] = {}
                     for amtt in self.ledger.amount_types:
-                        self.cadence[this_cadence][this_time][amtt] = 0.0
-                if this_cadence == 'daily':  # Next cumulative entry
-                    self.cumulative['t'].append(this_time)
-                    for amtt in self.ledger.amount_types:
-                        self.cumulative[amtt].append(self.cumulative[amtt][ctr] + self.cadence['daily'][this_time][amtt])
-                ctr += 1
+                        self.cadence[this_cadence][key][amtt] = 0.0
+            if this_cadence == 'daily':
+                self.cumulative['t'] = t
+                for amtt in self.ledger.amount_types:
+                    self.cumulative[amtt] = np.cumsum(self.cadence_arrays['daily'][amtt])
         self.smooth_cumulative_rates()
 
     def smooth_cumulative_rates(self, fs=1.0, cutoff=60.0, order=8):
-        from numpy import diff, insert, mean
+        """
+        Smooth the cumulative amounts (all amount types filtered together, see utils_ledger.smoothed_rates) and
+        get their daily rates.  Nothing is plotted (see show_plots).
+
+        Attributes
+        ----------
+        cumulative : dict
+            Adds smooth_<amount_type> and diff_<amount_type>
+        mean_rate : dict
+            Mean daily rate of each amount type, over rate_span
+        rate_span : tuple
+            The (low, high) indices of cumulative['t'] the rates are averaged between
+
+        """
         self.fs = fs
         self.cutoff = 1.0 / cutoff
         self.order = order
         self.mean_rate = {}
         print("Rates:")
-        for amtt in self.ledger.amount_types:
-            smkey = f"smooth_{amtt}"
-            self.cumulative[smkey] = ul.butter_lowpass_filter(self.cumulative[amtt], self.cutoff, self.fs, self.order)
-            dikey = f"diff_{amtt}"
-            self.cumulative[dikey] = insert(diff(self.cumulative[smkey]), 0, 0.0)
-            ilo = int(0.15 * len(self.cumulative['t']))
-            ihi = int(0.85 * len(self.cumulative['t']))
-            mv = mean(self.cumulative[dikey][ilo:ihi])
-            self.mean_rate[amtt] = mv
-            plots.plt.figure("DIFF RATES")
-            plots.plt.plot(self.cumulative['t'], self.cumulative[dikey], label=dikey)
-            plots.plt.plot([self.cumulative['t'][ilo], self.cumulative['t'][ihi]], [mv, mv], lw=4, label=f"mean {dikey}")
-            plots.plt.legend()
-            print(f"\t{amtt}: {mv:.3f} /day")
+        stacked = np.array([self.cumulative[amtt] for amtt in self.ledger.amount_types], dtype=float)
+        smooth, rates, mean_rates, self.rate_span = ul.smoothed_rates(stacked, self.cutoff, self.fs, self.order)
+        for i, amtt in enumerate(self.ledger.amount_types):
+            self.cumulative[f"smooth_{amtt}"] = smooth[i]
+            self.cumulative[f"diff_{amtt}"] = rates[i]
+            self.mean_rate[amtt] = mean_rates[i]
+            print(f"\t{amtt}: {mean_rates[i]:.3f} /day")
 
 
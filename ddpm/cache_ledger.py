@@ -0,0 +1,308 @@
+"""
+On-disk cache of parsed ledger files.
+
+Each ledger file is stored (after conversion, see settings_ledger.BaseType.convert) by column in a numpy .npz
+file in the cache directory:  amounts as float64, dates as int64 epoch microseconds and everything else as
+int32 codes into the distinct values, which are kept with the columns/file state in a json header.  Nothing is
+pickled, so loading a cache file can't run code.  The cache file name has two parts:  the first is from
+CACHE_VERSION and the path/report_type/flip and the second is from the size/modification time (or content) of
+the ledger file, so a changed ledger file just misses and replaces its old entry.  The old entry is still used
+if the ledger file was only appended to (see load_previous), so only the new rows need to be parsed.
+
+The per-fund partitions of a master ledger file (see ledger.write_partitions) are stored the same way, but
+next to the ledger file they stand in for, as <ledger file>.partition.npz.  They are only used when asked for
+(see ledger.Ledger.read use_partitions) and while the master file is unchanged.
+
+"""
+import os
+import json
+import hashlib
+import time
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import pandas as pd
+
+
+CACHE_VERSION = 2  # Change when the conversions (settings_ledger.py) or the format change, so old entries miss
+CACHE_SUFFIX = '.ledger.npz'
+OLD_SUFFIXES = ['.ledger.pkl']  # Earlier formats, removed by evict
+PARTITION_SUFFIX = '.partition.npz'
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MAX_AGE = 30.0  # days since last used
+MAX_SIZE = 1000.0  # MB
+
+
+def _md5(s):
+    return hashlib.md5(s.encode('utf-8')).hexdigest()[:16]
+
+
+def cache_name(cache_dir, ledger_file, report_type, flip, hash_content=False):
+    """
+    Get the cache file name for a ledger file.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory containing the cache
+    ledger_file : str
+        Name of the ledger file
+    report_type : str
+        Report type of the ledger file
+    flip : float
+        Amount multiplier used when reading
+    hash_content : bool
+        If True use a hash of the file contents rather than the modification time
+
+    Return
+    ------
+    str
+        Full path of the cache file
+
+    """
+    stat = os.stat(ledger_file)
+    prefix = _md5(f"{CACHE_VERSION}|{os.path.abspath(ledger_file)}|{report_type}|{flip}")
+    if hash_content:
+        with open(ledger_file, 'rb') as fp:
+            version = hashlib.md5(fp.read()).hexdigest()
+    else:
+        version = str(stat.st_mtime_ns)
+    suffix = _md5(f"{stat.st_size}|{version}")
+    return os.path.join(os.path.expanduser(cache_dir), f"{prefix}_{suffix}{CACHE_SUFFIX}")
+
+
+def _encode(values, key, arrays):
+    """
+    Add the arrays of one column (pandas Series) to arrays and return its description for the header.
+    """
+    if pd.api.types.is_float_dtype(values):
+        arrays[key] = values.to_numpy(dtype=np.float64)
+        return {'kind': 'float'}
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    uniques = uniques.tolist()
+    arrays[key] = codes.astype(np.int32)
+    info = {'dtype': str(values.dtype)}
+    if len(uniques) and all([isinstance(x, datetime) and x.tzinfo is not None for x in uniques]):
+        arrays[key + '_epoch'] = np.array([(x - EPOCH) // timedelta(microseconds=1) for x in uniques], dtype=np.int64)
+        info['kind'] = 'epoch'
+    else:
+        info.update({'kind': 'dict', 'categories': uniques})
+    return info
+
+
+def _decode(info, key, arrays):
+    """
+    Return a column (pandas Series) from its description and arrays (see _encode).
+    """
+    if info['kind'] == 'float':
+        return pd.Series(arrays[key], dtype=np.float64)
+    if info['kind'] == 'epoch':
+        categories = [(EPOCH + timedelta(microseconds=x)).astimezone() for x in arrays[key + '_epoch'].tolist()]
+    else:
+        categories = info['categories']
+    values = np.empty(len(categories), dtype=object)
+    values[:] = categories
+    return pd.Series(values[arrays[key]], dtype=info['dtype'])
+
+
+def _write(fn, header, entries, accounts):
+    """
+    Write the converted entries (pandas DataFrame) and account keys (pandas Series) to fn, with the json-able header.
+    """
+    arrays = {}
+    header = dict(header, version=CACHE_VERSION, entries=[], accounts=_encode(accounts, 'accounts', arrays))
+    for n, (name, values) in enumerate(entries.items()):
+        header['entries'].append([name, _encode(values, f"c{n}", arrays)])
+    arrays['header'] = np.frombuffer(json.dumps(header).encode('utf-8'), dtype=np.uint8)
+    tmp_file = fn + '.tmp'
+    with open(tmp_file, 'wb') as fp:
+        np.savez(fp, **arrays)
+    os.replace(tmp_file, fn)
+
+
+def _read(fn):
+    """
+    Return the header of fn (see _write) with its 'entries' and 'accounts'.
+    """
+    with np.load(fn, allow_pickle=False) as npz:
+        arrays = {key: npz[key] for key in npz.files}
+    header = json.loads(arrays['header'].tobytes().decode('utf-8'))
+    if header.get('version') != CACHE_VERSION:
+        raise ValueError(f"cache version {header.get('version')} is not {CACHE_VERSION}")
+    header['entries'] = pd.DataFrame({name: _decode(info, f"c{n}", arrays) for n, (name, info) in enumerate(header['entries'])})
+    header['accounts'] = _decode(header['accounts'], 'accounts', arrays)
+    return header
+
+
+def load(cache_file):
+    """
+    Return the cached dictionary (keys 'columns', 'entries', 'accounts', 'state') or None if not cached.
+    A cache file that can't be loaded (e.g. truncated or of another version) is removed, so the ledger file is
+    parsed again.
+
+    """
+    try:
+        cached = _read(cache_file)
+        if not {'columns', 'state'}.issubset(cached):
+            raise ValueError("not a cached ledger file")
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Can't use cached {cache_file} ({type(e).__name__}: {e}) -- removing it.")
+        try:
+            os.remove(cache_file)
+        except OSError:
+            pass
+        return None
+    os.utime(cache_file)  # Mark as recently used for eviction
+    return cached
+
+
+def load_previous(cache_file):
+    """
+    Return the cached dictionary of an earlier version of the same ledger file (same path/report_type/flip) or None.
+
+    """
+    cache_dir, this_one = os.path.split(cache_file)
+    if not os.path.isdir(cache_dir):
+        return None
+    prefix = this_one.split('_')[0]
+    for fn in os.listdir(cache_dir):
+        if fn.startswith(prefix) and fn.endswith(CACHE_SUFFIX) and fn != this_one:
+            return load(os.path.join(cache_dir, fn))
+    return None
+
+
+def save(cache_file, columns, entries, accounts, state):
+    """
+    Write the parsed ledger file to the cache and remove any older version of it.
+
+    Parameters
+    ----------
+    cache_file : str
+        Full path of the cache file (see cache_name)
+    columns : list
+        The header of the ledger file
+    entries : pandas DataFrame
+        The converted entries
+    accounts : pandas Series
+        The account key for each entry
+    state : dict
+        The ledger file state (see utils_ledger.get_file_state)
+
+    """
+    cache_dir, this_one = os.path.split(cache_file)
+    os.makedirs(cache_dir, exist_ok=True)
+    prefix = this_one.split('_')[0]
+    for fn in os.listdir(cache_dir):
+        if fn.startswith(prefix) and fn != this_one:
+            os.remove(os.path.join(cache_dir, fn))
+    _write(cache_file, {'columns': list(columns), 'state': state}, entries, accounts)
+
+
+def evict(cache_dir, max_age=MAX_AGE, max_size=MAX_SIZE):
+    """
+    Remove cache files not used within max_age days (and any of earlier formats), then the least recently used
+    until the cache is under max_size MB.
+
+    Return
+    ------
+    int
+        Number of cache files removed
+
+    """
+    cache_dir = os.path.expanduser(cache_dir)
+    if not os.path.isdir(cache_dir):
+        return 0
+    now = time.time()
+    cached = []
+    removed = 0
+    for fn in os.listdir(cache_dir):
+        if not fn.endswith(CACHE_SUFFIX) and not any([fn.endswith(x) for x in OLD_SUFFIXES]):
+            continue
+        full_fn = os.path.join(cache_dir, fn)
+        stat = os.stat(full_fn)
+        if not fn.endswith(CACHE_SUFFIX) or (now - stat.st_mtime) / 86400.0 > max_age:
+            os.remove(full_fn)
+            removed += 1
+        else:
+            cached.append((stat.st_mtime, stat.st_size, full_fn))
+    total_size = sum([x[1] for x in cached])
+    for _t, size, full_fn in sorted(cached):
+        if total_size <= max_size * 1E6:
+            break
+        os.remove(full_fn)
+        total_size -= size
+        removed += 1
+    return removed
+
+
+def partition_name(ledger_file):
+    return ledger_file + PARTITION_SUFFIX
+
+
+def source_state(source_file):
+    """
+    Return [path, size, modification time (ns)] of the master ledger file a partition was made from.
+
+    """
+    stat = os.stat(source_file)
+    return [os.path.abspath(source_file), stat.st_size, stat.st_mtime_ns]
+
+
+def partition_version(ledger_file):
+    """
+    Return the modification time (ns) of the partition for ledger_file or None if there isn't one.
+
+    """
+    try:
+        return os.stat(partition_name(ledger_file)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def load_partition(ledger_file):
+    """
+    Return the partition dictionary (keys 'columns', 'entries', 'accounts', 'flip', 'source', 'state') for
+    ledger_file, or None if there isn't one, it can't be loaded, the ledger file itself is newer or the master
+    file it was made from has changed (or is gone).
+
+    """
+    version = partition_version(ledger_file)
+    if version is None:
+        return None
+    if os.path.exists(ledger_file) and os.stat(ledger_file).st_mtime_ns > version:
+        return None
+    try:
+        partition = _read(partition_name(ledger_file))
+    except Exception as e:
+        print(f"Can't use {partition_name(ledger_file)} ({type(e).__name__}: {e}) -- not using it.")
+        return None
+    source = partition.get('source')
+    if source is None or not os.path.exists(source[0]) or source_state(source[0]) != source:
+        print(f"{partition_name(ledger_file)} is out of date with its master file -- not using it.")
+        return None
+    partition['state'] = {'partition': version}
+    return partition
+
+
+def save_partition(ledger_file, columns, entries, accounts, flip, source):
+    """
+    Write the converted entries of one fund as the partition for ledger_file.
+
+    Parameters
+    ----------
+    ledger_file : str
+        Name of the ledger file the partition stands in for
+    columns : list
+        The header of the master ledger file
+    entries : pandas DataFrame
+        The converted entries of the fund
+    accounts : pandas Series
+        The account key for each entry
+    flip : float
+        Amount multiplier used when reading
+    source : list
+        State of the master ledger file (see source_state)
+
+    """
+    _write(partition_name(ledger_file), {'columns': list(columns), 'flip': flip, 'source': source}, entries, accounts)
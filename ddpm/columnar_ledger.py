@@ -0,0 +1,169 @@
+"""
+ddpm's own ledger file format, which is opened memory-mapped (see ledger.Ledger.save/load).
+
+One file holds a whole Ledger (generally one fund):
+
+    8 bytes  MAGIC
+    8 bytes  offset of the header (little-endian uint64)
+    the column arrays, each starting on an ALIGN byte boundary:
+        amounts as float64, dates as int64 epoch seconds, everything else as int32 codes into the
+        distinct values kept in the header, the uint8 report type (schema) of each row and the int64
+        row numbers of each account
+    the header, as json:  the offset/type of each array, the distinct values, the account totals, the
+        report_class of each file (report_type and columns, from which the column maps are made again),
+        the Ledger totals/dates/file states and the size/modification time of the files read
+
+Amounts are kept as read, so a loaded ledger has the same entries and totals as the read it was saved from.
+Nothing is read until used, so opening a file costs about the size of the header.
+
+"""
+import os
+import json
+from datetime import datetime
+import numpy as np
+from . import store_ledger
+
+
+MAGIC = b'DDPMLDG1'
+VERSION = 2  # Files of other versions are read again
+ALIGN = 64
+SUFFIX = '.ddpm'
+
+
+def source_version(ledger_file):
+    """
+    Return [size, modification time (ns)] of a ledger file (or of its partition, see cache_ledger), or None.
+
+    """
+    from . import cache_ledger
+    for fn in [ledger_file, cache_ledger.partition_name(ledger_file)]:
+        if os.path.exists(fn):
+            stat = os.stat(fn)
+            return [stat.st_size, stat.st_mtime_ns]
+    return None
+
+
+def _epoch(x):
+    return store_ledger.MISSING_INT if x is None else int(x.timestamp())
+
+
+def _json_default(x):
+    if isinstance(x, np.generic):
+        return x.item()
+    raise TypeError(f"Can't write {type(x).__name__} {x!r} to the ledger file header.")
+
+
+def write(fn, ledger):
+    """
+    Write a Ledger (after read) to the file fn.
+
+    """
+    store = ledger.store
+    header = {'version': VERSION, 'fund': ledger.fund, 'nrows': store.nrows, 'columns': {}, 'flip': -1.0 if ledger.flip else 1.0,
+              'schemas': [list(x) for x in store.schemas], 'accounts': [],
+              'report_class': {}, 'sources': {}, 'partitioned': sorted(getattr(ledger, 'partitioned', [])),
+              'ledger': {'columns': ledger.columns, 'amount_types': ledger.amount_types, 'date_types': ledger.date_types,
+                         'grand_total': ledger.grand_total, 'total_entries': ledger.total_entries,
+                         'first_date': _epoch(ledger.first_date), 'last_date': _epoch(ledger.last_date),
+                         'file_state': ledger.file_state}}
+    for ledger_file, L in ledger.report_class.items():
+        header['report_class'][ledger_file] = {'report_type': L.report_type, 'columns': list(L.columns)}
+    for ledger_file, report_type in ledger.files.items():
+        if report_type != 'none':
+            header['sources'][ledger_file] = source_version(ledger_file)
+    tmp_file = fn + '.tmp'
+    with open(tmp_file, 'wb') as fp:
+        fp.write(MAGIC + np.uint64(0).tobytes())
+
+        def write_array(array):
+            fp.write(b'\0' * (-fp.tell() % ALIGN))
+            offset = fp.tell()
+            fp.write(np.ascontiguousarray(array).tobytes())
+            return {'offset': offset, 'dtype': array.dtype.str, 'length': len(array)}
+
+        for name, column in store.columns.items():
+            if isinstance(column, store_ledger.FloatColumn):
+                header['columns'][name] = dict(kind='float', **write_array(column.values().astype(np.float64)))
+            elif name in ledger.date_types and all([x is None or isinstance(x, datetime) for x in column.categories]):
+                epochs = np.array([_epoch(x) for x in column.categories], dtype=np.int64)
+                header['columns'][name] = dict(kind='epoch', **write_array(epochs[column.codes]))
+            else:
+                header['columns'][name] = dict(kind='dict', categories=column.categories, **write_array(column.codes))
+        header['schema'] = write_array(store.schema)
+        rows, start = [], 0
+        for account, this_account in ledger.data.items():
+            entries = this_account['entries']
+            if not isinstance(entries, store_ledger.EntryList):
+                raise ValueError(f"The entries of {account} aren't in the ledger store.")
+            totals = {key: value for key, value in this_account.items() if key != 'entries'}
+            header['accounts'].append([account, start, len(entries), totals])
+            rows.append(entries.rows)
+            start += len(entries)
+        header['rows'] = write_array(np.concatenate(rows) if len(rows) else np.empty(0, dtype=np.int64))
+        fp.write(b'\0' * (-fp.tell() % ALIGN))
+        header_offset = fp.tell()
+        fp.write(json.dumps(header, default=_json_default).encode('utf-8'))
+        fp.seek(len(MAGIC))
+        fp.write(np.uint64(header_offset).tobytes())
+    os.replace(tmp_file, fn)
+
+
+def read_header(fn):
+    """
+    Return the header (dict) of a ledger file.
+
+    """
+    with open(fn, 'rb') as fp:
+        start = fp.read(len(MAGIC) + 8)
+        if start[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{fn} is not a ddpm ledger file.")
+        fp.seek(int(np.frombuffer(start[len(MAGIC):], dtype=np.uint64)[0]))
+        return json.loads(fp.read().decode('utf-8'))
+
+
+def is_current(fn, files, flip):
+    """
+    Return True if the ledger file fn exists, is of this VERSION and was written from the same versions of
+    files (and flip).
+
+    """
+    if not os.path.exists(fn):
+        return False
+    header = read_header(fn)
+    if header.get('version') != VERSION:
+        return False
+    use_files = {ledger_file: source_version(ledger_file) for ledger_file, report_type in files.items() if report_type != 'none'}
+    return header['flip'] == flip and header['sources'] == use_files
+
+
+def open_arrays(fn, header):
+    """
+    Memory-map the arrays of a ledger file.
+
+    Return
+    ------
+    tuple
+        EntryStore, dict of account -> (rows, totals)
+
+    """
+    def mapped(info):
+        if not info['length']:
+            return np.empty(0, dtype=info['dtype'])
+        return np.memmap(fn, dtype=info['dtype'], mode='r', offset=info['offset'], shape=(info['length'],))
+
+    store = store_ledger.EntryStore()
+    store.nrows = header['nrows']
+    store.schemas = [tuple(x) for x in header['schemas']]
+    store.schema_chunks = [mapped(header['schema'])]
+    for name, info in header['columns'].items():
+        if info['kind'] == 'float':
+            store.columns[name] = store_ledger.FloatColumn.from_array(mapped(info))
+        elif info['kind'] == 'epoch':
+            store.columns[name] = store_ledger.EpochColumn(mapped(info))
+        else:
+            store.columns[name] = store_ledger.DictColumn.from_codes(info['categories'], mapped(info))
+    rows = mapped(header['rows'])
+    accounts = {}
+    for account, start, count, totals in header['accounts']:
+        accounts[account] = (rows[start:start + count], totals)
+    return store, accounts
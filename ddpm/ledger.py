@@ -1,13 +1,248 @@
+import os
+import numpy as np
 import pandas as pd
 from copy import copy
 from tabulate import tabulate
 from . import settings_ledger as settings
 from . import utils_time as ut
 from . import utils_ledger as ul
+from . import cache_ledger
+from . import store_ledger
+from . import rules_ledger
+from . import columnar_ledger
+
+
+def parse_file(ledger_file, report_type, flip, cache=None, use_partition=False):
+    """
+    Read and convert one ledger file, using the cache if supplied.  If the cache has an earlier version
+    of an append-only file, only the appended rows are parsed.
+
+    This is a function rather than a Ledger method so that files may be parsed in worker processes.
+
+    Parameters
+    ----------
+    ledger_file : str
+        Name of the ledger file
+    report_type : str
+        Report type of the file (see settings_ledger.py)
+    flip : float
+        Multiplier for the amount_types
+    cache : str or None
+        If a directory name, use it to cache the parsed files (see cache_ledger.py)
+    use_partition : bool
+        If True, use this fund's partition of a master file in place of the ledger file (see write_partitions)
+
+    Return
+    ------
+    tuple or None
+        file header, converted entries, account keys, file state (None if the file doesn't exist)
+
+    """
+    partition = cache_ledger.load_partition(ledger_file) if use_partition else None
+    if partition is not None:
+        entries = partition['entries']
+        if partition['flip'] != flip:
+            L = settings.ledger_info(report_type, partition['columns'])
+            entries = entries.copy()
+            for amtt in L.amount_types:
+                entries[amtt] = entries[amtt] * (flip / partition['flip'])
+        return partition['columns'], entries, partition['accounts'], partition['state']
+    if not os.path.exists(ledger_file):
+        print(f"{ledger_file} does not exist.")
+        return None
+    if cache is not None:
+        cache_file = cache_ledger.cache_name(cache, ledger_file, report_type, flip)
+        cached = cache_ledger.load(cache_file)
+        if cached is not None:
+            return cached['columns'], cached['entries'], cached['accounts'], cached['state']
+        previous = cache_ledger.load_previous(cache_file)
+        if previous is not None:
+            parsed = parse_appended(ledger_file, report_type, flip, previous['state'])
+            if parsed is not None:
+                columns, entries, accounts, state = parsed
+                entries = pd.concat([previous['entries'], entries], ignore_index=True)
+                accounts = pd.concat([previous['accounts'], accounts], ignore_index=True)
+                cache_ledger.save(cache_file, columns, entries, accounts, state)
+                return columns, entries, accounts, state
+    this_file = pd.read_csv(ledger_file)
+    state = ul.get_file_state(ledger_file, this_file)
+    L = settings.ledger_info(report_type, this_file.columns.to_list())
+    entries = L.convert(this_file, flip=flip)
+    accounts = L.vkeygen(this_file)
+    if cache is not None:
+        cache_ledger.save(cache_file, L.columns, entries, accounts, state)
+    return L.columns, entries, accounts, state
+
+
+def partition_file(ledger_file, report_type, flip, cache=None):
+    """
+    Parse a master ledger file (with many funds) once and split the converted rows by fund (the prefix of
+    'Fund - Desc'), so that each fund's Ledger can be handed its rows (see Ledger.read partitions).
+
+    Return
+    ------
+    dict or None
+        Keyed on fund, the same tuple as parse_file for the rows of that fund (None if the file doesn't exist)
+
+    """
+    parsed = parse_file(ledger_file, report_type, flip, cache)
+    if parsed is None:
+        return None
+    columns, entries, accounts, state = parsed
+    if 'fund' not in entries.columns:
+        raise ValueError(f"{ledger_file} has no fund column to partition on.")
+    partitions = {}
+    for fund, rows in entries.groupby('fund', sort=False).indices.items():
+        partitions[fund] = (columns, entries.iloc[rows].reset_index(drop=True),
+                            accounts.iloc[rows].reset_index(drop=True), state)
+    return partitions
+
+
+def write_partitions(ledger_file, report_type, fund_dirs, flip=1.0):
+    """
+    Parse a master ledger file once and write each fund's rows as a binary partition in its directory.  A
+    Ledger in that directory reading with use_partitions then reads the partition in place of a ledger file of
+    the same name, while the master file is unchanged (see parse_file).
+
+    Parameters
+    ----------
+    ledger_file : str
+        Name of the master ledger file
+    report_type : str
+        Report type of the file (see settings_ledger.py)
+    fund_dirs : dict
+        Directory of each fund (see utils_ledger.get_fund_directories)
+    flip : float
+        Multiplier for the amount_types
+
+    """
+    partitions = partition_file(ledger_file, report_type, flip)
+    if partitions is None:
+        return
+    source = cache_ledger.source_state(ledger_file)
+    for fund in sorted(fund_dirs):
+        if str(fund) not in partitions:
+            print(f"No entries for {fund}")
+            continue
+        columns, entries, accounts, _state = partitions[str(fund)]
+        fund_file = os.path.join(fund_dirs[fund], os.path.basename(ledger_file))
+        cache_ledger.save_partition(fund_file, columns, entries, accounts, flip, source)
+        print(f"{len(entries):4d} entries to {cache_ledger.partition_name(fund_file)}")
+    others = [fund for fund in partitions if fund not in [str(x) for x in fund_dirs]]
+    if len(others):
+        print(f"{sum([len(partitions[fund][1]) for fund in others])} entries of funds without directories:  {', '.join(others)}")
+
+
+def parse_appended(ledger_file, report_type, flip, state, fund=None):
+    """
+    Read and convert only the rows appended to a ledger file since it had the file state.
+    If fund is not None, only that fund's rows are kept (see select_fund).
+
+    Return
+    ------
+    tuple or None
+        file header, converted entries, account keys, new file state (None if the file wasn't just appended to)
+
+    """
+    appended, new_state = ul.get_appended(ledger_file, state)
+    if appended is None:
+        return None
+    L = settings.ledger_info(report_type, state['columns'])
+    appended, _skipped = select_fund(L, appended, fund)
+    return L.columns, L.convert(appended, flip=flip), L.vkeygen(appended), new_state
+
+
+def select_fund(L, this_file, fund):
+    """
+    Keep only the rows of this_file (pandas DataFrame) for fund.  If fund is None or the report type has
+    no fund column, all rows are kept.
+
+    Return
+    ------
+    tuple
+        the selected rows, the number of rows skipped
+
+    """
+    if fund is None or 'fund' not in L.reverse_map or L.reverse_map['fund'] not in this_file.columns:
+        return this_file, 0
+    fund_col = L.reverse_map['fund']
+    keep = L.colmap[fund_col]['vfunc'](this_file[fund_col]) == str(fund)
+    return this_file[keep], int((~keep).sum())
+
+
+def stream_dtypes(ledger_file, chunksize=100000):
+    """
+    Find the dtype of each column of a ledger file as pandas infers it reading the whole file, a chunk at a
+    time:  int if every chunk is int, float if every chunk is numeric, bool if every chunk is bool, else str.
+    Columns without any values are str (as for the appended rows, see utils_ledger.get_file_state).
+
+    Return
+    ------
+    dict
+        The dtype of each column
+
+    """
+    from pandas.api.types import is_bool_dtype, is_integer_dtype, is_numeric_dtype
+    found, has_values = {}, set()
+    for chunk in pd.read_csv(ledger_file, chunksize=chunksize):
+        for col in chunk.columns:
+            found.setdefault(col, []).append(chunk[col].dtype)
+            if col not in has_values and chunk[col].notna().any():
+                has_values.add(col)
+    dtype = {}
+    for col, dtypes in found.items():
+        if col not in has_values:
+            dtype[col] = 'str'
+        elif all([is_bool_dtype(x) for x in dtypes]):
+            dtype[col] = 'bool'
+        elif any([is_bool_dtype(x) for x in dtypes]):
+            dtype[col] = 'str'
+        elif all([is_integer_dtype(x) for x in dtypes]):
+            dtype[col] = 'int64'
+        elif all([is_numeric_dtype(x) for x in dtypes]):
+            dtype[col] = 'float64'
+        else:
+            dtype[col] = 'str'
+    return dtype
+
+
+def stream_file(ledger_file, report_type, flip, fund=None, chunksize=100000, dtype=None):
+    """
+    Read and convert a ledger file a chunk at a time, so only one chunk of the file is in memory.
+    The chunks are read with the dtypes of the whole file (see stream_dtypes), so the entries are the
+    same as those of parse_file.
+
+    Parameters
+    ----------
+    ledger_file : str
+        Name of the ledger file
+    report_type : str
+        Report type of the file (see settings_ledger.py)
+    flip : float
+        Multiplier for the amount_types
+    fund : str or None
+        If not None, only keep the rows for fund (see select_fund)
+    chunksize : int
+        Number of lines per chunk
+    dtype : dict or None
+        The dtype of each column, if None found by stream_dtypes
+
+    Yields
+    ------
+    tuple
+        report_class, converted entries, account keys, number of rows skipped for other funds, the selected rows as read
+
+    """
+    L = settings.ledger_info(report_type, pd.read_csv(ledger_file, nrows=0).columns.to_list())
+    if dtype is None:
+        dtype = stream_dtypes(ledger_file, chunksize)
+    for chunk in pd.read_csv(ledger_file, chunksize=chunksize, dtype=dtype):
+        chunk, skipped = select_fund(L, chunk, fund)
+        yield L, L.convert(chunk, flip=flip), L.vkeygen(chunk), skipped, chunk
 
 
 class Ledger():
-    def __init__(self, fund, files):
+    def __init__(self, fund, files, fy_month=7):
         """
         Parameters
         ----------
@@ -15,18 +250,26 @@ class Ledger():
             Project designation, generally a fund number
         files : list of str
             List with the names of the files to be read
+        fy_month : int
+            First month of the fiscal year
 
         Attributes
         ----------
         Same as Parameters
+        fiscal_calendar : utils_time.FiscalCalendar
+            Used for the fiscal year of each entry (see fiscal_years) and to check the files' fiscal years
 
         """
         self.fund = fund
         self.files = files
+        self.fy_month = fy_month
+        self.fiscal_calendar = ut.FiscalCalendar(fy_month)
 
-    def read(self, flip=False, raise_fund_error=True):
+    def read(self, flip=False, raise_fund_error=True, cache=None, nproc=1, chunksize=None, partitions=None,
+             use_partitions=False):
         """
-        Read in the datafiles to produce data dictionary
+        Read in the datafiles to produce data dictionary.  Each file is converted a column at
+        a time (see settings_ledger.BaseType.convert) and then merged in.
 
         Parameter
         ---------
@@ -34,11 +277,29 @@ class Ledger():
             Flag to flip the amount(s)
         raise_fund_error : bool
             If True, error out if fund numbers don't match
+        cache : str or None
+            If a directory name, use it to cache the parsed files (see cache_ledger.py)
+        nproc : int
+            Number of worker processes used to parse the files.  The parsed files are still merged
+            in the order of self.files, so the result doesn't depend on nproc.
+        chunksize : int or None
+            If not None, stream the files chunksize lines at a time (see stream_file) keeping only the rows
+            for self.fund, so memory doesn't scale with the size of the file (cache/nproc aren't used).
+        partitions : dict or None
+            Already parsed master ledger files, keyed on file name (see partition_file, parsed with the same flip).
+            Their rows for self.fund are used without reading them again, and if they are read again later
+            (see refresh) only those rows are kept.
+        use_partitions : bool
+            If True, use the per-fund partitions written by write_partitions in place of the ledger files
+            (while their master files are unchanged, see cache_ledger.load_partition)
 
         Attributes
         ----------
         data : dict
             The ledger dictionary, generally keyed on account, then 'entries' and amount_types data['50000'] = {'entries': [], 'actual': 4567.8, ...}
+            The 'entries' are an EntryList of read-only mappings into self.store (see store_ledger.py)
+        store : EntryStore
+            Column storage of all of the entries
         first_date/last_date : datetime
             Earliest and latest data entries
         grand_total : dict
@@ -52,80 +313,65 @@ class Ledger():
             
         """
         print(f"Reading in ledger files: {'flipping amounts' if flip else ''}")
-        flip = -1.0 if flip else 1.0
         self.data = {}
+        self.store = store_ledger.EntryStore()
         base = settings.BaseType()
         self.first_date = base.make_date('2040/1/1')
         self.last_date = base.make_date('2000/1/1')
         self.grand_total = {}
         self.total_entries = 0
         self.report_class = {}  # File report_type classes
+        self.file_state = {}  # To check for appended rows (see refresh)
+        self.flip, self.raise_fund_error, self.cache, self.nproc = flip, raise_fund_error, cache, nproc
+        self.chunksize, self.use_partitions = chunksize, use_partitions
+        if partitions is not None:
+            self.partitioned = set(partitions)
+        elif not hasattr(self, 'partitioned'):
+            self.partitioned = set()  # Master ledger files, of which only this fund's rows are used
+        flip = -1.0 if flip else 1.0
         counters = {'overall': 0}  # out-of-fy and line counters for each file
         for key in ['columns', 'amount_types', 'date_types']:
             setattr(self, key, {})
         
         # Read in ledger files
-        for ledger_file, report_type in self.files.items():  # loop through files
-            if report_type == 'none':
+        use_files = {}
+        for ledger_file, report_type in self.files.items():
+            if report_type != 'none':
+                use_files[ledger_file] = report_type
+        if nproc > 1 and len(use_files) > 1 and chunksize is None:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=min(nproc, len(use_files))) as executor:
+                futures = {}
+                for ledger_file, report_type in use_files.items():
+                    if ledger_file not in self.partitioned:
+                        futures[ledger_file] = executor.submit(parse_file, ledger_file, report_type, flip, cache, use_partitions)
+                all_parsed = {}
+                for ledger_file, future in futures.items():
+                    all_parsed[ledger_file] = future.result()
+        else:
+            all_parsed = None
+        for ledger_file, report_type in use_files.items():  # loop through files
+            fy = ut.get_fiscal_year(ledger_file, self.fy_month)  # Will return the fiscal year if filename contains it
+            if partitions is not None and ledger_file in partitions:
+                parsed = self._use_parsed(ledger_file, report_type, (partitions[ledger_file] or {}).get(str(self.fund)))
+            elif chunksize is not None:
+                self._stream_file(ledger_file, report_type, flip, fy, counters)
+                if ledger_file in counters:
+                    counters['overall'] += counters[ledger_file]['lines']
                 continue
-            fy = ut.get_fiscal_year(ledger_file)  # Will return the fiscal year if filename contains it
-            try:
-                this_file = pd.read_csv(ledger_file)
-            except FileNotFoundError:
-                print(f"{ledger_file} does not exist.")
+            elif all_parsed is None or ledger_file not in all_parsed:
+                parsed = self._parse_file(ledger_file, report_type, flip, cache)
+            else:
+                parsed = self._use_parsed(ledger_file, report_type, all_parsed.pop(ledger_file))
+            if parsed is None:
                 continue
-            L = settings.ledger_info(report_type, this_file.columns.to_list())
-
-            # Get overall info and initialize
-            for key, value in L.reverse_map.items():  # Just in case there are multiple file types, etc
-                self.columns[key] = value
-                if key in L.amount_types:
-                    self.amount_types[key] = value
-                    if key not in self.grand_total:
-                        self.grand_total[key] = 0.0
-                if key in L.date_types:
-                    self.date_types[key] = value
-            self.report_class[ledger_file] = copy(L)
-            counters[ledger_file] = {'fy': 0, 'lines': 0}
-
-            # Loop over rows in the file
-            for row in this_file.values:
-                counters['overall'] += 1
-                counters[ledger_file]['lines'] += 1
-                this_account = L.keygen(row)
-                if this_account not in self.data:
-                    self.data[this_account] = {'entries': []}
-                    for amtt in L.amount_types:
-                        self.data[this_account][amtt] = 0.0
-                this_entry = L.init()
-                for icol, ncol in enumerate(L.columns):  # loop through columns
-                    H = L.colmap[ncol]
-                    if H['name'] in L.amount_types:
-                        this_entry[H['name']] = flip * H['func'](row[icol])
-                    else:
-                        this_entry[H['name']] = H['func'](row[icol])
-                self.data[this_account]['entries'].append(this_entry)
-                self.total_entries += 1
-                for col in L.amount_types:
-                    self.data[this_account][col] += this_entry[col]
-                    self.grand_total[col] += this_entry[col]
-                for date_type in L.date_types:
-                    if this_entry[date_type] < self.first_date:
-                        self.first_date = copy(this_entry[date_type])
-                    if this_entry[date_type] > self.last_date:
-                        self.last_date = copy(this_entry[date_type])
-
-                # A few specific checks
-                try:
-                    if str(this_entry['fund']) != str(self.fund):
-                        if raise_fund_error:
-                            raise ValueError(f"Fund {this_entry['fund']} != {self.fund}")
-                except (KeyError, TypeError):
-                    pass
-                if fy.year is not None:  # check correct fiscal year
-                    if this_entry['date'] < fy.start or this_entry['date'] > fy.stop:
-                        print(f"\t{this_entry['date'].isoformat().split('T')[0]} is not in FY{fy.year}")
-                        counters[ledger_file]['fy'] += 1
+            L, entries, accounts = parsed
+            self._set_report_class(ledger_file, L)
+            counters[ledger_file] = {'fy': 0, 'lines': len(entries)}
+            counters['overall'] += len(entries)
+            self._ingest(ledger_file, L, entries, accounts, fy, counters, raise_fund_error)
+        if cache is not None:
+            cache_ledger.evict(cache)
         if counters['overall']:
             table_data = []
             for lfile in sorted(counters):
@@ -133,92 +379,558 @@ class Ledger():
                     continue
                 table_data.append([lfile, counters[lfile]['fy'], counters[lfile]['lines']])
             print('\n' + tabulate(table_data, headers=['ledger file', 'out_of_fy', 'total']))
+            self._print_out_of_fy(counters)
             print(f"Total number of entries: {counters['overall']}")
         else:
             from datetime import datetime
             self.first_date = datetime.now().astimezone()
             self.last_date = self.first_date
 
+    def _parse_file(self, ledger_file, report_type, flip, cache=None):
+        """
+        Read and convert one ledger file (see parse_file).
+
+        Return
+        ------
+        tuple or None
+            report_class, converted entries, account keys (None if the file doesn't exist)
+
+        """
+        if ledger_file in self.partitioned:
+            partitions = partition_file(ledger_file, report_type, flip, cache) or {}
+            return self._use_parsed(ledger_file, report_type, partitions.get(str(self.fund)))
+        return self._use_parsed(ledger_file, report_type, parse_file(ledger_file, report_type, flip, cache, self.use_partitions))
+
+    def _parse_appended(self, ledger_file, report_type, flip, state, fund=None):
+        """
+        Read and convert only the rows appended to a ledger file since it had the file state (see parse_appended).
+
+        Return
+        ------
+        tuple or None
+            report_class, converted entries, account keys (None if the file wasn't just appended to)
+
+        """
+        return self._use_parsed(ledger_file, report_type, parse_appended(ledger_file, report_type, flip, state, fund))
+
+    def _stream_file(self, ledger_file, report_type, flip, fy, counters):
+        """
+        Ingest a ledger file a chunk at a time (see stream_file), keeping only the rows for self.fund.  The
+        lines counted are the rows kept, the rows of other funds are counted as skipped.
+
+        Return
+        ------
+        list
+            The per-account subtotals of each chunk
+
+        """
+        if not os.path.exists(ledger_file):
+            print(f"{ledger_file} does not exist.")
+            return []
+        counters[ledger_file] = {'fy': 0, 'lines': 0, 'skipped': 0}
+        all_subtotals = []
+        first_chunk = None
+        for L, entries, accounts, skipped, chunk in stream_file(ledger_file, report_type, flip, self.fund, self.chunksize):
+            if ledger_file not in self.report_class:
+                self._set_report_class(ledger_file, L)
+            if first_chunk is None:
+                first_chunk = chunk.iloc[:0]  # The columns and dtypes as read, for the file state
+            counters[ledger_file]['skipped'] += skipped
+            counters[ledger_file]['lines'] += len(entries)
+            subtotals = self._ingest(ledger_file, L, entries, accounts, fy, counters, self.raise_fund_error)
+            if subtotals is not None:
+                all_subtotals.append(subtotals)
+        if counters[ledger_file]['skipped']:
+            print(f"Skipped {counters[ledger_file]['skipped']} rows of other funds in {ledger_file}")
+        if first_chunk is None:
+            first_chunk = pd.read_csv(ledger_file, nrows=0)
+        self.file_state[ledger_file] = ul.get_file_state(ledger_file, first_chunk)
+        self.file_state[ledger_file]['lines'] = counters[ledger_file]['lines'] + counters[ledger_file]['skipped']
+        return all_subtotals
+
+    def _use_parsed(self, ledger_file, report_type, parsed):
+        if parsed is None:
+            return None
+        columns, entries, accounts, self.file_state[ledger_file] = parsed
+        return settings.ledger_info(report_type, columns), entries, accounts
+
+    def refresh(self):
+        """
+        Update the ledger with the rows appended to the ledger files since they were read.  The data, totals,
+        dates and budget subtotals are updated in place, so only the new rows are parsed.  If a file was changed
+        in other ways, everything is read again.
+
+        """
+        print("Refreshing ledger files")
+        flip = -1.0 if self.flip else 1.0
+        counters = {}
+        for ledger_file, report_type in self.files.items():
+            if report_type == 'none':
+                continue
+            if ledger_file not in self.file_state and self.chunksize is not None:
+                for subtotals in self._stream_file(ledger_file, report_type, flip, ut.get_fiscal_year(ledger_file, self.fy_month), counters):
+                    self._update_subtotals(subtotals)
+                continue
+            elif ledger_file not in self.file_state:
+                parsed = self._parse_file(ledger_file, report_type, flip, self.cache)
+            elif 'partition' in self.file_state[ledger_file]:  # Read from a partition (see write_partitions)
+                if cache_ledger.partition_version(ledger_file) == self.file_state[ledger_file]['partition']:
+                    continue
+                print(f"The partition of {ledger_file} changed -- reading all files.")
+                self._read_again()
+                return
+            elif os.path.getsize(ledger_file) == self.file_state[ledger_file]['size']:
+                if ul.is_unchanged(ledger_file, self.file_state[ledger_file]):
+                    continue
+                print(f"{ledger_file} was changed -- reading all files.")
+                self._read_again()
+                return
+            else:
+                keep_fund = self.chunksize is not None or ledger_file in self.partitioned
+                parsed = self._parse_appended(ledger_file, report_type, flip, self.file_state[ledger_file],
+                                              fund=self.fund if keep_fund else None)
+                if parsed is None:
+                    print(f"{ledger_file} was not just appended to -- reading all files.")
+                    self._read_again()
+                    return
+            if parsed is None:
+                continue
+            L, entries, accounts = parsed
+            self._set_report_class(ledger_file, L)
+            counters[ledger_file] = {'fy': 0, 'lines': len(entries)}
+            subtotals = self._ingest(ledger_file, L, entries, accounts, ut.get_fiscal_year(ledger_file, self.fy_month), counters, self.raise_fund_error)
+            if subtotals is not None:
+                self._update_subtotals(subtotals)
+        table_data = []
+        for lfile in sorted(counters):
+            table_data.append([lfile, counters[lfile]['fy'], counters[lfile]['lines']])
+        print('\n' + tabulate(table_data, headers=['ledger file', 'out_of_fy', 'new']))
+        self._print_out_of_fy(counters)
+        print(f"Total number of entries: {self.total_entries}")
+
+    def _print_out_of_fy(self, counters):
+        """
+        Print the number of entries of each file that are not in the file's fiscal year, by their fiscal year.
+
+        """
+        table_data = []
+        for lfile in sorted(counters):
+            if lfile == 'overall' or 'out_of_fy' not in counters[lfile]:
+                continue
+            for year, count in sorted(counters[lfile]['out_of_fy'].items()):
+                table_data.append([lfile, f"FY{counters[lfile]['fy_year']}", f"FY{year}" if year else 'no date', count])
+        if len(table_data):
+            print('\n' + tabulate(table_data, headers=['ledger file', 'file FY', 'entry FY', 'entries']))
+
+    @property
+    def fiscal_years(self):
+        """
+        Fiscal year (see utils_time.FiscalCalendar) of each entry in self.store, by row, 0 if it has no date.  It
+        is found in one pass per distinct date and kept, so only rows added since (see refresh) are done again.
+
+        """
+        done = getattr(self, '_fiscal_years', None)
+        if done is None or done[0] is not self.store:
+            done = (self.store, np.empty(0, dtype=np.int32))
+        if len(done[1]) < self.store.nrows:
+            rows = np.arange(len(done[1]), self.store.nrows)
+            if 'date' in self.store.columns:
+                years = self.fiscal_calendar.years(self.store.column('date', rows))
+            else:
+                years = np.zeros(len(rows), dtype=np.int32)
+            done = (self.store, np.concatenate([done[1], years]))
+        self._fiscal_years = done
+        return done[1]
+
+    def fiscal_year_totals(self, accounts='all'):
+        """
+        Totals of the amount_types per fiscal year of the entries (see fiscal_years).
+
+        Parameter
+        ---------
+        accounts : str or list
+            The accounts to total ('all' for all of them)
+
+        Return
+        ------
+        dict
+            Keyed on fiscal year (0 for entries without dates), then amount_type
+
+        """
+        accounts = list(self.data.keys()) if accounts == 'all' else accounts
+        rows = [self.data[account]['entries'].rows for account in accounts if account in self.data]
+        rows = np.concatenate(rows) if len(rows) else np.empty(0, dtype=np.int64)
+        years, codes = np.unique(self.fiscal_years[rows], return_inverse=True)
+        totals = {year: {} for year in years.tolist()}
+        for amtt in self.amount_types:
+            sums = np.bincount(codes.reshape(-1), weights=np.nan_to_num(self.store.column(amtt, rows)), minlength=len(years))
+            for year, amount in zip(years.tolist(), sums.tolist()):
+                totals[year][amtt] = amount
+        return totals
+
+    def _read_again(self):
+        """
+        Read all of the files again with the same settings and redo the budget subtotals.
+
+        """
+        self.read(flip=self.flip, raise_fund_error=self.raise_fund_error, cache=self.cache, nproc=self.nproc,
+                  chunksize=self.chunksize, use_partitions=self.use_partitions)
+        if getattr(self, 'budget_categories', None) is not None:
+            budget_aggregates = self.budget_aggregates
+            self.get_budget_categories(self.budget_categories)
+            self.get_budget_aggregates(budget_aggregates)
+
+    def save(self, fn):
+        """
+        Write the ledger (after read) to a ddpm ledger file, which load opens without parsing (see columnar_ledger.py).
+
+        """
+        columnar_ledger.write(fn, self)
+        print(f"Wrote {self.total_entries} entries to {fn}")
+
+    def load(self, fn, flip=False, raise_fund_error=True, cache=None, nproc=1, chunksize=None, use_partitions=False,
+             check=True):
+        """
+        Use a ddpm ledger file (see save) instead of reading the ledger files.  The arrays are memory-mapped,
+        so only what is used is read from disk.  The other parameters are as for read (and used by refresh).
+
+        Parameter
+        ---------
+        fn : str
+            Name of the ddpm ledger file
+        check : bool
+            If True, only use it if it was written from the current versions of self.files with the same flip
+
+        Return
+        ------
+        bool
+            True if loaded, False if the file doesn't exist, is out of date, of another version or for another fund
+
+        """
+        if not os.path.exists(fn) or (check and not columnar_ledger.is_current(fn, self.files, -1.0 if flip else 1.0)):
+            return False
+        header = columnar_ledger.read_header(fn)
+        if header.get('version') != columnar_ledger.VERSION:
+            print(f"{fn} is an older ledger file version -- not using it.")
+            return False
+        if str(header['fund']) != str(self.fund):
+            print(f"{fn} is for fund {header['fund']}, not {self.fund}")
+            return False
+        from datetime import datetime
+        print(f"Loading ledger from {fn}")
+        self.store, accounts = columnar_ledger.open_arrays(fn, header)
+        self.data = {}
+        for account, (rows, totals) in accounts.items():
+            self.data[account] = {'entries': store_ledger.EntryList(self.store)}
+            self.data[account]['entries'].extend_rows(rows)
+            self.data[account].update(totals)
+        self.report_class = {}
+        for ledger_file, info in header['report_class'].items():
+            self.report_class[ledger_file] = settings.ledger_info(info['report_type'], info['columns'])
+        for key in ['columns', 'amount_types', 'date_types', 'grand_total', 'total_entries', 'file_state']:
+            setattr(self, key, header['ledger'][key])
+        for key in ['first_date', 'last_date']:
+            setattr(self, key, datetime.fromtimestamp(header['ledger'][key]).astimezone())
+        self.flip, self.raise_fund_error, self.cache, self.nproc = flip, raise_fund_error, cache, nproc
+        self.chunksize, self.use_partitions = chunksize, use_partitions
+        self.partitioned = set(header['partitioned'])
+        print(f"Total number of entries: {self.total_entries}")
+        return True
+
+    def use_sqlite(self, db_file):
+        """
+        Keep the entries in a SQLite database (after read or load), so Audit.detail selects them with one
+        indexed query (see sqlite_ledger.py).  The database is written again if the ledger has changed.
+
+        Parameter
+        ---------
+        db_file : str
+            Name of the SQLite database file (':memory:' to not keep it)
+
+        """
+        from . import sqlite_ledger
+        self.db = sqlite_ledger.LedgerDB(db_file, self)
+
+    def _set_report_class(self, ledger_file, L):
+        """
+        Add the report class of a file and update the net columns/amount_types/date_types/grand_total.
+
+        """
+        for key, value in L.reverse_map.items():  # Just in case there are multiple file types, etc
+            self.columns[key] = value
+            if key in L.amount_types:
+                self.amount_types[key] = value
+                if key not in self.grand_total:
+                    self.grand_total[key] = 0.0
+            if key in L.date_types:
+                self.date_types[key] = value
+        self.report_class[ledger_file] = copy(L)
+
+    def _ingest(self, ledger_file, L, entries, accounts, fy, counters, raise_fund_error):
+        """
+        Merge the converted entries of one file into self.data, the totals and the date extrema.
+
+        Parameters
+        ----------
+        ledger_file : str
+            Name of the file the entries came from
+        L : report_class
+            The report class of the file
+        entries : pandas DataFrame
+            Converted entries (see settings_ledger.BaseType.convert)
+        accounts : pandas Series
+            The account key for each entry
+        fy : Namespace
+            Fiscal year of the file (fy.year is None if not known)
+        counters : dict
+            The out-of-fy and line counters
+        raise_fund_error : bool
+            If True, error out if fund numbers don't match
+
+        """
+        if not len(entries):
+            return None
+        if 'fund' in entries.columns and raise_fund_error:  # A few specific checks
+            wrong_fund = entries['fund'].map(str) != str(self.fund)
+            if wrong_fund.any():
+                raise ValueError(f"Fund {entries['fund'][wrong_fund].iloc[0]} != {self.fund}")
+        for date_type in L.date_types:
+            this_first, this_last = min(entries[date_type]), max(entries[date_type])
+            if this_first < self.first_date:
+                self.first_date = copy(this_first)
+            if this_last > self.last_date:
+                self.last_date = copy(this_last)
+        if fy.year is not None and 'date' in L.date_types:  # check correct fiscal year
+            entry_fy = self.fiscal_calendar.years(entries['date'].to_numpy())
+            out_of_fy = entry_fy != fy.year
+            counters[ledger_file]['fy'] += int(out_of_fy.sum())
+            counters[ledger_file]['fy_year'] = fy.year
+            years, counts = np.unique(entry_fy[out_of_fy], return_counts=True)
+            for year, count in zip(years.tolist(), counts.tolist()):
+                by_year = counters[ledger_file].setdefault('out_of_fy', {})
+                by_year[year] = by_year.get(year, 0) + count
+
+        start = self.store.append(entries, L.amount_types)
+        codes, these_accounts = pd.factorize(accounts)  # In order of first appearance
+        order = start + np.argsort(codes, kind='stable')  # Row numbers grouped by account
+        counts = np.bincount(codes, minlength=len(these_accounts))
+        stops = np.cumsum(counts)
+        for account, count, stop in zip(these_accounts.tolist(), counts.tolist(), stops.tolist()):
+            if account not in self.data:
+                self.data[account] = {'entries': store_ledger.EntryList(self.store)}
+                for amtt in L.amount_types:
+                    self.data[account][amtt] = 0.0
+            self.data[account]['entries'].extend_rows(order[stop - count:stop])
+        self.total_entries += len(entries)
+        amounts = entries[L.amount_types]
+        subtotals = amounts.groupby(accounts.to_numpy(), sort=False).sum()
+        missing = amounts.isna()
+        if missing.to_numpy().any():  # An empty amount makes the totals NaN, as adding entry by entry does
+            subtotals = subtotals.mask(missing.groupby(accounts.to_numpy(), sort=False).any())
+        for account, these in subtotals.iterrows():
+            for col in L.amount_types:
+                self.data[account][col] += float(these[col])
+        for col in L.amount_types:
+            self.grand_total[col] += float(entries[col].sum(skipna=False))
+        return subtotals
+
+    def _update_subtotals(self, subtotals):
+        """
+        Add the per-account subtotals of newly ingested entries to the budget category/aggregate subtotals.
+        Only the rows of the changed accounts are touched (plus the aggregates).
+
+        """
+        if not hasattr(self, 'budget_categories') or self.budget_categories is None:
+            return
+        for amtt in subtotals.columns:
+            if amtt not in self.subtotal_amounts:
+                self.subtotal_amounts.append(amtt)
+                self.subtotal_matrix = np.hstack([self.subtotal_matrix, np.zeros((len(self.subtotal_rows), 1))])
+        amounts = subtotals.reindex(columns=self.subtotal_amounts, fill_value=0.0).to_numpy(dtype=float)
+        self._add_to_subtotals(subtotals.index.tolist(), amounts)
+        self._sum_aggregates()
+        self._set_subtotals()
+
+    def _add_to_subtotals(self, accounts, amounts):
+        """
+        Add the amounts (array of accounts x subtotal_amounts) to the subtotal rows of each account, putting
+        accounts not in a budget category into not_included.
+
+        """
+        not_included = self.subtotal_index['not_included']
+        rows, which = [], []
+        for n, account in enumerate(accounts):
+            these = self.category_index.get(account)
+            if these is None:
+                these = self.category_index[account] = [not_included]
+                self.budget_categories['not_included'].append(account)
+            rows += these
+            which += [n] * len(these)
+        if len(rows):
+            np.add.at(self.subtotal_matrix, np.array(rows), amounts[which])
+
+    def _sum_aggregates(self):
+        """
+        Set the budget aggregate rows of the subtotal matrix from the rows they are made of.
+
+        """
+        if getattr(self, 'budget_aggregates', None) is None:
+            return
+        for this_agg, these_cats in self.budget_aggregates.items():
+            these_rows = [self.subtotal_index[cmp] for cmp in these_cats]
+            self.subtotal_matrix[self.subtotal_index[this_agg]] = self.subtotal_matrix[these_rows].sum(axis=0)
+
+    def _set_subtotals(self):
+        self.subtotals = {}
+        for this_row, amounts in zip(self.subtotal_rows, self.subtotal_matrix.tolist()):
+            self.subtotals[this_row] = dict(zip(self.subtotal_amounts, amounts))
+
     def patrol(self, etype='equivalent', report_type='calanswers'):
         """
         Check for entries with same content.  Ad hoc for gift letters...
 
+        Each entry is hashed once on the fields compared by etype (see settings_ledger.BaseType.eq_fields) and
+        the entries of all accounts are grouped by them in one pass, rather than comparing every pair of entries.
+        busted has the same groups (and each entry as many times) as the pairwise comparison gave.
+
         """
         print("Assuming calanswers.")
         print(f"Using {etype} - generating attribute busted")
         print("Checking actual")
         L = settings.ledger_info(report_type, ['Account - Desc'])
+        fields = L.eq_fields(etype)
+        names = [L.colmap[fld]['name'] for fld in fields]
         ctr = 0
         self.busted = {}
-        for account in self.data:
-            for n1 in range(len(self.data[account]['entries'])):
-                for n2 in range(len(self.data[account]['entries'])):
-                    if n1 == n2:
-                        continue
-                    eq = getattr(L, etype)(self.data[account]['entries'][n1], self.data[account]['entries'][n2])
-                    if eq:
-                        self.busted.setdefault(eq, [])
-                        if abs(self.data[account]['entries'][n1]['actual']) > 0.0:
-                            #self.busted[eq].append(self.data[account]['entries'][n1])
-                            en = self.data[account]['entries'][n1]
-                            self.busted[eq].append([en['fund'], en['date'].strftime('%Y-%m-%d'), en['actual']])
-                        if abs(self.data[account]['entries'][n2]['actual']) > 0.0:
-                            #self.busted[eq].append(self.data[account]['entries'][n2])
-                            en = self.data[account]['entries'][n2]
-                            self.busted[eq].append([en['fund'], en['date'].strftime('%Y-%m-%d'), en['actual']])
-                        ctr += 1
+        frames = []
+        for account, this_account in self.data.items():
+            if not len(this_account['entries']):
+                continue
+            frame = pd.DataFrame({name: self._entry_column(this_account['entries'], name) for name in names})
+            frame['_account'] = account
+            frame['_n'] = np.arange(len(frame))
+            frames.append(frame)
+        if not len(frames):
+            return
+        keys = names + ['_account']
+        everything = pd.concat(frames, ignore_index=True)
+        duplicated = everything[everything.duplicated(subset=keys, keep=False)]
+        for _k, group in duplicated.groupby(keys, sort=False, dropna=False):
+            entries = self.data[group['_account'].iloc[0]]['entries']
+            members = [entries[n] for n in group['_n'].tolist()]
+            eq = L.ehash(fields, members[0])
+            found = [[en['fund'], en['date'].strftime('%Y-%m-%d'), en['actual']] if abs(en['actual']) > 0.0 else None
+                     for en in members]
+            self.busted.setdefault(eq, [])
+            for n1 in range(len(members)):
+                for n2 in range(len(members)):
+                    if n1 != n2:
+                        self.busted[eq] += [x for x in (found[n1], found[n2]) if x is not None]
+            ctr += len(members) * (len(members) - 1)
         if len(self.busted):
             print(f"{ctr} are {etype}")
 
-    def intellicull(self, report_type='calanswers'):
+    def _entry_column(self, entries, key, func=None):
+        """
+        Return an array of the values of key for entries (an EntryList or a list of entries), with func applied if supplied.
+        """
+        if isinstance(entries, store_ledger.EntryList):
+            return entries.column(key, func)
+        values = np.empty(len(entries), dtype=object)
+        values[:] = [entry[key] if func is None else func(entry[key]) for entry in entries]
+        return values
+
+    def intellicull(self, report_type='calanswers', keep=None, report=None):
         """
         Poll to cull entries.  Ad hoc for gift letters...part deux
-        
+
+        The entries of each account are grouped by the amount of actual in cents (less than $1 are dropped)
+        and for the groups with more than one entry the ones to keep are either asked for or set by keep.
+
+        Parameters
+        ----------
+        report_type : str
+            Report type to assume
+        keep : str or None
+            Keep policy for the groups without prompting:  'first' (the first entry), 'all' or 'unique' (the first
+            entry of each distinct date/docid).  If None, asks for each group.
+        report : str or None
+            Name of csv file to write the cull report to (one line per entry in a group or dropped)
+
         """
         print("INTELLICULL:  Assuming calanswers.")
         print("Checking actual")
         L = settings.ledger_info(report_type, ['Account - Desc'])
+        if keep not in [None, 'first', 'all', 'unique']:
+            raise ValueError(f"Invalid intellicull keep policy:  {keep}")
         dctr = 0
-        poll = {}
-        for account in self.data:
-            poll[account] = {}
-            for entry in self.data[account]['entries']:
-                dctr += 1
-                actual_int = int(abs(entry['actual'] * 100))
-                if actual_int < 100:  # Ignore less than $1
-                    continue
-                poll[account].setdefault(actual_int, [])
-                poll[account][actual_int].append(copy(entry))
-        keep = {}
+        kept = 0
+        culled = []
         breaking = False
+        data = self.data
         self.data = {}
-        for account in poll:
-            keep[account] = {}
-            self.data[account] = {'entries': []}
-            for actin in poll[account]:
-                if len(poll[account][actin]) == 1:
-                    keep[account][actin] = [0]
-                else:
-                    for i, entry in enumerate(poll[account][actin]):
+        for account, this_account in data.items():
+            entries = this_account['entries']
+            dctr += len(entries)
+            cents = (np.abs(self._entry_column(entries, 'actual').astype(float)) * 100).astype(np.int64)
+            ignored = np.flatnonzero(cents < 100)  # Ignore less than $1
+            use = np.flatnonzero(cents >= 100)
+            codes, uniques = pd.factorize(cents[use])
+            order = use[np.argsort(codes, kind='stable')]  # Grouped by amount, in order of first appearance
+            sizes = np.bincount(codes, minlength=len(uniques))
+            starts = np.cumsum(sizes) - sizes
+            if keep is None:
+                keeping = []
+                for start, size in zip(starts.tolist(), sizes.tolist()):
+                    if size == 1:
+                        keeping.append(order[start:start+1])
+                        continue
+                    for i, n in enumerate(order[start:start+size].tolist()):
+                        entry = entries[n]
                         print(f"{i}:  {entry['fund']}: {entry['account']}, {entry['date'].strftime('%Y-%m-%d')}, {entry['description']} {entry['detailed_description']} -- {entry['actual']}")
                     ask = input("Which to keep: ")
                     if ask == 'x':  # None
-                        keep[account][actin] = []
+                        keeping.append(order[start:start])
                     elif ask == 'a':  # all
-                        keep[account][actin] = list(range(len(poll[account][actin])))
+                        keeping.append(order[start:start+size])
                     elif ask == 'b':  # break
                         breaking = True
                         break
                     else:  # csv
-                        keep[account][actin] = [int(i) for i in ask.split(',')]
+                        keeping.append(order[start:start+size][[int(i) for i in ask.split(',')]])
+                keeping = np.concatenate(keeping) if len(keeping) else np.empty(0, dtype=np.int64)
+            elif keep == 'all':
+                keeping = order
+            else:
+                if keep == 'first':
+                    keeping = np.zeros(len(order), dtype=bool)
+                else:
+                    keeping = ~pd.DataFrame({'group': np.repeat(np.arange(len(sizes)), sizes),
+                                             'date': self._entry_column(entries, 'date')[order],
+                                             'docid': self._entry_column(entries, 'docid')[order]}).duplicated().to_numpy()
+                keeping[starts] = True
+                keeping = order[keeping]
+            if isinstance(entries, store_ledger.EntryList):
+                self.data[account] = {'entries': store_ledger.EntryList(self.store)}
+                self.data[account]['entries'].extend_rows(entries.rows[keeping])
+            else:
+                self.data[account] = {'entries': [entries[n] for n in keeping.tolist()]}
+            kept += len(keeping)
+            if report:
+                is_kept = np.zeros(len(entries), dtype=bool)
+                is_kept[keeping] = True
+                in_group = np.zeros(len(entries), dtype=bool)
+                in_group[order] = np.repeat(sizes, sizes) > 1
+                for n in np.concatenate([order[in_group[order]], ignored]).tolist():
+                    entry = entries[n]
+                    action = 'keep' if is_kept[n] else ('cull' if cents[n] >= 100 else 'ignore')
+                    culled.append([account, int(cents[n]), action, entry['fund'], entry['date'].strftime('%Y-%m-%d'),
+                                   entry['docid'], entry['description'], entry['actual']])
             if breaking:
                 break
-        for account in keep:
-            for actin in keep[account]:
-                for keeping in keep[account][actin]:
-                    self.data[account]['entries'].append(poll[account][actin][keeping])
-
-        #print(f"poll count {pctr}")
+        print(f"Kept {kept} of {dctr} entries")
+        if report:
+            ul.write_to_csv(report, culled, header=['account', 'cents', 'action', 'fund', 'date', 'docid', 'description', 'actual'])
 
     def get_file_header(self):
         """
@@ -241,13 +953,23 @@ class Ledger():
         Returns a sum of the supplied amounts (types) for given cat.
 
         """
-        tot = 0.0
-        for amt in amounts:
-            if cat == 'grand':
-                tot += self.grand_total[amt]
-            else:
-                tot += self.subtotals[cat][amt]
-        return tot
+        return float(self.totals([cat], amounts)[0])
+
+    def totals(self, cats, amounts):
+        """
+        Returns an array of the sums of the supplied amounts (types) for each of cats ('grand' for the grand total).
+
+        """
+        totals = np.zeros(len(cats))
+        grand = [n for n, cat in enumerate(cats) if cat == 'grand']
+        if len(grand):
+            totals[grand] = sum([self.grand_total[amt] for amt in amounts])
+        others = [n for n, cat in enumerate(cats) if cat != 'grand']
+        if len(others):
+            rows = [self.subtotal_index[cats[n]] for n in others]
+            cols = [self.subtotal_amounts.index(amt) for amt in amounts]
+            totals[others] = self.subtotal_matrix[np.ix_(rows, cols)].sum(axis=1)
+        return totals
 
     def _get_update_prompt(self, entry):
         show = []
@@ -256,20 +978,30 @@ class Ledger():
                 show.append(str(entry[col]))
         return '| '.join(show) + ':  '
 
-    def update_account(self, accounts='all', shortcuts={}):
+    def update_account(self, accounts='all', shortcuts={}, rules=None, csvout='updated.csv'):
         """
         Go through ledger.data and change the key (account) if desired.
 
+        Entries that match one of the rules get its account in one pass, and only the rest are asked for.
+
         Parameter
         ---------
         accounts : str, list
             Accounts to show for update
         shortcuts : dict or None
             Shortcuts to apply.
+        rules : str, dict or None
+            Rules to apply (yaml file name or dict, see rules_ledger) -- its shortcuts are added to shortcuts
+        csvout : str
+            Name of csv file to write if updated
+
+        Attribute
+        ---------
+        updated : dict
+            Keyed on the new account, with the 'entries' and their new 'account' (the key if checked for update)
 
         """
-        import csv, yaml
-        from datetime import datetime
+        import yaml
         self.updated = {}
         if accounts == 'all':
             accounts = None
@@ -278,19 +1010,29 @@ class Ledger():
         if isinstance(shortcuts, str):
             with open(shortcuts, 'r') as fp:
                 shortcuts = yaml.safe_load(fp)
+        rules = rules_ledger.Rules(rules)
+        shortcuts = {**rules.shortcuts, **(shortcuts or {})}
         if len(shortcuts):
             print("Using shortcuts:")
             for sc, cat in shortcuts.items():
                 print(f"\t{sc} -> {cat}")
         ctr = 0
+        matched_ctr = 0
         asking = True
         self.get_file_header()
         print("Use <RET> for current or '-9' to stop updating the rest.")
-        for account in self.data:
-            if accounts is None or account in accounts:  # Check for update
-                for entry in self.data[account]['entries']:
-                    use_entry = copy(entry)
-                    key = input(self._get_update_prompt(use_entry)) if asking else account
+        new_accounts = {}
+        for account, this_account in self.data.items():
+            entries = this_account['entries']
+            keys = np.full(len(entries), account, dtype=object)
+            relabel = accounts is None or account in accounts
+            if relabel:  # Check for update
+                matched = rules.apply(lambda key: self._entry_column(entries, key), len(entries))
+                found = matched != ''
+                keys[found] = matched[found]
+                matched_ctr += int(found.sum())
+                for n in np.flatnonzero(~found).tolist():
+                    key = input(self._get_update_prompt(entries[n])) if asking else account
                     if key == '-9':
                         print("Using existing account for the rest!")
                         key = account
@@ -299,34 +1041,91 @@ class Ledger():
                         key = account
                     elif key in shortcuts:
                         key = shortcuts[key]
-                    if key != account:
-                        ctr += 1
-                    self.updated.setdefault(key, {})
-                    self.updated[key].setdefault('entries', [])
-                    use_entry.update({'account': key})
-                    self.updated[key]['entries'].append(use_entry)
-            else:  # Copy over
-                self.updated.setdefault(account, {})
-                self.updated[account].setdefault('entries', [])
-                for entry in self.data[account]['entries']:
-                    self.updated[account]['entries'].append(copy(entry))
+                    keys[n] = key
+                ctr += int((keys != account).sum())
+            codes, uniques = pd.factorize(keys)
+            order = np.argsort(codes, kind='stable')
+            for key, these in zip(uniques.tolist(), np.split(order, np.cumsum(np.bincount(codes))[:-1])):
+                account_col = np.full(len(these), key, dtype=object) if relabel else self._entry_column(entries, 'account')[these]
+                new_accounts.setdefault(key, []).append((entries, these, account_col))
+        for key, parts in new_accounts.items():
+            if all([isinstance(entries, store_ledger.EntryList) for entries, _t, _a in parts]):
+                self.updated[key] = {'entries': store_ledger.EntryList(self.store)}
+                for entries, these, _a in parts:
+                    self.updated[key]['entries'].extend_rows(entries.rows[these])
+            else:
+                self.updated[key] = {'entries': [entries[n] for entries, these, _a in parts for n in these.tolist()]}
+            self.updated[key]['account'] = np.concatenate([account_col for _e, _t, account_col in parts])
+        if len(rules.rules):
+            print(f"{matched_ctr} entries matched rules.")
         if ctr:
-            print(f"Made {ctr} updates -- writing 'updated.csv'.")
-            with open('updated.csv', 'w') as fp:
-                writer = csv.writer(fp)
-                writer.writerow(self.file_header)
-                for account, entries in self.updated.items():
-                    for entry in entries['entries']:
-                        this_row = []
-                        for col in self.columns:
-                            this_one = entry[col]
-                            if isinstance(this_one, datetime):
-                                this_one = this_one.strftime('%m/%d/%Y')
-                            this_row.append(this_one)
-                        writer.writerow(this_row)
+            print(f"Made {ctr} updates -- writing '{csvout}'.")
+            self.write_updated(csvout)
         else:
             print("No updates made.")
 
+    def _entry_batches(self, accounts, batch=50000):
+        """
+        Generate the values of the entries of accounts (dict of account -> {'entries': ...}, e.g. data or updated)
+        in batches of up to batch entries, each a list of columns in the order of self.columns.  If an account
+        has an 'account' array (see update_account) it is used for that column.  Dates are written as mm/dd/YYYY.
+
+        """
+        from datetime import datetime
+
+        def date_str(x):
+            return x.strftime('%m/%d/%Y') if isinstance(x, datetime) else x
+
+        for account, this_account in accounts.items():
+            entries = this_account['entries']
+            for start in range(0, len(entries), batch):
+                stop = min(start + batch, len(entries))
+                if isinstance(entries, store_ledger.EntryList):
+                    these = entries.take(slice(start, stop))
+                else:
+                    these = entries[start:stop]
+                columns = []
+                for col in self.columns:
+                    if col == 'account' and 'account' in this_account:
+                        columns.append(this_account['account'][start:stop].tolist())
+                    else:
+                        func = date_str if col in self.date_types else None
+                        columns.append(self._entry_column(these, col, func).tolist())
+                yield columns
+
+    def write_updated(self, csvout='updated.csv'):
+        """
+        Write the updated entries (see update_account) to a csv file, streamed in batches.
+
+        """
+        import csv
+
+        with open(csvout, 'w', buffering=ul.CSV_BUFFER) as fp:
+            writer = csv.writer(fp)
+            writer.writerow(self.file_header)
+            writer.writerows(ul.iter_rows(self._entry_batches(self.updated)))
+
+    def write_csv(self, csvout='ledger.csv', accounts='all', batch=50000):
+        """
+        Write the entries of the ledger to a csv file (with the file header), streamed in batches of entries
+        so the whole table is never held in memory.
+
+        Parameters
+        ----------
+        csvout : str
+            Name of csv file
+        accounts : str or list
+            Accounts to write, 'all' for all
+        batch : int
+            Number of entries converted at a time
+
+        """
+        if accounts == 'all':
+            accounts = list(self.data.keys())
+        self.get_file_header()
+        ul.write_to_csv(csvout, ul.iter_rows(self._entry_batches({account: self.data[account] for account in accounts}, batch)),
+                        header=self.file_header)
+
     def get_budget_categories(self, budget_categories):
         """
         Budget categories are groups of account codes which get sub-totaled.
@@ -342,6 +1141,11 @@ class Ledger():
         ----------
         budget_categories : dict, None
             The budget_categories, budget_categories['staff'] = ['56789', ...]
+        category_index : dict
+            The subtotal rows (budget categories or not_included) of each account code, category_index['56789'] = [0]
+        subtotal_matrix : numpy array
+            The subtotals, with rows subtotal_rows (budget categories, not_included then aggregates)
+            and columns subtotal_amounts (the amount_types)
         subtotals : dict
             Sub-totals for the budget categories, subtotals['staff']['actual'] = 12345.6
 
@@ -350,26 +1154,20 @@ class Ledger():
         self.subtotals = {}
         if budget_categories is None:
             return
-        self.all_account_codes_in_included_categories = set()
-        for this_cat, these_codes in self.budget_categories.items():
-            self.subtotals[this_cat] = {}
-            for amtt in self.grand_total:
-                self.subtotals[this_cat][amtt] = 0.0
-            for this_code in these_codes:
-                self.all_account_codes_in_included_categories.add(this_code)
-                if this_code not in self.data:
-                    continue
-                for amtt in self.grand_total:
-                    self.subtotals[this_cat][amtt] += self.data[this_code][amtt]
-        all_account_codes_in_data = set(list(self.data.keys()))
-        not_included = list(all_account_codes_in_data - self.all_account_codes_in_included_categories)
-        self.subtotals['not_included'] = {}
-        for amtt in self.grand_total:
-            self.subtotals['not_included'][amtt] = 0.0
-        self.budget_categories['not_included'] = not_included
-        for this_code in not_included:
-            for amtt in self.grand_total:
-                self.subtotals['not_included'][amtt] += self.data[this_code][amtt]
+        self.budget_categories.setdefault('not_included', [])
+        self.budget_categories['not_included'][:] = []  # In place, since the manager also refers to it
+        self.subtotal_rows = [this_cat for this_cat in self.budget_categories if this_cat != 'not_included'] + ['not_included']
+        self.subtotal_index = {this_row: i for i, this_row in enumerate(self.subtotal_rows)}
+        self.subtotal_amounts = list(self.grand_total)
+        self.category_index = {}
+        for this_cat in self.subtotal_rows[:-1]:
+            for this_code in self.budget_categories[this_cat]:
+                self.category_index.setdefault(this_code, []).append(self.subtotal_index[this_cat])
+        self.subtotal_matrix = np.zeros((len(self.subtotal_rows), len(self.subtotal_amounts)))
+        amounts = np.array([[self.data[this_code][amtt] for amtt in self.subtotal_amounts] for this_code in self.data], dtype=float)
+        self._add_to_subtotals(list(self.data), amounts.reshape(len(self.data), len(self.subtotal_amounts)))
+        self.budget_aggregates = None
+        self._set_subtotals()
 
     def get_budget_aggregates(self, budget_aggregates):
         """
@@ -393,12 +1191,13 @@ class Ledger():
         self.budget_aggregates = budget_aggregates
         if budget_aggregates is None:
             return
-        for this_agg, these_cats in self.budget_aggregates.items():
-            self.subtotals[this_agg] = {}
-            for amtt in self.grand_total:
-                self.subtotals[this_agg][amtt] = 0.0
-                for cmp in these_cats:
-                    self.subtotals[this_agg][amtt] += self.subtotals[cmp][amtt]
+        ncat = self.subtotal_index['not_included'] + 1
+        self.subtotal_rows = self.subtotal_rows[:ncat] + list(self.budget_aggregates)
+        self.subtotal_index = {this_row: i for i, this_row in enumerate(self.subtotal_rows)}
+        self.subtotal_matrix = np.vstack([self.subtotal_matrix[:ncat],
+                                          np.zeros((len(self.subtotal_rows) - ncat, len(self.subtotal_amounts)))])
+        self._sum_aggregates()
+        self._set_subtotals()
 
 class Budget:
     def __init__(self, data, key='budget'):
@@ -433,27 +1232,29 @@ class Budget:
         self.categories = {}  # These are the budget categories (not aggregated as below)
         self.aggregates = {}  # These are aggregates of other budget categories
         self.grand_total = 0.0
+        depends_on = {}
         for this_cat, amt in self.budget.items():
-            nval = amt
-            if isinstance(amt, str):
-                if amt[0] == '+':  # An aggregate
-                    self.aggregates[this_cat] = amt.strip('+').split('+')
-                    continue
-                elif amt[0] == '=':  # Total from key amt
-                    nval = ul.sumup(data[amt[1:]])
-                else:
-                    nval = eval(amt)
-            self.categories[this_cat] = this_cat  # Just point to itself to make a dict
+            if isinstance(amt, str) and amt[0] == '+':  # An aggregate
+                self.aggregates[this_cat] = amt.strip('+').split('+')
+            else:
+                self.categories[this_cat] = this_cat  # Just point to itself to make a dict
+            depends_on[this_cat] = self.aggregates.get(this_cat, [])
+        for this_cat in ul.dependency_order(depends_on):  # Each after what it is made of
+            amt = self.budget[this_cat]
+            if this_cat in self.aggregates:
+                nval = 0.0
+                for cmp in self.aggregates[this_cat]:
+                    nval += self.budget[cmp]
+            elif isinstance(amt, str) and amt[0] == '=':  # Total from key amt
+                nval = ul.sumup(data[amt[1:]])
+            else:
+                nval = ul.evaluate(amt)
             self.budget[this_cat] = nval
-            try:
-                self.grand_total += nval
-            except ValueError:
-                print(nval)
-                continue
-        for this_cat, cmps in self.aggregates.items():
-            self.budget[this_cat] = 0.0
-            for cmp in cmps:
-                self.budget[this_cat] += self.budget[cmp]
+            if this_cat in self.categories:
+                try:
+                    self.grand_total += nval
+                except ValueError:
+                    print(nval)
 
     def add_rate(self, cat, keys, rate=0.605, offset=0.0):
         amt = self.totalit(keys) + offset
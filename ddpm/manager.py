@@ -5,13 +5,22 @@ This provides the overall analysis for budget and ledger.  The input yaml define
 import yaml
 from . import utils_ledger as ul
 from . import utils_time as ut
-from . import plots_ledger as plot
 from . import project, components, ledger, account_code_list, reports_ledger, audit
 from tabulate import tabulate
 from datetime import datetime, timedelta
 from dateutil.parser import parse
 
 
+def __getattr__(name):
+    """
+    plot (plots_ledger, and so matplotlib) is only imported when used, so headless runs never load it.
+    """
+    if name == 'plot':
+        from . import plots_ledger
+        return plots_ledger
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 class Manager:
     def __init__(self, yaml_file):
         """
@@ -32,6 +41,21 @@ class Manager:
             Generated name of project
         flip : str
             Flag to flip values in ledger
+        cache : str or None
+            Directory to use to cache the parsed ledger files
+        nproc : int
+            Number of processes to use to read the ledger files
+        chunksize : int or None
+            If not None, stream the ledger files in chunks of that many lines (keeping only this fund)
+        ledger_file : str or None
+            If not None, a ddpm ledger file used in place of reading the ledger files while they are unchanged
+            (and written when they are read, see ledger.Ledger.save/load)
+        sqlite : str or None
+            If not None, a SQLite database of the ledger entries used to filter them (see ledger.Ledger.use_sqlite)
+        fy_month : int
+            First month of the fiscal year (default 7)
+        use_partitions : bool
+            If True, use the per-fund partitions of master ledger files (see ledger.write_partitions)
         chart_amounts : list or None
             If list, use those amount_types in plots etc
         ledger, budget, project : None
@@ -43,12 +67,19 @@ class Manager:
             self.yaml_data = yaml.safe_load(fp)
         self.name = f"{self.yaml_data['name']} - {self.yaml_data['fund']}"
         self.flip = self.yaml_data['flip'] if 'flip' in self.yaml_data else False
+        self.cache = self.yaml_data['cache'] if 'cache' in self.yaml_data else None
+        self.nproc = self.yaml_data['nproc'] if 'nproc' in self.yaml_data else 1
+        self.chunksize = self.yaml_data['chunksize'] if 'chunksize' in self.yaml_data else None
+        self.ledger_file = self.yaml_data['ledger_file'] if 'ledger_file' in self.yaml_data else None
+        self.sqlite = self.yaml_data['sqlite'] if 'sqlite' in self.yaml_data else None
+        self.fy_month = self.yaml_data['fy_month'] if 'fy_month' in self.yaml_data else 7
+        self.use_partitions = self.yaml_data['use_partitions'] if 'use_partitions' in self.yaml_data else False
         self.chart_amounts = ul.get_amount_list(self.yaml_data['chart_amounts']) if 'chart_amounts' in self.yaml_data else None
         self.ledger = None
         self.budget = None
         self.project = None
 
-    def get_finance(self, file_list, raise_fund_error=True):
+    def get_finance(self, file_list, raise_fund_error=True, partitions=None):
         """
         Read in the ledger and the budget and transfer budget categories to ledger.
 
@@ -56,6 +87,8 @@ class Manager:
         ---------
         file_list : str, list
             key to use from the Yaml file for budget is str, else list of filenames
+        partitions : dict or None
+            Already parsed master ledger files to take this fund's rows from (see ledger.partition_file)
 
         Attributes
         ----------
@@ -74,8 +107,15 @@ class Manager:
         if file_list is None:
             return
         use_files = file_list if isinstance(file_list, list) else self.yaml_data[file_list]
-        self.ledger = ledger.Ledger(self.yaml_data['fund'], use_files)  #start a ledger
-        self.ledger.read(flip=self.flip, raise_fund_error=raise_fund_error)  # read data for the ledger
+        self.ledger = ledger.Ledger(self.yaml_data['fund'], use_files, fy_month=self.fy_month)  #start a ledger
+        read_settings = dict(flip=self.flip, raise_fund_error=raise_fund_error, cache=self.cache, nproc=self.nproc,
+                             chunksize=self.chunksize, use_partitions=self.use_partitions)
+        if self.ledger_file is None or not self.ledger.load(self.ledger_file, **read_settings):
+            self.ledger.read(partitions=partitions, **read_settings)  # read data for the ledger
+            if self.ledger_file is not None:
+                self.ledger.save(self.ledger_file)
+        if self.sqlite is not None:
+            self.ledger.use_sqlite(self.sqlite)
         self.ledger.get_budget_categories(self.budget.categories)  # subtotal the ledger into budget categories
         self.ledger.get_budget_aggregates(self.budget.aggregates)  # add the budget category aggregates from sponsor to ledger
         self.budget.categories['not_included'] = self.ledger.budget_categories['not_included']  # Copy over after setting ledger categories
@@ -144,19 +184,22 @@ class Manager:
             self.project.add(ledger_latest, attrname='ledger_latest')
         self.project.postproc()
 
-    def _can_skip(self, cat, amounts):
-        if abs(self.budget.budget[cat]) < 1.0 and abs(self.ledger.totaling(cat, amounts)) < 1.0:
+    def _can_skip(self, cat, amounts, ledger_total=None):
+        if ledger_total is None:
+            ledger_total = self.ledger.totaling(cat, amounts)
+        if abs(self.budget.budget[cat]) < 1.0 and abs(ledger_total) < 1.0:
             if cat != 'not_included':
                 print(f"Skipping {cat}-{'+'.join(amounts)} since no budget or expenditure")
             return True
         return False
 
     def _make_dash_fig(self, figname, use, amounts, save_it=False):
+        from . import plots_ledger as plot
         if len(use):
             plot.plt.figure(figname)
             bamts = [self.budget.budget[ca] for ca in use]
             plot.chart(use, bamts, label='Budget', width=0.7)
-            lamts = [self.ledger.totaling(ca, amounts) for ca in use]
+            lamts = self.ledger.totals(use, amounts).tolist()
             plot.chart(use, lamts, label='Ledger', width=0.4)
             plot.plt.legend()
             plot.plt.grid()
@@ -201,10 +244,11 @@ class Manager:
         use = {}
         for catype, catagg in zip(['cat', 'agg'], [categories, aggregates]):
             use[catype] = []
-            for ca in catagg:
-                if not self._can_skip(ca, amounts):
+            ledger_totals = self.ledger.totals(catagg, amounts).tolist()
+            for ca, ledger_total in zip(catagg, ledger_totals):
+                if not self._can_skip(ca, amounts, ledger_total):
                     use[catype].append(ca)
-                    bal = self.budget.budget[ca] - self.ledger.totaling(ca, amounts)
+                    bal = self.budget.budget[ca] - ledger_total
                     data = [self.budget.budget[ca], bal] + [self.ledger.subtotals[ca][x] for x in self.ledger.amount_types]
                     self.table_data.append([ca] + [ul.print_money(x) for x in data])
         grand_bal = self.budget.grand_total - self.ledger.totaling('grand', amounts)
@@ -253,7 +297,7 @@ class Manager:
     def show_files(self):
         ul.show_ledger_files(self.ledger)
 
-    def start_audit(self, file_list='files', raise_fund_error=True):
+    def start_audit(self, file_list='files', raise_fund_error=True, partitions=None):
         """
         Parameters
         ----------
@@ -261,9 +305,11 @@ class Manager:
             key to use for list of files to use
         amount_types : list
             list of amount_types to use in the audit
+        partitions : dict or None
+            Already parsed master ledger files (see get_finance)
 
         """
-        self.get_finance(file_list=file_list, raise_fund_error=raise_fund_error)
+        self.get_finance(file_list=file_list, raise_fund_error=raise_fund_error, partitions=partitions)
         self.audit = audit.Audit(self.ledger, chart_amounts=self.chart_amounts)
 
 
@@ -320,6 +366,57 @@ class Portfolio:
                         elif line.startswith('\\author'):
                             self.portfolio[fundno]['date_range'] = line.strip().strip('%').strip('}')[8:].replace('{', '').replace('}', '')
 
+    def read_ledgers(self, master_files, report_type='calanswers', yaml_file=None, file_list='files'):
+        """
+        Read the ledger of each fund directory from master ledger files (with all of the funds), so each master
+        file is parsed only once (see ledger.partition_file) rather than once per fund.
+
+        Parameters
+        ----------
+        master_files : list
+            Names of the master ledger files, used in place of the fund's ledger files of the same name
+        report_type : str
+            Report type of the master ledger files
+        yaml_file : str or None
+            Name of the yaml file in each fund directory, if None the .yaml file there (if only one)
+        file_list : str
+            Yaml key of the ledger files (see Manager.get_finance)
+
+        Attributes
+        ----------
+        managers : dict
+            The Manager of each fund directory read, keyed on fund number
+
+        """
+        master_files = {ul.os.path.basename(fn): ul.os.path.abspath(fn) for fn in master_files}
+        parsed = {}  # Keyed on master file and flip
+        self.managers = {}
+        table_data = []
+        cwd = ul.os.getcwd()
+        for fundno, fund_dir in ul.get_fund_directories(self.path).items():
+            yamls = [yaml_file] if yaml_file is not None else [x for x in ul.os.listdir(fund_dir) if x.endswith('.yaml')]
+            if len(yamls) != 1 or not ul.os.path.exists(ul.os.path.join(fund_dir, yamls[0])):
+                print(f"Skipping {fund_dir}:  no single yaml file")
+                continue
+            ul.os.chdir(fund_dir)  # The ledger files of the yaml are relative to its directory
+            try:
+                mgr = Manager(yamls[0])
+                flip = -1.0 if mgr.flip else 1.0
+                partitions = {}
+                for ledger_file in mgr.yaml_data[file_list]:
+                    master_file = master_files.get(ul.os.path.basename(ledger_file))
+                    if master_file is None:
+                        continue
+                    if (master_file, flip) not in parsed:
+                        parsed[(master_file, flip)] = ledger.partition_file(master_file, report_type, flip)
+                    partitions[ledger_file] = parsed[(master_file, flip)]
+                mgr.get_finance(file_list, partitions=partitions)
+            finally:
+                ul.os.chdir(cwd)
+            self.managers[fundno] = mgr
+            table_data.append([fundno, mgr.ledger.total_entries] + [mgr.ledger.grand_total.get(x, 0.0) for x in ['budget', 'actual', 'encumbrance']])
+        print('\n' + tabulate(table_data, headers=['fund', 'entries', 'budget', 'actual', 'encumbrance'], floatfmt='.2f'))
+
     def write_csv(self, fn='portfolio_#.csv'):
         """
         Write the portfolio to a csv file.
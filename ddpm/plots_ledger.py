@@ -64,6 +64,20 @@ def cumulative(cumulative, amounts):
     plt.plot(cumulative['t'], ordered_amounts, 'k')
     plt.plot(cumulative['t'], ordered_smooth, 'b', lw=2)
 
+def rates(cumulative, mean_rate, span, amounts):
+    """
+    Plot the daily rates (diff_<amount_type>) of the smoothed cumulative data and their means over span (see
+    audit.Audit.smooth_cumulative_rates).
+
+    """
+    plt.figure("DIFF RATES")
+    ilo, ihi = span
+    for amtt in amounts:
+        dikey = f"diff_{amtt}"
+        plt.plot(cumulative['t'], cumulative[dikey], label=dikey)
+        plt.plot([cumulative['t'][ilo], cumulative['t'][ihi]], [mean_rate[amtt], mean_rate[amtt]], lw=4, label=f"mean {dikey}")
+    plt.legend()
+
 def pie(budget, keys=None, autopct='%.0f%%', ax=None):
     """
     Parameters:
@@ -99,13 +99,13 @@ class Gantt:
         if self.extrema.min.day < 10:
             first_day = datetime.datetime(year=self.extrema.min.year, month=self.extrema.min.month, day=1).replace(tzinfo=self.timezone)
             ax.plot([first_day, first_day], [-10, ybound], '--', lw=2, color=color)
-        this_day = (ut.last_day_of_month(self.extrema.min, return_datetime=True) + datetime.timedelta(days=1)).replace(tzinfo=self.timezone)
-        while this_day < self.extrema.max:
-            ax.plot([this_day, this_day], [-10, ybound], '--', lw=2, color=color)
-            this_day = (ut.last_day_of_month(this_day, return_datetime=True) + datetime.timedelta(days=1)).replace(tzinfo=self.timezone)
-        if self.extrema.max.day > 20:
-            this_day = (ut.last_day_of_month(self.extrema.max, return_datetime=True) + datetime.timedelta(days=1)).replace(tzinfo=self.timezone)
-            ax.plot([this_day, this_day], [-10, ybound], '--', lw=2, color=color)
+        first_month = np.datetime64(f"{self.extrema.min.year:04d}-{self.extrema.min.month:02d}", 'M')
+        last_month = np.datetime64(f"{self.extrema.max.year:04d}-{self.extrema.max.month:02d}", 'M')
+        months = np.arange(first_month + 1, last_month + 1 + int(self.extrema.max.day > 20))
+        for this_month in months.astype('datetime64[D]').tolist():  # First days of the months
+            this_day = datetime.datetime(year=this_month.year, month=this_month.month, day=1).replace(tzinfo=self.timezone)
+            if this_day < self.extrema.max or this_month.month != self.extrema.max.month:
+                ax.plot([this_day, this_day], [-10, ybound], '--', lw=2, color=color)
 
     def assign_yvals_labels(self, colinear_delimiter='\n'):
         """
@@ -1,5 +1,4 @@
 from copy import copy
-from . import plots_proj as plots
 from . import settings_proj as settings
 from . import utils_proj as utils
 from . import utils_time as ut
@@ -209,6 +208,7 @@ class Project:
         kwargs2use = copy(settings.CHART_DEFAULTS)
         kwargs2use.update(copy(kwargs))
 
+        from . import plots_proj as plots
         self.gantt = plots.Gantt(name = self.name)
         dates = []
         labels = []
@@ -275,6 +275,7 @@ class Project:
                     ctr += 1.0
             self.cdf.values.append(ctr)
         if show:
+            from . import plots_proj as plots
             plots.cumulative_graph(self.cdf.dates, self.cdf.values, len(dates))
 
     def eval_status_complete(self, status):
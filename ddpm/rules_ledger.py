@@ -0,0 +1,96 @@
+"""
+Rules to reassign the account of ledger entries (see ledger.Ledger.update_account).
+
+The rules come from a yaml file (or the same as a dict), e.g.
+
+    shortcuts:  # Answers to expand at the update prompt
+      g: groceries
+    rules:  # In order -- the first rule that matches an entry is used
+      - account: groceries
+        keywords: [trader joe, safeway]  # Anywhere in the field, any case
+      - account: utilities
+        exact: [PGE WEB ONLINE]  # The whole field
+        regex: '^COMCAST\\b'
+        field: description  # Entry key to match (default 'description')
+
+"""
+import re
+import numpy as np
+import pandas as pd
+
+
+class Rules:
+    def __init__(self, rules=None):
+        """
+        Parameter
+        ---------
+        rules : str, dict or None
+            Name of yaml file or dict with keys 'shortcuts' and/or 'rules'
+
+        Attributes
+        ----------
+        shortcuts : dict
+            Shortcut -> account for the prompt
+        rules : list
+            The compiled rules (dicts with account, field and pattern)
+
+        """
+        self.shortcuts = {}
+        self.rules = []
+        if rules is None:
+            return
+        if isinstance(rules, str):
+            import yaml
+            with open(rules, 'r') as fp:
+                rules = yaml.safe_load(fp)
+        self.shortcuts = rules.get('shortcuts') or {}
+        for rule in rules.get('rules') or []:
+            self.add(**rule)
+
+    def add(self, account, exact=None, keywords=None, regex=None, field='description'):
+        """
+        Add a rule, compiled into one regular expression of its exact values, keywords and regex.
+
+        """
+        patterns = []
+        if exact:
+            patterns.append('^(?:' + '|'.join([re.escape(str(x)) for x in exact]) + ')$')
+        if keywords:
+            patterns.append('(?i:' + '|'.join([re.escape(str(x)) for x in keywords]) + ')')
+        if regex:
+            patterns.append(f"(?:{regex})")
+        if not len(patterns):
+            raise ValueError(f"Rule for {account} needs exact, keywords or regex.")
+        self.rules.append({'account': str(account), 'field': field, 'pattern': re.compile('|'.join(patterns))})
+
+    def apply(self, column, nrows):
+        """
+        Find the account of the first matching rule for each entry, matching each distinct value only once.
+
+        Parameters
+        ----------
+        column : callable
+            Returns the array of values of an entry key for the entries
+        nrows : int
+            Number of entries
+
+        Return
+        ------
+        numpy array
+            The account for each entry, '' if no rule matched
+
+        """
+        matched = np.full(nrows, '', dtype=object)
+        todo = np.ones(nrows, dtype=bool)
+        factorized = {}
+        for rule in self.rules:
+            if not todo.any():
+                break
+            if rule['field'] not in factorized:
+                factorized[rule['field']] = pd.factorize(column(rule['field']), use_na_sentinel=False)
+            codes, uniques = factorized[rule['field']]
+            hit = np.array([pd.notna(x) and bool(rule['pattern'].search(str(x))) for x in uniques], dtype=bool)
+            these = todo & hit[codes] if len(uniques) else np.zeros(nrows, dtype=bool)
+            matched[these] = rule['account']
+            todo &= ~these
+        return matched
@@ -1,5 +1,7 @@
-from dateutil.parser import parse
 import hashlib
+import numpy as np
+import pandas as pd
+from . import utils_time as ut
 
 
 def ledger_info(report_type, columns):
@@ -14,7 +16,12 @@ def ledger_info(report_type, columns):
         print("Consider adding to settings_ledger.py and account_code_list.py?")
         return None
 
+MONEY_TABLE = str.maketrans({'(': '-', ')': None, "'": None, '$': None, ',': None})
+
+
 class BaseType:
+    date_formats = ut.DATE_FORMATS  # Candidate formats for the date columns, in order of preference
+
     def __repr__(self):
         s = f"  {self.report_type}: key = {self.key}\n"
         for key, val in self.reverse_map.items():
@@ -35,7 +42,7 @@ class BaseType:
             return 0.0
 
     def make_date(self, x):
-        return parse(x).astimezone()
+        return ut.parse_date(x)
 
     def clean(self, x):
         return str(x).strip()
@@ -43,6 +50,91 @@ class BaseType:
     def cpliti(self, x, c, i):
         return str(x).split(c)[i].strip()
 
+    def vmake_amt(self, x):
+        """
+        Convert a column (pandas Series) of accounting formatted money to floats in one pass.
+
+        Parentheses are negative and $ , ' are removed.  Values that don't convert are 0.0 and
+        are kept in self.amount_errors for the summary (see convert).  A column may hold both numbers and
+        strings (e.g. read by pandas in chunks), so only the values that aren't already numbers are cleaned.
+        """
+        if pd.api.types.is_numeric_dtype(x):
+            return x.astype(float)
+        amt = pd.to_numeric(x, errors='coerce').astype(float)
+        redo = amt.isna() & x.notna()
+        if redo.any():
+            amt[redo] = pd.to_numeric(x[redo].astype(str).str.translate(MONEY_TABLE).str.strip(), errors='coerce')
+        failed = amt.isna() & x.notna()
+        if failed.any():
+            self.amount_errors[x.name] = x[failed].tolist()
+        return amt.where(~failed, 0.0).astype(float)
+
+    def vmake_date(self, x):
+        """
+        Convert a column of dates.  The format of the column is found once (see utils_time.detect_date_format)
+        and used for the distinct values in one pass, with dateutil only used for any values that don't match.
+        """
+        codes, uniques = pd.factorize(x, use_na_sentinel=False)
+        if x.name not in self.date_format and len(uniques):
+            is_str = pd.api.types.is_string_dtype(x) or pd.api.types.is_object_dtype(x)
+            self.date_format[x.name] = ut.detect_date_format(uniques, self.date_formats) if is_str else None
+        dates = ut.parse_dates(uniques, self.date_format.get(x.name))
+        return pd.Series(dates[codes], index=x.index, dtype=object)
+
+    def vclean(self, x):
+        return self.per_unique(x, self.clean)
+
+    def vcpliti(self, x, c, i):
+        return self.per_unique(x, lambda y: self.cpliti(y, c, i))
+
+    def per_unique(self, x, func):
+        """
+        Apply func to a column (pandas Series), converting each distinct value only once.
+        """
+        codes, uniques = pd.factorize(x, use_na_sentinel=False)
+        converted = np.empty(len(uniques), dtype=object)
+        converted[:] = [func(y) for y in uniques]
+        return pd.Series(converted[codes], index=x.index, dtype=object)
+
+    def vkeygen(self, this_file):
+        """
+        Column version of keygen -- update this in the child class along with keygen if needed.
+
+        """
+        return self.vcpliti(this_file[self.key], '-', 0)
+
+    def convert(self, this_file, flip=1.0):
+        """
+        Convert all of the columns of a file (pandas DataFrame) at once.
+
+        Parameters
+        ----------
+        this_file : pandas DataFrame
+            The file as read by pandas.read_csv
+        flip : float
+            Multiplier for the amount_types
+
+        Return
+        ------
+        pandas DataFrame
+            The converted entries, with columns in the order of self.all (missing columns are '')
+
+        """
+        entries = {}
+        for entry in self.all:
+            entries[entry] = ''
+        self.amount_errors = {}
+        for ncol in self.columns:
+            H = self.colmap[ncol]
+            if H['name'] in self.amount_types:
+                entries[H['name']] = flip * H['vfunc'](this_file[ncol])
+            else:
+                entries[H['name']] = H['vfunc'](this_file[ncol])
+        for ncol, bad in self.amount_errors.items():
+            examples = ', '.join([repr(x) for x in list(dict.fromkeys(bad))[:5]])
+            print(f"{len(bad)} amounts not successfully made in '{ncol}' -- set to 0.0 (e.g. {examples})")
+        return pd.DataFrame(entries, index=this_file.index)
+
     def init(self, seed_entry=None):
         this_entry = {}
         for entry in self.all:
@@ -54,17 +146,38 @@ class BaseType:
     def _get_all(self):
         self.all = []
         self.reverse_map = {}
+        self.date_format = {}  # Detected format of each date column
+        self.amount_errors = {}  # Values that failed vmake_amt, per column
         for key, val in self.colmap.items():
             self.all.append(val['name'])
             self.reverse_map[val['name']] = key
 
     def _eq(self, fields, e1, e2):
-        ehash = ''
         for fld in fields:
             if e1[self.colmap[fld]['name']] != e2[self.colmap[fld]['name']]:
                 return False
-            ehash += str(e1[self.colmap[fld]['name']])
-        return  hashlib.md5(ehash.encode('ascii')).hexdigest()[:8]
+        return self.ehash(fields, e1)
+
+    def ehash(self, fields, entry):
+        """
+        Short hash of the values of fields (colmap keys) for an entry, as returned by equivalent/equal.
+        """
+        ehash = ''.join([str(entry[self.colmap[fld]['name']]) for fld in fields])
+        return hashlib.md5(ehash.encode('ascii')).hexdigest()[:8]
+
+    def eq_fields(self, etype):
+        """
+        Return the fields (colmap keys) compared by etype ('equivalent' or 'equal').
+        """
+        if etype == 'equal':
+            return list(self.colmap.keys())
+        return self.equivalent_fields
+
+    def equivalent(self, e1, e2):
+        return self._eq(self.eq_fields('equivalent'), e1, e2)
+
+    def equal(self, e1, e2):
+        return self._eq(self.eq_fields('equal'), e1, e2)
 
     def keygen(self, row):
         """
@@ -81,22 +194,16 @@ class BankOfAmerica(BaseType):
         self.key = 'Account'
         self.key_index = self.columns.index(self.key)
         self.date_types = ['date']
+        self.date_formats = ['%m/%d/%Y', '%Y-%m-%d']
         self.amount_types = ['amount']
-        self.colmap = {'Date': {'name': 'date', 'func': self.make_date},
-                       'Description': {'name': 'description', 'func': self.clean},
-                       'Amount': {'name': 'amount', 'func': self.make_amt},
-                       'Account': {'name': 'account', 'func': self.clean}
+        self.colmap = {'Date': {'name': 'date', 'func': self.make_date, 'vfunc': self.vmake_date},
+                       'Description': {'name': 'description', 'func': self.clean, 'vfunc': self.vclean},
+                       'Amount': {'name': 'amount', 'func': self.make_amt, 'vfunc': self.vmake_amt},
+                       'Account': {'name': 'account', 'func': self.clean, 'vfunc': self.vclean}
                        }
+        self.equivalent_fields = ['Description', 'Account']  # Compared by equivalent (see patrol)
         self._get_all()
 
-    def equivalent(self, e1, e2):
-        fields = ['Description', 'Account']
-        return self._eq(fields, e1, e2)
-
-    def equal(self, e1, e2):
-        fields = list(self.colmap.keys())
-        return self._eq(fields, e1, e2)
-
 class Calanswers(BaseType):
     def __init__(self, report_type, columns):
         self.report_type = report_type
@@ -104,35 +211,31 @@ class Calanswers(BaseType):
         self.key = 'Account - Desc'
         self.key_index = self.columns.index(self.key)
         self.date_types = ['date']
+        self.date_formats = ['%m/%d/%Y', '%Y/%m/%d']  # As exported and as written by utils_ledger.xls2csv
         self.amount_types = ['actual', 'budget', 'encumbrance']
-        self.colmap = {'Accounting Period - Desc': {'name': 'period', 'func': self.clean},
-                       'Dept ID - Desc': {'name': 'deptid', 'func': lambda x: self.cpliti(x, '-', 0)},
-                       'Fund - Desc': {'name': 'fund', 'func': lambda x: self.cpliti(x, '-', 0)},
-                       'CF1 Code': {'name': 'cf1', 'func': self.clean},
-                       'CF2 Code': {'name': 'cf2', 'func': self.clean},
-                       'Program Code': {'name': 'program', 'func': self.clean},
-                       'Account - Desc': {'name': 'account', 'func': self.clean},
-                       'Journal Date': {'name': 'date', 'func': self.make_date},
-                       'Document ID': {'name': 'docid', 'func': self.clean},
-                       'Description': {'name': 'description', 'func': self.clean},
-                       'Detailed Description': {'name': 'detailed_description','func':  self.clean},
-                       'Reference': {'name': 'reference', 'func': self.clean},
-                       'Approver Name': {'name': 'approver', 'func': self.clean},
-                       'Preparer Name': {'name': 'preparer', 'func': self.clean},
-                       'Authorized Budget Amount': {'name': 'budget', 'func': self.make_amt},
-                       'Encumbrance Amount': {'name': 'encumbrance', 'func': self.make_amt},
-                       'Actuals Amount': {'name': 'actual','func':  self.make_amt}
+        self.colmap = {'Accounting Period - Desc': {'name': 'period', 'func': self.clean, 'vfunc': self.vclean},
+                       'Dept ID - Desc': {'name': 'deptid', 'func': lambda x: self.cpliti(x, '-', 0),
+                                          'vfunc': lambda x: self.vcpliti(x, '-', 0)},
+                       'Fund - Desc': {'name': 'fund', 'func': lambda x: self.cpliti(x, '-', 0),
+                                       'vfunc': lambda x: self.vcpliti(x, '-', 0)},
+                       'CF1 Code': {'name': 'cf1', 'func': self.clean, 'vfunc': self.vclean},
+                       'CF2 Code': {'name': 'cf2', 'func': self.clean, 'vfunc': self.vclean},
+                       'Program Code': {'name': 'program', 'func': self.clean, 'vfunc': self.vclean},
+                       'Account - Desc': {'name': 'account', 'func': self.clean, 'vfunc': self.vclean},
+                       'Journal Date': {'name': 'date', 'func': self.make_date, 'vfunc': self.vmake_date},
+                       'Document ID': {'name': 'docid', 'func': self.clean, 'vfunc': self.vclean},
+                       'Description': {'name': 'description', 'func': self.clean, 'vfunc': self.vclean},
+                       'Detailed Description': {'name': 'detailed_description','func':  self.clean, 'vfunc': self.vclean},
+                       'Reference': {'name': 'reference', 'func': self.clean, 'vfunc': self.vclean},
+                       'Approver Name': {'name': 'approver', 'func': self.clean, 'vfunc': self.vclean},
+                       'Preparer Name': {'name': 'preparer', 'func': self.clean, 'vfunc': self.vclean},
+                       'Authorized Budget Amount': {'name': 'budget', 'func': self.make_amt, 'vfunc': self.vmake_amt},
+                       'Encumbrance Amount': {'name': 'encumbrance', 'func': self.make_amt, 'vfunc': self.vmake_amt},
+                       'Actuals Amount': {'name': 'actual','func':  self.make_amt, 'vfunc': self.vmake_amt}
                        }
+        self.equivalent_fields = ['Dept ID - Desc', 'CF1 Code', 'CF2 Code', 'Program Code', 'Account - Desc',
+                                  'Document ID', 'Description', 'Detailed Description', 'Reference']
         self._get_all()
-    
-    def equivalent(self, e1, e2):
-        fields = ['Dept ID - Desc', 'CF1 Code', 'CF2 Code', 'Program Code', 'Account - Desc',
-                  'Document ID', 'Description', 'Detailed Description', 'Reference']
-        return self._eq(fields, e1, e2)
-
-    def equal(self, e1, e2):
-        fields = list(self.colmap.keys())
-        return self._eq(fields, e1, e2)
 
 class FundSummary(BaseType):
     def __init__(self, report_type, columns):
@@ -142,20 +245,14 @@ class FundSummary(BaseType):
         self.key_index = self.columns.index(self.key)
         self.amount_types = ['actual', 'encumbrance', 'remaining']
         self.date_types = []
-        self.colmap = {'Dept ID - Desc': {'name': 'deptid', 'func': self.clean},
-                       'Fund - Desc': {'name': 'fund','func': lambda x: self.cpliti(x, '-', 0)},
-                       'Account Category': {'name': 'account', 'func': self.clean},
-                       'Authorized Budget Amount': {'name': 'budget', 'func': self.make_amt},
-                       'Actuals Amount': {'name': 'actual', 'func': self.make_amt},
-                       'Encumbrance Amount': {'name': 'encumbrance', 'func': self.make_amt},
-                       'Remaining Balance': {'name': 'remaining', 'func': self.make_amt}
+        self.colmap = {'Dept ID - Desc': {'name': 'deptid', 'func': self.clean, 'vfunc': self.vclean},
+                       'Fund - Desc': {'name': 'fund','func': lambda x: self.cpliti(x, '-', 0),
+                                       'vfunc': lambda x: self.vcpliti(x, '-', 0)},
+                       'Account Category': {'name': 'account', 'func': self.clean, 'vfunc': self.vclean},
+                       'Authorized Budget Amount': {'name': 'budget', 'func': self.make_amt, 'vfunc': self.vmake_amt},
+                       'Actuals Amount': {'name': 'actual', 'func': self.make_amt, 'vfunc': self.vmake_amt},
+                       'Encumbrance Amount': {'name': 'encumbrance', 'func': self.make_amt, 'vfunc': self.vmake_amt},
+                       'Remaining Balance': {'name': 'remaining', 'func': self.make_amt, 'vfunc': self.vmake_amt}
                        }
+        self.equivalent_fields = ['Dept ID - Desc', 'Account Category']  # Compared by equivalent (see patrol)
         self._get_all()
-
-    def equivalent(self, e1, e2):
-        fields = ['Dept ID - Desc', 'Account Category']
-        return self._eq(fields, e1, e2)
-
-    def equal(self, e1, e2):
-        fields = list(self.colmap.keys())
-        return self._eq(fields, e1, e2)
\ No newline at end of file
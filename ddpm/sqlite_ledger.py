@@ -0,0 +1,176 @@
+"""
+SQLite index of the ledger entries, so that the audit.Filter settings are one indexed query (see Audit.detail).
+
+The entries table has a row per entry of the ledger accounts:  _row (row number in the ledger store),
+_account (ledger key), _pos (position in the account's entries) and a column per entry key -- amounts as
+REAL, dates as INTEGER epoch seconds and everything else as stored.  There are indexes on _account, date,
+fund and docid.  The meta table keeps a signature of the ledger it was written from, so it is written again
+when the ledger changes (e.g. refresh or intellicull).
+
+"""
+import json
+import hashlib
+import sqlite3
+from datetime import datetime
+import numpy as np
+
+
+INDEXED = ['date', 'fund', 'docid']  # Entry keys indexed if present (_account always is)
+ALL_AMOUNTS = (-1E15, 1E15)  # Amount limits of Filter.set_amount(key, 'all')
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _epoch(x):
+    return int(x.timestamp()) if isinstance(x, datetime) else None
+
+
+class LedgerDB:
+    def __init__(self, db_file, ledger):
+        """
+        Parameters
+        ----------
+        db_file : str
+            Name of the SQLite database file (':memory:' to not keep it)
+        ledger : Ledger instance
+            The (read) ledger
+
+        Attributes
+        ----------
+        Same as Parameters
+        connection : sqlite3 Connection
+        columns : list
+            The entry keys in the entries table
+
+        """
+        self.db_file = db_file
+        self.ledger = ledger
+        self.connection = sqlite3.connect(db_file)
+        self.columns = []
+        self.sync()
+
+    def signature(self):
+        """
+        Return a hash of what the entries table depends on:  the file states, flip and the number of entries per account.
+        """
+        ledger = self.ledger
+        sig = [ledger.store.nrows, ledger.flip, ledger.file_state,
+               [[account, len(this_account['entries'])] for account, this_account in ledger.data.items()]]
+        return hashlib.md5(json.dumps(sig, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def sync(self):
+        """
+        Write the entries table if it is missing or was written from a different ledger.
+        """
+        cur = self.connection.cursor()
+        cur.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        stored = dict(cur.execute("SELECT key, value FROM meta").fetchall())
+        if stored.get('signature') == self.signature():
+            self.columns = json.loads(stored['columns'])
+            return
+        self.write()
+
+    def write(self):
+        """
+        Write the entries table (and its indexes) from the ledger.
+        """
+        ledger = self.ledger
+        store = ledger.store
+        print(f"Writing ledger entries to {self.db_file}")
+        self.columns = list(store.columns)
+        rows, accounts, positions = [], [], []
+        for account, this_account in ledger.data.items():
+            entries = this_account['entries']
+            rows.append(np.asarray(entries.rows) if hasattr(entries, 'rows') else np.array([x.row for x in entries], dtype=np.int64))
+            accounts += [account] * len(entries)
+            positions.append(np.arange(len(entries)))
+        rows = np.concatenate(rows) if len(rows) else np.empty(0, dtype=np.int64)
+        positions = np.concatenate(positions) if len(positions) else np.empty(0, dtype=np.int64)
+        values = [rows.tolist(), accounts, positions.tolist()]
+        types = []
+        for key in self.columns:
+            if key in ledger.amount_types:
+                types.append('REAL')
+                values.append(store.column(key, rows).tolist())
+            elif key in ledger.date_types:
+                types.append('INTEGER')
+                values.append(store.column(key, rows, func=_epoch).tolist())
+            else:
+                types.append('')
+                values.append(store.column(key, rows).tolist())
+        cur = self.connection.cursor()
+        cur.execute("DROP TABLE IF EXISTS entries")
+        cur.execute("CREATE TABLE entries (_row INTEGER, _account TEXT, _pos INTEGER, "
+                    + ', '.join([f"{_quote(key)} {this_type}".strip() for key, this_type in zip(self.columns, types)]) + ")")
+        cur.executemany(f"INSERT INTO entries VALUES ({', '.join(['?'] * (3 + len(self.columns)))})", zip(*values))
+        cur.execute("CREATE INDEX entries__account ON entries (_account, _pos)")
+        for key in INDEXED:
+            if key in self.columns:
+                cur.execute(f"CREATE INDEX {_quote('entries_' + key)} ON entries ({_quote(key)})")
+        cur.execute("INSERT OR REPLACE INTO meta VALUES ('signature', ?)", (self.signature(),))
+        cur.execute("INSERT OR REPLACE INTO meta VALUES ('columns', ?)", (json.dumps(self.columns),))
+        self.connection.commit()
+
+    def where(self, filt, accounts):
+        """
+        Translate the Filter settings into a WHERE clause (the same selection as Filter.allow).
+
+        Parameters
+        ----------
+        filt : audit.Filter
+            The filter
+        accounts : list
+            The ledger accounts to use
+
+        Return
+        ------
+        tuple
+            str clause, list of parameters
+
+        """
+        clauses = ["_account IN (SELECT value FROM json_each(?))"]
+        params = [json.dumps(accounts)]
+        for key in filt.date['type']:
+            clauses.append(f"{_quote(key)} BETWEEN ? AND ?")
+            params += [int(filt.date['start'][key].timestamp()), int(filt.date['stop'][key].timestamp())]
+        for key in filt.amount['type']:
+            limits = (filt.amount['low'][key], filt.amount['high'][key])
+            if limits == ALL_AMOUNTS:
+                continue
+            value = f"abs({_quote(key)})" if filt.absval[key] else _quote(key)
+            clauses.append(f"({_quote(key)} IS NULL OR {value} BETWEEN ? AND ?)")  # NaN is NULL and passes Filter.allow
+            params += list(limits)
+        for key, val in filt.other.items():
+            if key not in self.columns:
+                raise KeyError(key)
+            if isinstance(val, list):
+                clauses.append(f"{_quote(key)} IN (SELECT value FROM json_each(?))")
+                params.append(json.dumps(val))
+            else:
+                clauses.append(f"{_quote(key)} = ?")
+                params.append(val)
+        return ' AND '.join(clauses), params
+
+    def select(self, filt, accounts):
+        """
+        Select the entries allowed by filt.
+
+        Return
+        ------
+        dict
+            Keyed on account, the ledger store row numbers of the selected entries (in the order of the entries)
+
+        """
+        self.sync()
+        clause, params = self.where(filt, accounts)
+        found = self.connection.execute(f"SELECT _account, _row FROM entries WHERE {clause} ORDER BY _account, _pos",
+                                        params).fetchall()
+        selected = {}
+        for account, row in found:
+            selected.setdefault(account, []).append(row)
+        return selected
+
+    def close(self):
+        self.connection.close()
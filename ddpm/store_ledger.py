@@ -0,0 +1,280 @@
+"""
+Compact, array-backed storage of the ledger entries.
+
+The entries of all of the ledger files are kept by column in one EntryStore:  the amounts as float arrays and
+everything else (strings, dates) dictionary encoded as integer codes into a list of the distinct values, so
+repeated values like fund, deptid, approver and preparer are only kept once.  The ledger accounts hold an
+EntryList of the row numbers of their entries, which hands out read-only Entry mapping views, so
+entry['actual'] etc work as they did for the per-entry dictionaries.
+
+The columns may also be memory-mapped from a ledger file (see columnar_ledger.py):  amounts are used as
+mapped (FloatColumn.from_array) and dates as int64 epoch seconds (EpochColumn) are only decoded when first used.
+
+"""
+from collections.abc import Mapping, Sequence
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+
+MISSING = None  # Value of a column for entries whose report type doesn't have it
+MISSING_INT = np.iinfo(np.int64).min  # Same, for the int64 epoch arrays
+
+
+class FloatColumn:
+    def __init__(self, nrows=0):
+        self.chunks = [np.full(nrows, np.nan)]
+        self._array = None
+
+    @classmethod
+    def from_array(cls, values):
+        """
+        Make a FloatColumn from an array (e.g. memory-mapped) of float64 values.
+        """
+        column = cls.__new__(cls)
+        column.chunks = [values]
+        column._array = values
+        return column
+
+    def append(self, values, nrows):
+        self.chunks.append(np.full(nrows, np.nan) if values is None else np.asarray(values, dtype=float))
+        self._array = None
+
+    @property
+    def array(self):
+        if self._array is None:
+            self._array = np.concatenate(self.chunks)
+            self.chunks = [self._array]
+        return self._array
+
+    def get(self, row):
+        return float(self.array[row])
+
+    def values(self, rows=None, func=None):
+        values = self.array if rows is None else self.array[rows]
+        if func is not None:
+            converted = np.empty(len(values), dtype=object)
+            converted[:] = [func(x) for x in values.tolist()]
+            return converted
+        return values
+
+
+class DictColumn:
+    def __init__(self, nrows=0):
+        self.categories = []  # The distinct values
+        self.lookup = {}  # value -> code
+        self.chunks = [np.full(nrows, self._code(MISSING), dtype=np.int32)]
+        self._codes = None
+
+    @classmethod
+    def from_codes(cls, categories, codes):
+        """
+        Make a DictColumn from its distinct values and an array (e.g. memory-mapped) of codes.
+        """
+        column = cls.__new__(cls)
+        column.categories = list(categories)
+        column.lookup = {value: code for code, value in enumerate(column.categories)}
+        column.chunks = [codes]
+        column._codes = codes
+        return column
+
+    def _code(self, value):
+        if value not in self.lookup:
+            self.lookup[value] = len(self.categories)
+            self.categories.append(value)
+        return self.lookup[value]
+
+    def append(self, values, nrows):
+        if values is None:
+            self.chunks.append(np.full(nrows, self._code(MISSING), dtype=np.int32))
+        else:
+            codes, uniques = pd.factorize(values, use_na_sentinel=False)
+            to_global = np.array([self._code(x) for x in uniques.tolist()], dtype=np.int32)
+            self.chunks.append(to_global[codes] if len(codes) else np.empty(0, dtype=np.int32))
+        self._codes = None
+
+    @property
+    def codes(self):
+        if self._codes is None:
+            self._codes = np.concatenate(self.chunks)
+            self.chunks = [self._codes]
+        return self._codes
+
+    def get(self, row):
+        return self.categories[self.codes[row]]
+
+    def values(self, rows=None, func=None):
+        categories = np.empty(len(self.categories), dtype=object)
+        categories[:] = self.categories if func is None else [func(x) for x in self.categories]
+        return categories[self.codes] if rows is None else categories[self.codes[rows]]
+
+
+class EpochColumn(DictColumn):
+    """
+    DictColumn of dates from an array (e.g. memory-mapped) of int64 epoch seconds, decoded (once per distinct
+    date, into local time) when first used.
+    """
+    def __init__(self, epochs):
+        self.epochs = epochs
+
+    def __getattr__(self, name):
+        if name in ['categories', 'lookup', 'chunks', '_codes']:
+            codes, uniques = pd.factorize(np.asarray(self.epochs), use_na_sentinel=False)
+            self.categories = [MISSING if x == MISSING_INT else datetime.fromtimestamp(x).astimezone() for x in uniques.tolist()]
+            self.lookup = {value: code for code, value in enumerate(self.categories)}
+            self._codes = codes.astype(np.int32)
+            self.chunks = [self._codes]
+            return getattr(self, name)
+        raise AttributeError(name)
+
+
+class EntryStore:
+    def __init__(self):
+        """
+        Attributes
+        ----------
+        columns : dict
+            FloatColumn or DictColumn per entry key
+        schemas : list
+            The distinct sets (tuples) of entry keys, one per report type
+        nrows : int
+            Number of entries
+
+        """
+        self.columns = {}
+        self.schemas = []
+        self.schema_chunks = []
+        self._schema = None
+        self.nrows = 0
+
+    def append(self, entries, amount_types):
+        """
+        Add converted entries (see settings_ledger.BaseType.convert).
+
+        Parameters
+        ----------
+        entries : pandas DataFrame
+            The converted entries, one column per entry key
+        amount_types : list
+            Keys of the amount columns, which are stored as floats
+
+        Return
+        ------
+        int
+            Row number of the first added entry
+
+        """
+        names = tuple(entries.columns)
+        if names not in self.schemas:
+            self.schemas.append(names)
+        nrows = len(entries)
+        for name in names:
+            if name not in self.columns:
+                self.columns[name] = FloatColumn(self.nrows) if name in amount_types else DictColumn(self.nrows)
+        for name, column in self.columns.items():
+            column.append(entries[name] if name in names else None, nrows)
+        self.schema_chunks.append(np.full(nrows, self.schemas.index(names), dtype=np.uint8))
+        self._schema = None
+        start = self.nrows
+        self.nrows += nrows
+        return start
+
+    @property
+    def schema(self):
+        """
+        Index into schemas for each row
+        """
+        if self._schema is None:
+            self._schema = np.concatenate(self.schema_chunks) if len(self.schema_chunks) else np.empty(0, dtype=np.uint8)
+            self.schema_chunks = [self._schema]
+        return self._schema
+
+    def keys(self, row):
+        return self.schemas[self.schema[row]]
+
+    def get(self, key, row):
+        if key not in self.keys(row):
+            raise KeyError(key)
+        return self.columns[key].get(row)
+
+    def column(self, key, rows=None, func=None):
+        """
+        Return an array of the values of key for rows (all if None), with func applied to each distinct value if supplied
+        """
+        return self.columns[key].values(rows, func)
+
+
+class Entry(Mapping):
+    """
+    Read-only mapping view of one entry in an EntryStore.  copy(entry) returns a dict.
+    """
+    __slots__ = ('store', 'row')
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    def __getitem__(self, key):
+        return self.store.get(key, self.row)
+
+    def __iter__(self):
+        return iter(self.store.keys(self.row))
+
+    def __len__(self):
+        return len(self.store.keys(self.row))
+
+    def __contains__(self, key):
+        return key in self.store.keys(self.row)
+
+    def __copy__(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class EntryList(Sequence):
+    """
+    The entries of one account, as row numbers into an EntryStore.
+    """
+    def __init__(self, store):
+        self.store = store
+        self.chunks = []
+        self._rows = None
+
+    def extend_rows(self, rows):
+        self.chunks.append(np.asarray(rows, dtype=np.int64))
+        self._rows = None
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = np.concatenate(self.chunks) if len(self.chunks) else np.empty(0, dtype=np.int64)
+            self.chunks = [self._rows]
+        return self._rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [Entry(self.store, row) for row in self.rows[i].tolist()]
+        return Entry(self.store, int(self.rows[i]))
+
+    def __iter__(self):
+        for row in self.rows.tolist():
+            yield Entry(self.store, row)
+
+    def take(self, index):
+        """
+        Return an EntryList of the entries at index (a slice or array of positions).
+        """
+        entries = EntryList(self.store)
+        entries.extend_rows(self.rows[index])
+        return entries
+
+    def column(self, key, func=None):
+        """
+        Return an array of the values of key for these entries (see EntryStore.column)
+        """
+        return self.store.column(key, self.rows, func)
@@ -1,9 +1,12 @@
 
+import ast
 import csv
 import os
 import locale
 from copy import copy
+from functools import lru_cache
 locale.setlocale(locale.LC_ALL, '')
+CSV_BUFFER = 1 << 20  # bytes buffered by the csv writers
 
 
 def print_money(amt, dollar_sign=False, cents=False, pad=False):
@@ -65,17 +68,56 @@ def show_ledger_files(ledger):
         print(f"File: {fname}")
         print(rc)
 
-def butter_lowpass_filter(data, cutoff, fs, order):
-    from scipy.signal import butter, filtfilt, freqz
-    # print("Cutoff freq " + str(cutoff))
+@lru_cache(maxsize=None)
+def butter_lowpass(cutoff, fs, order):
+    """
+    Return the (b, a) coefficients of a low-pass Butterworth filter, designed once per (cutoff, fs, order).
+    """
+    from scipy.signal import butter
     nyq = 0.5 * fs # Nyquist Frequency
-    normal_cutoff = cutoff / nyq
-    # Get the filter coefficients 
-    b, a = butter(order, normal_cutoff, btype='low', analog=False)
-    w, ff = freqz(b, a, fs=fs)
-    #plt.semilogy(w, np.abs(ff), label='Filter')
-    y = filtfilt(b, a, data)
-    return y
+    return butter(order, cutoff / nyq, btype='low', analog=False)
+
+def butter_lowpass_filter(data, cutoff, fs, order):
+    """
+    Low-pass filter data forward and backward along its last axis, so each row of a 2-D array is filtered in one call.
+    """
+    from scipy.signal import filtfilt
+    b, a = butter_lowpass(cutoff, fs, order)
+    return filtfilt(b, a, data, axis=-1)
+
+def smoothed_rates(cumulative, cutoff, fs, order, span=(0.15, 0.85)):
+    """
+    Smooth cumulative series and get their rates.  Series too short to filter (see filtfilt padlen) are used
+    as they are.
+
+    Parameters
+    ----------
+    cumulative : numpy array
+        2-D, one cumulative series per row (e.g. per amount type and/or fund) on the same daily times
+    cutoff, fs, order : float, float, int
+        See butter_lowpass_filter
+    span : tuple
+        Fractions of the times between which the rates are averaged
+
+    Return
+    ------
+    tuple
+        smoothed series, their daily differences (first 0.0), the mean difference of each over span
+        and the (low, high) indices of span
+
+    """
+    import numpy as np
+    cumulative = np.asarray(cumulative, dtype=float)
+    if cumulative.shape[1] > 3 * (order + 1):  # The default padlen of filtfilt for a butter filter of order
+        smooth = butter_lowpass_filter(cumulative, cutoff, fs, order)
+    else:
+        smooth = cumulative.copy()
+    rates = np.zeros_like(smooth)
+    rates[:, 1:] = np.diff(smooth, axis=1)
+    ilo = int(span[0] * smooth.shape[1])
+    ihi = int(span[1] * smooth.shape[1])
+    mean_rates = rates[:, ilo:ihi].mean(axis=1) if ihi > ilo else np.zeros(len(rates))
+    return smooth, rates, mean_rates, (ilo, ihi)
 
 def augmented_slice(S):
     """
@@ -90,17 +132,169 @@ def augmented_slice(S):
 
 def sumup(adict, keys=None):
     """
-    Sumup the values in a dictionary.
+    Sumup the values in a dictionary (numbers or arithmetic expressions, see evaluate).
 
     """
     if keys is None:
         keys = list(adict.keys())
     sum = 0.0
     for key in keys:
-        sum += eval(str(adict[key]))
+        sum += evaluate(adict[key])
     return sum
 
 
+ARITHMETIC_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant,
+                    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.UAdd, ast.USub)
+
+
+@lru_cache(maxsize=4096)
+def compile_expression(expr):
+    """
+    Parse an arithmetic expression (numbers, + - * / and parentheses) once and compile it.
+
+    Raises ValueError if it contains anything else (names, calls etc), so it is safe to evaluate.
+    """
+    tree = ast.parse(expr.strip(), mode='eval')
+    for node in ast.walk(tree):
+        if not isinstance(node, ARITHMETIC_NODES) or (isinstance(node, ast.Constant) and
+                                                      (isinstance(node.value, bool) or not isinstance(node.value, (int, float)))):
+            raise ValueError(f"Invalid arithmetic expression:  {expr}")
+    return compile(tree, '<expression>', 'eval')
+
+
+def evaluate(value):
+    """
+    Return the value of a number or arithmetic expression string, e.g. '(100000+10000)*0.6'.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return eval(compile_expression(str(value)), {'__builtins__': {}})
+
+
+def dependency_order(depends_on):
+    """
+    Order the keys of depends_on (dict of key -> list of keys it depends on) so each comes after its dependencies.
+
+    Raises ValueError on a circular dependency.
+    """
+    order, done, visiting = [], set(), set()
+
+    def visit(key):
+        if key in done:
+            return
+        if key in visiting:
+            raise ValueError(f"Circular dependency at {key}")
+        visiting.add(key)
+        for dep in depends_on.get(key, []):
+            visit(dep)
+        visiting.discard(key)
+        done.add(key)
+        order.append(key)
+
+    for key in depends_on:
+        visit(key)
+    return order
+
+
+def _md5_file(fn):
+    """
+    Return the md5 (hashlib object), size and last byte of a file, read a block at a time.
+    """
+    import hashlib
+    md5 = hashlib.md5()
+    size = 0
+    last_byte = b''
+    with open(fn, 'rb') as fp:
+        for block in iter(lambda: fp.read(1 << 20), b''):
+            md5.update(block)
+            size += len(block)
+            last_byte = block[-1:]
+    return md5, size, last_byte
+
+
+def get_file_state(fn, this_file):
+    """
+    Get what is needed to later check if the csv file has only been appended to (see get_appended).
+
+    Parameters
+    ----------
+    fn : str
+        Name of csv file
+    this_file : pandas DataFrame
+        The file as read by pandas
+
+    Return
+    ------
+    dict
+        size/modification time/md5 of the file, number of lines, column names and dtypes (float or str) to use for
+        the appended rows.  Columns without any values are read as str, since pandas only makes them float for
+        want of anything else.
+
+    """
+    from pandas.api.types import is_float_dtype, is_integer_dtype
+    md5, size, last_byte = _md5_file(fn)
+    dtypes = {}
+    for col in this_file.columns:
+        if is_float_dtype(this_file[col]) and not (len(this_file) and this_file[col].isna().all()):
+            dtypes[col] = 'float64'
+        elif not is_integer_dtype(this_file[col]):
+            dtypes[col] = 'str'
+    return {'size': size, 'mtime': os.stat(fn).st_mtime_ns, 'md5': md5.hexdigest(), 'lines': len(this_file),
+            'columns': this_file.columns.to_list(), 'dtypes': dtypes, 'newline': last_byte == b'\n'}
+
+
+def is_unchanged(fn, state):
+    """
+    Return True if the csv file still has the state (see get_file_state):  the same size, modification time and md5.
+    """
+    stat = os.stat(fn)
+    if stat.st_size != state['size'] or stat.st_mtime_ns != state.get('mtime'):
+        return False
+    return _md5_file(fn)[0].hexdigest() == state['md5']
+
+
+def get_appended(fn, state):
+    """
+    Read only the rows of the csv file appended since it had the supplied state (see get_file_state).
+
+    Parameters
+    ----------
+    fn : str
+        Name of csv file
+    state : dict
+        The file state when it was last read
+
+    Return
+    ------
+    tuple
+        The appended rows as a pandas DataFrame (may be empty) and the new file state,
+        or None, None if the file changed in other ways or the appended rows can't be read as before
+
+    """
+    import hashlib
+    import io
+    import pandas
+    with open(fn, 'rb') as fp:
+        prefix = fp.read(state['size'])
+        tail = fp.read()
+    md5 = hashlib.md5(prefix)
+    if len(prefix) != state['size'] or not state['newline'] or md5.hexdigest() != state['md5']:
+        return None, None
+    if len(tail.strip()):
+        try:
+            appended = pandas.read_csv(io.BytesIO(tail), header=None, names=state['columns'], dtype=state['dtypes'])
+        except ValueError as e:
+            print(f"Can't read the rows appended to {fn} as before ({e}).")
+            return None, None
+    else:
+        appended = pandas.DataFrame(columns=state['columns'])
+    md5.update(tail)
+    new_state = copy(state)
+    new_state.update({'size': state['size'] + len(tail), 'mtime': os.stat(fn).st_mtime_ns, 'md5': md5.hexdigest(),
+                      'lines': state['lines'] + len(appended), 'newline': tail.endswith(b'\n') if len(tail) else state['newline']})
+    return appended, new_state
+
+
 def scrub_csv(fn, legend_starts_with='Accounting Period', data_ends_with='Grand Total'):
     os.rename(fn, 'test_x_csv.csv')
     in_data = False
@@ -167,6 +361,51 @@ def split_csv(fn):
             print(f"{files_to_write[fundno]['counter']:4d} entries to {files_to_write[fundno]['fn']}")
             files_to_write[fundno]['fp'].close()
 
+def xlsx2csv(xlsfile, csvfile, legend_starts_with='Accounting Period', data_ends_with='Grand Total'):
+    """
+    Write the data of an xlsx ledger export straight to a csv file, as xls2csv followed by scrub_csv would.
+
+    The workbook is read a row at a time (openpyxl read-only mode), keeping the rows from the legend
+    (the header) up to the Grand Total, so memory doesn't depend on the size of the file.  Dates are written
+    as %Y/%m/%d.
+
+    Return
+    ------
+    int
+        Number of rows of data written (not counting the header)
+
+    """
+    from datetime import datetime
+    from openpyxl import load_workbook
+
+    def cell_str(x):
+        if x is None:
+            return ''
+        if isinstance(x, datetime):
+            return x.strftime('%Y/%m/%d')
+        return x
+
+    workbook = load_workbook(xlsfile, read_only=True, data_only=True)
+    in_data = False
+    rows = -1
+    try:
+        with open(csvfile, 'w') as fp_out:
+            writer = csv.writer(fp_out)
+            for row in workbook.active.iter_rows(values_only=True):
+                first = '' if not len(row) or row[0] is None else str(row[0]).strip()
+                if first.startswith(legend_starts_with):
+                    in_data = True
+                elif first.startswith(data_ends_with):
+                    break
+                if in_data:
+                    writer.writerow([cell_str(x) for x in row])
+                    rows += 1
+    finally:
+        workbook.close()
+    if not in_data:
+        print(f"No line starting with '{legend_starts_with}' in {xlsfile}")
+    return max(rows, 0)
+
 def xls2csv(xlsfile, csvfile):
     import pandas
     read_file = pandas.read_excel(xlsfile)
@@ -174,7 +413,8 @@ def xls2csv(xlsfile, csvfile):
 
 def write_to_csv(csvout, data, header=None, **kwargs):
     """
-    Write a csv file with header data and a header line
+    Write a csv file with header data and a header line.  The data may be any iterable of rows (e.g. a generator,
+    see iter_rows), which is written as it is made.
     """
     if not csvout.endswith('.csv'):
         csvout += '.csv'
@@ -186,19 +426,18 @@ def write_to_csv(csvout, data, header=None, **kwargs):
         kw_hdr = []
     for kw in kwargs.keys():
         kw_hdr.append([None, kw, kwargs[kw]])
-    if header is not None and len(kw_hdr):
-        csv_hdr = kw_hdr + [header]
-    elif header is not None:
-        csv_hdr = [header]
-    elif header is None and len(kw_hdr):
-        csv_hdr = kw_hdr
-    else:
-        csv_hdr = None
-
-    if csv_hdr is not None:
-        data = csv_hdr + data
+    if header is not None:
+        kw_hdr.append(header)
 
-    with open(csvout, 'w') as fp:
+    with open(csvout, 'w', buffering=CSV_BUFFER) as fp:
         writer = csv.writer(fp)
-        for d in data:
-            writer.writerow(d)
+        writer.writerows(kw_hdr)
+        writer.writerows(data)
+
+
+def iter_rows(batches):
+    """
+    Rows from columnar batches (each a list of equal length columns), one batch at a time.
+    """
+    for columns in batches:
+        yield from zip(*columns)
@@ -1,4 +1,3 @@
-import matplotlib.pyplot as plt
 import requests
 import csv
 
@@ -81,6 +80,7 @@ def complete2rgb(lag):
         return c
 
 def color_bar():
+    import matplotlib.pyplot as plt
     fff = plt.figure('ColorBar')
     ax = fff.add_subplot(111)
     ax.set_yticklabels([])
@@ -1,34 +1,244 @@
 from argparse import Namespace
+import calendar
 import datetime
+from functools import lru_cache
 from numpy import floor
 from dateutil.parser import parse
 from copy import copy
-from numpy import floor
 
 
-def cadence_keys(cadence, date):
+DATE_FORMATS = ['%m/%d/%Y', '%Y/%m/%d', '%Y-%m-%d', '%m/%d/%y',
+                '%m/%d/%Y %H:%M:%S', '%Y/%m/%d %H:%M:%S', '%Y-%m-%d %H:%M:%S']
+
+
+@lru_cache(maxsize=65536)
+def parse_date(x):
+    """
+    Memoized parse(x).astimezone()
+    """
+    return parse(x).astimezone()
+
+
+def detect_date_format(values, formats=DATE_FORMATS):
+    """
+    Find the format that converts the most of the values.
+
+    Parameters
+    ----------
+    values : array-like of str
+        Date strings to check
+    formats : list of str
+        strptime formats to try, in order of preference
+
+    Return
+    ------
+    str or None
+        The format, or None if none work.
+
+    """
+    import pandas as pd
+    best, best_count = None, 0
+    for fmt in formats:
+        count = pd.to_datetime(values, format=fmt, errors='coerce').notna().sum()
+        if count > best_count:
+            best, best_count = fmt, count
+        if best_count == len(values):
+            break
+    return best
+
+
+def parse_dates(values, fmt=None):
+    """
+    Convert an array of distinct date strings to tz-aware datetimes, the same as parse_date for each.
+
+    Parameters
+    ----------
+    values : array-like of str
+        Date strings, generally distinct (e.g. the uniques from pandas.factorize)
+    fmt : str or None
+        strptime format of the values (see detect_date_format), if None use parse_date for all
+
+    Return
+    ------
+    numpy array
+        Object array of the datetimes.  Values that don't match fmt use parse_date.
+
+    """
+    import numpy as np
+    import pandas as pd
+    dates = np.empty(len(values), dtype=object)
+    if fmt is None:
+        dates[:] = [parse_date(x) for x in values]
+        return dates
+    converted = pd.to_datetime(values, format=fmt, errors='coerce')
+    for i, (this_date, is_nat) in enumerate(zip(converted.to_pydatetime(), converted.isna())):
+        dates[i] = parse_date(values[i]) if is_nat else this_date.astimezone()
+    return dates
+
+
+CADENCES = ['daily', 'monthly', 'quarterly', 'yearly', 'fiscal']  # Periods of cadence_keys/period_ends
+
+
+def cadence_keys(cadence, date, fy_month=7):
+    """
+    Key of the cadence period containing date:  the last minute (23:59, local time) of its last day.
+    Memoized on the day (see period_end_key).
+
+    """
+    return period_end_key(*period_end(cadence, date.year, date.month, date.day, fy_month))
+
+
+@lru_cache(maxsize=65536)
+def period_end(cadence, year, month, day, fy_month=7):
+    """
+    Return (year, month, day) of the last day of the cadence period containing the day.
+    """
     if cadence == 'daily':
-        cdate = datetime.datetime(year=date.year, month=date.month, day=date.day, hour=23, minute=59).astimezone()
-    elif cadence == 'monthly':
-        ldom = last_day_of_month(date)
-        cdate = datetime.datetime(year=date.year, month=date.month, day=ldom, hour=23, minute=59).astimezone()
+        return year, month, day
+    if cadence == 'monthly':
+        end_month = month
     elif cadence == 'quarterly':
-        qmon = 3 * int(floor((date.month-1)/3 + 1))
-        ldom = last_day_of_month(datetime.datetime(year=date.year, month=qmon, day=28), False)
-        cdate = datetime.datetime(year=date.year, month=qmon, day=ldom, hour=23, minute=59).astimezone()
+        end_month = 3 * ((month - 1) // 3 + 1)
     elif cadence == 'yearly':
-        cdate = datetime.datetime(year=date.year, month=12, day=31, hour=23, minute=59).astimezone()
-    return cdate
+        end_month = 12
+    elif cadence == 'fiscal':
+        end_month = (fy_month - 2) % 12 + 1  # The month before fy_month
+        year = year + 1 if month >= fy_month and fy_month > 1 else year
+    else:
+        raise ValueError(f"Invalid cadence {cadence}")
+    return year, end_month, calendar.monthrange(year, end_month)[1]
+
+
+@lru_cache(maxsize=65536)
+def period_end_key(year, month, day):
+    """
+    The last minute of the day (local time), as used for the cadence keys.
+    """
+    return datetime.datetime(year=year, month=month, day=day, hour=23, minute=59).astimezone()
+
+
+def to_days(dates):
+    """
+    Convert an array of dates (datetime/date, each on its own local day) to numpy datetime64[D], once per distinct value.
+    None is NaT.
+
+    """
+    import numpy as np
+    import pandas as pd
+    codes, uniques = pd.factorize(np.asarray(dates, dtype=object), use_na_sentinel=False)
+    days = np.array([np.datetime64('NaT') if pd.isna(x) else np.datetime64(datetime.date(x.year, x.month, x.day))
+                     for x in uniques.tolist()], dtype='datetime64[D]')  # factorize makes None NaN
+    return days[codes] if len(codes) else np.empty(0, dtype='datetime64[D]')
+
+
+def period_ends(days, cadence, fy_month=7):
+    """
+    Last day of the cadence period of each day, with datetime64 arithmetic.
+
+    Parameters
+    ----------
+    days : numpy array
+        datetime64[D] (see to_days)
+    cadence : str
+        One of CADENCES
+    fy_month : int
+        First month of the fiscal year
+
+    Return
+    ------
+    numpy array
+        datetime64[D]
+
+    """
+    import numpy as np
+    days = np.asarray(days, dtype='datetime64[D]')
+    if cadence == 'daily':
+        return days
+    if cadence == 'yearly':
+        return (days.astype('datetime64[Y]') + 1).astype('datetime64[D]') - 1
+    months = days.astype('datetime64[M]')
+    if cadence == 'quarterly':
+        months = months + (2 - months.astype(np.int64) % 3)  # Month 0 is January 1970
+    elif cadence == 'fiscal':
+        months = months + (fy_month - 2 - months.astype(np.int64)) % 12
+    elif cadence != 'monthly':
+        raise ValueError(f"Invalid cadence {cadence}")
+    return (months + 1).astype('datetime64[D]') - 1
+
+
+def period_keys(dates, cadence, fy_month=7, stop=None):
+    """
+    The cadence_keys of an array of dates, found once per distinct period end.
+
+    Parameters
+    ----------
+    dates : array-like
+        datetimes (see to_days) or datetime64[D]
+    cadence : str
+        One of CADENCES
+    fy_month : int
+        First month of the fiscal year
+    stop : datetime or None
+        If not None, later keys are stop (e.g. the end of today)
+
+    Return
+    ------
+    numpy array
+        Object array of the keys
+
+    """
+    import numpy as np
+    days = dates if np.asarray(dates).dtype.kind == 'M' else to_days(dates)
+    ends, codes = np.unique(period_ends(days, cadence, fy_month), return_inverse=True)
+    keys = np.empty(len(ends), dtype=object)
+    keys[:] = [None if x is None else period_end_key(x.year, x.month, x.day) for x in ends.tolist()]
+    if stop is not None:
+        keys[:] = [x if x is None or x <= stop else stop for x in keys]
+    return keys[codes.reshape(-1)]
+
+
+def cadence_calendar(cadence, first, last):
+    """
+    Every cadence key from first to last (see cadence_keys), made from the periods between them in one pass.
+
+    Parameters
+    ----------
+    cadence : str
+        'daily', 'monthly', 'quarterly' or 'yearly'
+    first, last : datetime
+        The first and last keys.  A later key is clipped to last (e.g. to now, as for Audit.cadence).
+
+    Return
+    ------
+    list
+        The keys, in order
+
+    """
+    import numpy as np
+    unit = {'daily': 'D', 'monthly': 'M', 'quarterly': 'M', 'yearly': 'Y'}[cadence]
+    periods = np.arange(np.datetime64(first.strftime('%Y-%m-%d'), unit), np.datetime64(last.strftime('%Y-%m-%d'), unit) + 1)
+    keys = []
+    for this_date in periods.astype('datetime64[D]').tolist():
+        key = min(cadence_keys(cadence, this_date), last)
+        if not len(keys) or key != keys[-1]:  # Quarters span three months
+            keys.append(key)
+    return keys
 
 
 def last_day_of_month(t, return_datetime=False):
-    next_mon = datetime.datetime(year=t.year, month=t.month, day=25).astimezone() + datetime.timedelta(days=10)
-    ldom = datetime.datetime(year=next_mon.year, month=next_mon.month, day=1).astimezone() - datetime.timedelta(days=1)
+    ldom = _last_day_of_month(t.year, t.month)
     if return_datetime:
         return ldom
     return ldom.day
 
 
+@lru_cache(maxsize=4096)
+def _last_day_of_month(year, month):
+    if month == 12:
+        year, month = year + 1, 0
+    return datetime.datetime(year=year, month=month + 1, day=1).astimezone() - datetime.timedelta(days=1)
+
+
 def datedeltastr(val, fmt='%Y-%m-%dT%H:%M'):
     if isinstance(val, datetime.datetime):
         return val.strftime(fmt)
@@ -116,7 +326,7 @@ def get_fiscal_year(val, fy_month=7):
     elif isinstance(val, (int, float)):
         nval = int(val)
     elif isinstance(val, datetime.datetime):
-        if val.mon < fy_month:
+        if val.month < fy_month:
             nval = val.year
         else:
             nval = val.year + 1
@@ -129,6 +339,43 @@ def get_fiscal_year(val, fy_month=7):
     return fy
 
 
+class FiscalCalendar:
+    """
+    Fiscal years starting on the first of fy_month, named as in get_fiscal_year by the year they end in
+    (e.g. FY2025 is 2024-07-01 to 2025-06-30 for fy_month=7).
+    """
+    def __init__(self, fy_month=7):
+        self.fy_month = fy_month
+
+    def years(self, dates):
+        """
+        Fiscal year of each of an array of dates (see to_days) in one pass, 0 if missing.
+        """
+        import numpy as np
+        days = dates if np.asarray(dates).dtype.kind == 'M' else to_days(dates)
+        months = days.astype('datetime64[M]').astype(np.int64)  # Month 0 is January 1970
+        years = 1971 + (months - (self.fy_month - 1)) // 12
+        years[np.isnat(days)] = 0
+        return years.astype(np.int32)
+
+    def year(self, date):
+        """
+        Fiscal year of one date.
+        """
+        return date.year + 1 if date.month >= self.fy_month else date.year
+
+    def bounds(self, val):
+        """
+        Namespace of year/start/stop of a fiscal year (see get_fiscal_year), memoized.
+        """
+        return _fiscal_year_bounds(val, self.fy_month)
+
+
+@lru_cache(maxsize=1024)
+def _fiscal_year_bounds(val, fy_month):
+    return get_fiscal_year(val, fy_month)
+
+
 def months_to_timedelta(starts, duration_mo):
     starts = parse(starts).astimezone()
     int_mo = int(floor(duration_mo))
@@ -12,9 +12,13 @@ ap.add_argument('-r', '--reverse', help="Flag to reverse the sort", action='stor
 ap.add_argument('-t', '--hide_table', help="Don't show the table", action='store_true')
 ap.add_argument('-p', '--hide_plot', help="Don't show the plot", action='store_true')
 ap.add_argument('-i', '--intellicull', help="Run ledger intellicull first", action='store_true')
+ap.add_argument('--cull_keep', help="Intellicull keep policy (first, all, unique) instead of asking", default=None)
+ap.add_argument('--cull_report', help="Name of csv file to write the intellicull report", default=None)
 ap.add_argument('-x', '--skip_fund_error', help="Flag to skip erroring on different funds", action='store_true')
 ap.add_argument('--amounts', help="Type of amounts to use in audit, None uses from yaml.", default=None)
 ap.add_argument('--csv', help="Name of csv file to write", default=False)
+ap.add_argument('--offset', help="First (sorted) entry to show", type=int, default=0)
+ap.add_argument('--limit', help="Number of entries to show (all if not supplied)", type=int, default=None)
 ap.add_argument('--col', help="Columns to show or 'all'",
                 default='account,date,description,detailed_description,reference,actual,amount,budget,encumbrance')
 args = ap.parse_args()
@@ -22,13 +26,14 @@ args = ap.parse_args()
 mgr = manager.Manager(args.yaml)
 mgr.start_audit(file_list=args.files, raise_fund_error=not args.skip_fund_error)
 if args.intellicull:
-    mgr.ledger.intellicull()
+    mgr.ledger.intellicull(keep=args.cull_keep, report=args.cull_report)
 if args.category != 'all':
     mgr.audit.filter.set(account=mgr.budget_category_accounts[args.category])
 elif args.accounts is not None:
     args.accounts = args.accounts.split(',')
     mgr.audit.filter.set(account=args.accounts)
-mgr.audit.detail(sort_by=args.sort_by, sort_reverse=args.reverse, cols_to_show=args.col, csv=args.csv)
+mgr.audit.detail(sort_by=args.sort_by, sort_reverse=args.reverse, cols_to_show=args.col, csv=args.csv,
+                 offset=args.offset, limit=args.limit)
 if not args.hide_table:
     mgr.audit.show_table()
 if not args.hide_plot:
@@ -9,6 +9,8 @@ ap.add_argument('-d', '--directory', help="Directory with the xls file", default
 ap.add_argument('-t', '--file-type', dest='file_type', default='auto',
                 choices=['summary', 'detail', 'auto'])
 ap.add_argument('--split', help="Set if splitting funds out of a master file.", action='store_true')
+ap.add_argument('--partition', help="Set if splitting funds out of a master file as binary partitions (see ledger.write_partitions).",
+                action='store_true')
 args = ap.parse_args()
 
 basedir = path.expanduser(args.directory)
@@ -47,13 +49,20 @@ else:
     args.data_ends_with = 'Grand Total'
 
 if xlsin is not None:
-    print(f"   >>>Reading {xlsin}")
-    utils.xls2csv(xlsin, csvout)
+    print(f"   >>>Reading {args.file_type} data from {xlsin} into {csvout}")
+    nrows = utils.xlsx2csv(xlsin, csvout, args.legend_starts_with, args.data_ends_with)
+    print(f"   >>>Wrote {nrows} rows.")
     import os
     os.remove(xlsin)
-print(f"   >>>Scrubbing {args.file_type} csv file {csvout}.")
-utils.scrub_csv(csvout, args.legend_starts_with, args.data_ends_with)
+else:
+    print(f"   >>>Scrubbing {args.file_type} csv file {csvout}.")
+    utils.scrub_csv(csvout, args.legend_starts_with, args.data_ends_with)
 
 if args.split:
     print(f"Splitting {csvout}")
     utils.split_csv(csvout)
+if args.partition:
+    from ddpm import ledger
+    print(f"Partitioning {csvout}")
+    ledger.write_partitions(csvout, 'calanswers' if args.file_type == 'detail' else 'fund_summary',
+                            utils.get_fund_directories())
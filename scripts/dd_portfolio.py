@@ -1,6 +1,14 @@
 #! /usr/bin/env python
+import argparse
 from ddpm import manager
 
+ap = argparse.ArgumentParser()
+ap.add_argument('-l', '--ledger', help="Master ledger file(s) (csv-list) to read each fund's ledger from, parsed once", default=None)
+ap.add_argument('-y', '--yaml', help="Name of the yaml file in each fund directory (default the one .yaml there)", default=None)
+args = ap.parse_args()
+
 pf = manager.Portfolio()
+if args.ledger is not None:
+    pf.read_ledgers(args.ledger.split(','), yaml_file=args.yaml)
 pf.get_portfolio_summary_from_tex()
-pf.write_csv()
\ No newline at end of file
+pf.write_csv()
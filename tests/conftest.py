@@ -0,0 +1,42 @@
+import os
+import io
+import csv
+import contextlib
+import pytest
+from ddpm import ledger
+
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+LEDGER_FILE = os.path.join(DATA, 'FY25_General_Ledger_Detail.csv')
+
+
+def read_ledger(ledger_file=LEDGER_FILE, **kwargs):
+    """
+    Read the fixture ledger (or a copy of it, fund 12345) quietly.
+    """
+    this_ledger = ledger.Ledger(12345, {ledger_file: 'calanswers'})
+    with contextlib.redirect_stdout(io.StringIO()):
+        this_ledger.read(**kwargs)
+    return this_ledger
+
+
+def copy_ledger(fn, edit=None):
+    """
+    Write the fixture ledger to fn, with edit(n, row) applied to each data row (list of str) if supplied.
+    Rows for which edit returns None are left out.
+    """
+    with open(LEDGER_FILE, newline='') as fp:
+        rows = list(csv.reader(fp))
+    with open(fn, 'w', newline='') as fp:
+        writer = csv.writer(fp, lineterminator='\n')
+        writer.writerow(rows[0])
+        for n, row in enumerate(rows[1:]):
+            row = row if edit is None else edit(n, row)
+            if row is not None:
+                writer.writerow(row)
+    return fn
+
+
+@pytest.fixture
+def fixture_ledger():
+    return read_ledger()
@@ -0,0 +1,162 @@
+import os
+import io
+import csv
+import contextlib
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytest
+from ddpm import audit, store_ledger
+from conftest import read_ledger, copy_ledger
+
+
+COLS = ['account', 'date', 'description', 'docid', 'reference', 'approver', 'budget', 'actual']
+
+
+def run_detail(ledger, **kwargs):
+    this_audit = audit.Audit(ledger)
+    this_audit.filter.set(**kwargs.pop('filter', {}))
+    with contextlib.redirect_stdout(io.StringIO()):
+        this_audit.detail(**kwargs)
+    return this_audit
+
+
+def test_detail_sorted(fixture_ledger):
+    this_audit = run_detail(fixture_ledger, sort_by='actual', cols_to_show=['docid', 'actual'])
+    assert this_audit.header == ['Document ID', 'Actuals Amount']
+    assert this_audit.table_data[:2] == [['DOC331', -2351.46], ['DOC78', -974.43]]
+    assert this_audit.table_data[-2:] == [['DOC450', 4986.94], ['DOC195', 4997.77]]
+    assert this_audit.total_lines == len(this_audit.table_data) == 150
+    assert this_audit.subtotal['budget'] == 12000.0
+    assert this_audit.subtotal['actual'] == pytest.approx(344510.14)
+    this_audit = run_detail(fixture_ledger, sort_by='|actual', sort_reverse=True, cols_to_show=['docid', 'actual'])
+    assert this_audit.table_data[:3] == [['DOC195', 4997.77], ['DOC450', 4986.94], ['DOC134', 4928.22]]
+    this_audit = run_detail(fixture_ledger, sort_by='|actual', cols_to_show=['docid', 'actual'])
+    assert this_audit.table_data[:3] == [['DOC488', 27.7], ['DOC262', -80.14], ['DOC269', -80.21]]
+    this_audit = run_detail(fixture_ledger, sort_by=['description', 'actual'], cols_to_show='description,actual')
+    assert this_audit.table_data[:3] == [['Laptop', -974.43], ['Laptop', -484.54], ['Laptop', 379.12]]
+    this_audit = run_detail(fixture_ledger, cols_to_show=['account', 'date', 'docid'])
+    assert this_audit.table_data[:2] == [['50100 - Acad', '2024-07-16', 'DOC316'], ['50100 - Acad', '2024-09-05', 'DOC259']]
+
+
+def test_detail_ties_in_order_found(fixture_ledger):
+    found = ['DOC386', 'DOC492', 'DOC360', 'DOC150', 'DOC310']  # The 500.00 entries, by account then file order
+    for sort_reverse in [False, True]:
+        this_audit = run_detail(fixture_ledger, sort_by='actual', sort_reverse=sort_reverse, cols_to_show=['docid', 'actual'])
+        ties = [docid for docid, actual in this_audit.table_data if actual == 500.0]
+        assert ties == (found[::-1] if sort_reverse else found)
+
+
+def test_detail_nan_amounts(tmp_path):
+    def no_actual(n, row):
+        if n in [0, 1]:
+            row[-1] = ''
+        return row
+
+    this_ledger = read_ledger(copy_ledger(str(tmp_path / 'FY25_General_Ledger_Detail.csv'), no_actual))
+    this_audit = run_detail(this_ledger, sort_by='actual', cols_to_show=['docid', 'actual'])
+    assert this_audit.table_data[0] == ['DOC331', -2351.46]
+    assert [x[0] for x in this_audit.table_data[-2:]] == ['DOC36', 'DOC134'] and all([x[1] != x[1] for x in this_audit.table_data[-2:]])
+    assert this_audit.subtotal['actual'] != this_audit.subtotal['actual']  # NaN, as adding entry by entry
+    this_audit = run_detail(this_ledger, sort_by='actual', sort_reverse=True, cols_to_show=['docid', 'actual'])
+    assert [x[0] for x in this_audit.table_data[:2]] == ['DOC134', 'DOC36']
+
+
+def test_detail_empty_selection(fixture_ledger):
+    for selection in [{'account': 'none'}, {'date': '2030-01-01'}, {'actual': '>1E9'}]:
+        this_audit = run_detail(fixture_ledger, cols_to_show=COLS, filter=selection)
+        assert this_audit.total_lines == 0 and this_audit.table_data == []
+        assert this_audit.subtotal == {'budget': 0.0, 'encumbrance': 0.0, 'actual': 0.0}
+        assert this_audit.get_table() == [] and list(this_audit.iter_table()) == []
+    this_audit = run_detail(fixture_ledger, cols_to_show=['docid'], filter={'date': '2025-03-18'})  # Too short to smooth
+    assert this_audit.table_data == [['DOC36']]
+
+
+def test_detail_pages(fixture_ledger):
+    full = run_detail(fixture_ledger, sort_by='|actual', cols_to_show=COLS).table_data
+    this_audit = run_detail(fixture_ledger, sort_by='|actual', cols_to_show=COLS, offset=20, limit=15)
+    assert this_audit.table_data == full[20:35]
+    assert this_audit.total_lines == 150
+    assert this_audit.get_table() == full
+    assert this_audit.get_table(145, 100) == full[145:]
+    assert this_audit.get_table(150) == this_audit.get_table(1000, 10) == []
+    assert run_detail(fixture_ledger, cols_to_show=COLS, offset=148, limit=10).table_data == \
+        run_detail(fixture_ledger, cols_to_show=COLS).table_data[148:]
+    assert run_detail(fixture_ledger, cols_to_show=COLS, limit=0).table_data == []
+
+
+DETAIL_CSV = ['Account - Desc,Journal Date,Description,Document ID,Reference,Approver Name,Authorized Budget Amount,Actuals Amount',
+              '50100 - Acad,2024-07-16,Payroll,DOC316,nan,"Smith, J",0.0,4270.8',
+              '50100 - Acad,2024-09-05,Travel,DOC259,nan,"Doe, A",0.0,4012.3']
+
+
+def csv_lines(fn):
+    with open(fn, newline='') as fp:
+        return fp.read().split('\r\n')
+
+
+def test_detail_csv(fixture_ledger, tmp_path):
+    full = run_detail(fixture_ledger, cols_to_show=COLS, csv=str(tmp_path / 'full'))
+    lines = csv_lines(str(tmp_path / 'full.csv'))
+    assert lines[:3] == DETAIL_CSV
+    assert len(lines) == 152 and lines[-1] == ''  # header, 150 rows and the final line end
+    assert list(csv.reader(lines[1:-1])) == [[str(x) for x in row] for row in full.table_data]
+    for n, kwargs in enumerate([{'offset': 10, 'limit': 7}, {'offset': 1000}, {'limit': 0}]):
+        this_audit = run_detail(fixture_ledger, cols_to_show=COLS, csv=str(tmp_path / f'detail{n}.csv'), **kwargs)
+        assert csv_lines(str(tmp_path / f'detail{n}.csv')) == lines, kwargs  # Always the whole table
+        for batch in [1, 7, 150, 50000]:
+            assert list(this_audit.iter_table(batch=batch)) == this_audit.get_table() == full.table_data
+
+
+def test_detail_csv_empty_selection(fixture_ledger, tmp_path):
+    run_detail(fixture_ledger, cols_to_show=COLS, csv=str(tmp_path / 'empty'), filter={'account': 'none'})
+    assert not os.path.exists(str(tmp_path / 'empty.csv'))  # As before, nothing is written
+
+
+def selected(fixture_ledger, **kwargs):
+    """
+    The entries Filter.mask passes with the settings kwargs, checked against allow entry by entry.
+    """
+    this_filter = audit.Audit(fixture_ledger).filter
+    this_filter.set(**kwargs)
+    passed = []
+    for this_account in fixture_ledger.data.values():
+        entries = this_account['entries']
+        keep = this_filter.mask(entries)
+        assert keep.tolist() == [this_filter.allow(x) for x in entries]
+        passed += [entries[i] for i in np.flatnonzero(keep).tolist()]
+    return passed
+
+
+def test_filter_date_range(fixture_ledger):
+    # Used to raise AttributeError (it caught parse.ParserError)
+    march = selected(fixture_ledger, date='2025-03-01_2025-03-31')
+    assert len(march) == 11 and all([x['date'].month == 3 for x in march])
+    assert [x['docid'] for x in selected(fixture_ledger, date='2025-03-18')] == ['DOC36']
+
+
+def test_filter_amount_range(fixture_ledger):
+    # Used to be read as float('1000_1200') and, with $, raise KeyError (it set amount['hight'])
+    expected = [1095.51, 1102.66, 1119.08, 1176.59]
+    assert sorted([x['actual'] for x in selected(fixture_ledger, actual='1000_1200')]) == expected
+    assert sorted([x['actual'] for x in selected(fixture_ledger, actual='$1,000_$1,200')]) == expected
+
+
+def test_filter_amount_absval(fixture_ledger):
+    # The | used to be left in place, so the limit wasn't set and everything passed
+    assert len(selected(fixture_ledger, actual='<1200')) == 44
+    assert len(selected(fixture_ledger, actual='|<1200')) == 43
+    assert -2351.46 in [x['actual'] for x in selected(fixture_ledger, actual='|>1000')]
+    assert -2351.46 not in [x['actual'] for x in selected(fixture_ledger, actual='>1000')]
+
+
+def test_filter_entries_without_date():
+    store = store_ledger.EntryStore()
+    store.append(pd.DataFrame({'date': [datetime(2025, 3, 1).astimezone()], 'actual': [1.0]}), ['actual'])
+    store.append(pd.DataFrame({'actual': [2.0]}), ['actual'])
+    entries = store_ledger.EntryList(store)
+    entries.extend_rows([0, 1])
+    this_filter = audit.Filter(['50000'], ['date'], ['actual'])
+    assert this_filter.mask(entries).tolist() == [True, False]
+    with pytest.raises(KeyError):
+        this_filter.allow(entries[1])
@@ -0,0 +1,59 @@
+import os
+import io
+import pickle
+import contextlib
+from ddpm import cache_ledger, ledger
+from conftest import read_ledger, copy_ledger
+
+
+def entries_of(this_ledger):
+    return {account: [dict(x) for x in this_account['entries']] for account, this_account in this_ledger.data.items()}
+
+
+def test_cache_round_trip(fixture_ledger, tmp_path):
+    cache = str(tmp_path / 'cache')
+    cold = read_ledger(cache=cache)
+    cached = os.listdir(cache)
+    assert len(cached) == 1 and cached[0].endswith(cache_ledger.CACHE_SUFFIX)
+    warm = read_ledger(cache=cache)
+    assert entries_of(cold) == entries_of(warm) == entries_of(fixture_ledger)
+    assert warm.grand_total == fixture_ledger.grand_total
+    assert warm.file_state == fixture_ledger.file_state
+
+
+def test_cache_appended(tmp_path, monkeypatch):
+    cache = str(tmp_path / 'cache')
+    this_file = copy_ledger(str(tmp_path / 'FY25_General_Ledger_Detail.csv'), lambda n, row: row if n < 100 else None)
+    read_ledger(this_file, cache=cache)
+    copy_ledger(this_file)
+    appended = []
+    parse_appended = ledger.parse_appended
+    monkeypatch.setattr(ledger, 'parse_appended', lambda *args: appended.append(args) or parse_appended(*args))
+    assert entries_of(read_ledger(this_file, cache=cache)) == entries_of(read_ledger(this_file))
+    assert len(appended) == 1
+
+
+def test_cache_name_has_version(tmp_path, monkeypatch):
+    this_name = cache_ledger.cache_name(str(tmp_path), cache_ledger.__file__, 'calanswers', 1.0)
+    monkeypatch.setattr(cache_ledger, 'CACHE_VERSION', cache_ledger.CACHE_VERSION + 1)
+    assert cache_ledger.cache_name(str(tmp_path), cache_ledger.__file__, 'calanswers', 1.0) != this_name
+
+
+def test_cache_not_unpickled(tmp_path):
+    cache_file = str(tmp_path / f"x_y{cache_ledger.CACHE_SUFFIX}")
+    with open(cache_file, 'wb') as fp:
+        pickle.dump({'columns': [], 'entries': None, 'accounts': None, 'state': {}}, fp)
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert cache_ledger.load(cache_file) is None
+    assert not os.path.exists(cache_file)
+
+
+def test_partition_round_trip(fixture_ledger, tmp_path):
+    master = copy_ledger(str(tmp_path / 'FY25_General_Ledger_Detail.csv'))
+    fund_dir = tmp_path / '12345'
+    fund_dir.mkdir()
+    with contextlib.redirect_stdout(io.StringIO()):
+        ledger.write_partitions(master, 'calanswers', {12345: str(fund_dir)})
+    assert os.path.exists(cache_ledger.partition_name(str(fund_dir / 'FY25_General_Ledger_Detail.csv')))
+    partitioned = read_ledger(str(fund_dir / 'FY25_General_Ledger_Detail.csv'), use_partitions=True)
+    assert entries_of(partitioned) == entries_of(fixture_ledger)
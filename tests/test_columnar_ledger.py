@@ -0,0 +1,58 @@
+import os
+import io
+import shutil
+import contextlib
+from ddpm import ledger
+from conftest import LEDGER_FILE
+
+
+def round_trip(files, fn):
+    """
+    Read the files, save the ledger to fn and load it into a new Ledger.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        read = ledger.Ledger(12345, files)
+        read.read()
+        read.save(fn)
+        loaded = ledger.Ledger(12345, files)
+        assert loaded.load(fn)
+    return read, loaded
+
+
+def check_same(read, loaded):
+    assert list(loaded.data) == list(read.data)
+    for account, this_account in read.data.items():
+        assert [dict(x) for x in loaded.data[account]['entries']] == [dict(x) for x in this_account['entries']]
+        for amtt in read.amount_types:
+            assert loaded.data[account][amtt] == this_account[amtt]
+    for key in ['grand_total', 'total_entries', 'first_date', 'last_date', 'columns', 'amount_types', 'date_types']:
+        assert getattr(loaded, key) == getattr(read, key)
+
+
+def test_round_trip(tmp_path):
+    read, loaded = round_trip({LEDGER_FILE: 'calanswers'}, str(tmp_path / 'test.ddpm'))
+    check_same(read, loaded)
+
+
+def test_round_trip_sub_cent(tmp_path):
+    sub_cent = str(tmp_path / 'FY25_General_Ledger_Detail.csv')
+    with open(LEDGER_FILE) as fp_in, open(sub_cent, 'w') as fp_out:
+        for n, line in enumerate(fp_in):
+            fp_out.write(line if not n or not line.rstrip().endswith('"') else line.rstrip()[:-1] + '7"\n')
+    read, loaded = round_trip({sub_cent: 'calanswers'}, str(tmp_path / 'test.ddpm'))
+    assert any([round(x['actual'], 2) != x['actual'] for this_account in read.data.values() for x in this_account['entries']])
+    check_same(read, loaded)
+
+
+def test_load_only_current(tmp_path):
+    this_file = str(tmp_path / 'FY25_General_Ledger_Detail.csv')
+    shutil.copy(LEDGER_FILE, this_file)
+    fn = str(tmp_path / 'test.ddpm')
+    round_trip({this_file: 'calanswers'}, fn)
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert not ledger.Ledger(999, {this_file: 'calanswers'}).load(fn, check=False)
+        assert not ledger.Ledger(12345, {this_file: 'calanswers'}).load(fn, flip=True)
+        with open(this_file, 'a') as fp:
+            fp.write(open(LEDGER_FILE).readlines()[1])
+        assert not ledger.Ledger(12345, {this_file: 'calanswers'}).load(fn)
+    os.remove(fn)
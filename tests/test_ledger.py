@@ -0,0 +1,130 @@
+import os
+import io
+import math
+import time
+import contextlib
+import pytest
+from ddpm import ledger
+from conftest import read_ledger, copy_ledger
+
+
+LEDGER_CSV = ['Accounting Period - Desc,Dept ID - Desc,Fund - Desc,CF1 Code,CF2 Code,Program Code,Account - Desc,Journal Date,'
+              'Document ID,Description,Detailed Description,Reference,Approver Name,Preparer Name,Authorized Budget Amount,'
+              'Encumbrance Amount,Actuals Amount',
+              '03 - Period,12345,12345,X2,nan,P01,56000 - Soft,03/18/2025,DOC36,Laptop,b,R1,"Doe, A","Lee, K",0.0,0.0,2835.57',
+              '04 - Period,12345,12345,nan,nan,P01,56000 - Soft,04/13/2025,DOC109,Payroll,b,R1,"Smith, J","Lee, K",0.0,0.0,1102.66']
+
+
+def written(this_ledger, fn, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        this_ledger.write_csv(fn, **kwargs)
+    with open(fn, newline='') as fp:
+        return fp.read().split('\r\n')
+
+
+def test_write_csv(fixture_ledger, tmp_path):
+    lines = written(fixture_ledger, str(tmp_path / 'ledger.csv'))
+    assert lines[:3] == LEDGER_CSV
+    assert len(lines) == 152 and lines[-1] == ''  # header, 150 entries and the final line end
+    for batch in [1, 7, 150, 50000]:
+        assert written(fixture_ledger, str(tmp_path / f'ledger{batch}.csv'), batch=batch) == lines, batch
+    assert written(fixture_ledger, str(tmp_path / 'soft.csv'), accounts=['56000'])[:3] == LEDGER_CSV
+    assert written(fixture_ledger, str(tmp_path / 'none.csv'), accounts=[]) == LEDGER_CSV[:1] + ['']
+
+
+def test_write_csv_nan_amount(tmp_path):
+    this_ledger = read_ledger(copy_ledger(str(tmp_path / 'FY25_General_Ledger_Detail.csv'),
+                                          lambda n, row: row[:-1] + [''] if n == 0 else row))
+    lines = written(this_ledger, str(tmp_path / 'ledger.csv'))
+    assert lines[1] == LEDGER_CSV[1].replace('2835.57', 'nan')
+    assert lines[2] == LEDGER_CSV[2]
+
+
+def test_empty_amount_total_is_nan(tmp_path):
+    def no_actual(n, row):
+        if n == 0:  # 56000, "$2,835.57"
+            row[-1] = ''
+        return row
+
+    this_ledger = read_ledger(copy_ledger(str(tmp_path / 'FY25_General_Ledger_Detail.csv'), no_actual))
+    assert math.isnan(this_ledger.data['56000']['actual'])
+    assert math.isnan(this_ledger.grand_total['actual'])
+    assert not math.isnan(this_ledger.data['56000']['budget'])
+    assert not any([math.isnan(this_account['actual']) for account, this_account in this_ledger.data.items() if account != '56000'])
+
+
+def entries_of(this_ledger):
+    return {account: [dict(x) for x in this_account['entries']] for account, this_account in this_ledger.data.items()}
+
+
+def refreshed(this_ledger):
+    with contextlib.redirect_stdout(io.StringIO()):
+        this_ledger.refresh()
+    return this_ledger
+
+
+def test_refresh_same_size_edit(tmp_path):
+    this_file = copy_ledger(str(tmp_path / 'FY25_General_Ledger_Detail.csv'))
+    this_ledger = read_ledger(this_file)
+    size = os.path.getsize(this_file)
+    copy_ledger(this_file, lambda n, row: row[:-1] + ['$2,935.57'] if n == 0 else row)
+    os.utime(this_file, ns=(time.time_ns(), time.time_ns() + 1000000000))
+    assert os.path.getsize(this_file) == size
+    this_ledger = refreshed(this_ledger)
+    assert this_ledger.data['56000']['actual'] == read_ledger(this_file).data['56000']['actual']
+    assert entries_of(this_ledger) == entries_of(read_ledger(this_file))
+    assert entries_of(refreshed(this_ledger)) == entries_of(read_ledger(this_file))
+
+
+def fill_cf2(n, row):
+    if n >= 100 and n % 10 == 0:
+        row[4] = 'ZZ9'  # CF2 Code, empty in the fixture
+    return row
+
+
+def test_refresh_append_fills_empty_column(tmp_path, monkeypatch):
+    this_file = copy_ledger(str(tmp_path / 'FY25_General_Ledger_Detail.csv'), lambda n, row: row if n < 100 else None)
+    this_ledger = read_ledger(this_file)
+    assert this_ledger.file_state[this_file]['dtypes']['CF2 Code'] == 'str'
+    copy_ledger(this_file, fill_cf2)
+    monkeypatch.setattr(this_ledger, '_read_again', lambda: pytest.fail("read again"))
+    this_ledger = refreshed(this_ledger)
+    assert this_ledger.total_entries == 150
+    assert entries_of(this_ledger) == entries_of(read_ledger(this_file))
+    assert {x['cf2'] for x in this_ledger.data['56000']['entries']} == {'nan', 'ZZ9'}
+
+
+def test_cache_append_fills_empty_column(tmp_path):
+    cache = str(tmp_path / 'cache')
+    this_file = copy_ledger(str(tmp_path / 'FY25_General_Ledger_Detail.csv'), lambda n, row: row if n < 100 else None)
+    read_ledger(this_file, cache=cache)
+    copy_ledger(this_file, fill_cf2)
+    assert entries_of(read_ledger(this_file, cache=cache)) == entries_of(read_ledger(this_file))
+
+
+def test_refresh_unreadable_append_reads_again(tmp_path):
+    this_file = copy_ledger(str(tmp_path / 'FY25_General_Ledger_Detail.csv'), lambda n, row: row if n < 100 else None)
+    this_ledger = read_ledger(this_file)
+    this_ledger.file_state[this_file]['dtypes']['CF2 Code'] = 'float64'  # As it was recorded before
+    copy_ledger(this_file, fill_cf2)
+    assert entries_of(refreshed(this_ledger)) == entries_of(read_ledger(this_file))
+
+
+def test_stream_total_is_kept_rows(tmp_path):
+    def other_fund(n, row):
+        if n % 3 == 0:
+            row[2] = '99999 - Other'  # Fund - Desc
+        return row
+
+    this_file = copy_ledger(str(tmp_path / 'FY25_General_Ledger_Detail.csv'), other_fund)
+    this_ledger = ledger.Ledger(12345, {this_file: 'calanswers'})
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        this_ledger.read(chunksize=40)
+    file_line = [line.split() for line in out.getvalue().splitlines() if line.startswith(this_file)][0]
+    assert this_ledger.total_entries == 100
+    assert file_line[-1] == '100'  # ledger file, out_of_fy, total
+    assert "Skipped 50 rows of other funds" in out.getvalue()
+    assert "Total number of entries: 100" in out.getvalue()
+    kept = read_ledger(copy_ledger(str(tmp_path / 'kept.csv'), lambda n, row: None if n % 3 == 0 else row))
+    assert entries_of(this_ledger) == entries_of(kept)
+    assert this_ledger.grand_total == pytest.approx(kept.grand_total, abs=1E-6)
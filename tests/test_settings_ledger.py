@@ -0,0 +1,33 @@
+import io
+import math
+import contextlib
+import numpy as np
+import pandas as pd
+from ddpm import settings_ledger as settings
+from conftest import LEDGER_FILE
+
+
+def test_vmake_amt_mixed_float_and_str():
+    base = settings.BaseType()
+    base.amount_errors = {}
+    x = pd.Series([1.5, '$2,000.00', '(3.25)', np.nan, 'n/a', 7, "'4'", ' 5 '], dtype=object, name='Actuals Amount')
+    amt = base.vmake_amt(x).tolist()
+    assert amt[:3] == [1.5, 2000.0, -3.25] and amt[4:] == [0.0, 7.0, 4.0, 5.0]
+    assert math.isnan(amt[3])
+    assert base.amount_errors == {'Actuals Amount': ['n/a']}
+
+
+def test_convert_mixed_amount_column():
+    this_file = pd.read_csv(LEDGER_FILE)
+    L = settings.ledger_info('calanswers', this_file.columns.to_list())
+    expected = L.convert(this_file)
+    mixed = this_file.copy()
+    actual = mixed['Actuals Amount'].astype(object)
+    half = np.arange(len(actual)) % 2 == 0
+    actual[half] = actual[half].map(L.make_amt)  # As pandas reads a large file in chunks:  some floats, some str
+    mixed['Actuals Amount'] = actual
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        converted = L.convert(mixed)
+    assert out.getvalue() == ''
+    assert converted['actual'].tolist() == expected['actual'].tolist()
+    assert converted['actual'].sum() == expected['actual'].sum() != 0.0
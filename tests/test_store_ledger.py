@@ -0,0 +1,97 @@
+import io
+import contextlib
+from copy import copy
+import numpy as np
+import pandas as pd
+import pytest
+from ddpm import settings_ledger as settings
+from conftest import LEDGER_FILE, read_ledger, copy_ledger
+
+
+MESSY = {0: '(1,234.50)', 1: '', 2: 'tbd', 3: '12.5', 4: ' $ 7.25 ', 5: "'1,000'"}  # Actuals Amount of the first rows
+
+
+def messy_ledger(fn):
+    def edit(n, row):
+        if n in MESSY:
+            row[-1] = MESSY[n]
+        return row
+    return copy_ledger(fn, edit)
+
+
+def per_entry_ledger(this_file):
+    """
+    The ledger as it was kept before the column store:  each row converted a cell at a time (keygen and the
+    'func' of each column) into an entry dict per account, with the account totals summed entry by entry.
+    """
+    L = settings.ledger_info('calanswers', this_file.columns.to_list())
+    data = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for row in this_file.values:
+            account = L.keygen(row)
+            if account not in data:
+                data[account] = {'entries': []}
+                for amtt in L.amount_types:
+                    data[account][amtt] = 0.0
+            entry = L.init()
+            for icol, ncol in enumerate(L.columns):
+                entry[L.colmap[ncol]['name']] = L.colmap[ncol]['func'](row[icol])
+            data[account]['entries'].append(entry)
+            for amtt in L.amount_types:
+                data[account][amtt] += entry[amtt]
+    return data
+
+
+def check_entries(this_ledger, expected):
+    assert list(this_ledger.data) == list(expected)
+    for account, this_account in expected.items():
+        entries = this_ledger.data[account]['entries']
+        assert len(entries) == len(this_account['entries'])
+        for entry, expected_entry in zip(entries, this_account['entries']):
+            assert {key: str(x) if x != x else x for key, x in entry.items()} == \
+                   {key: str(x) if x != x else x for key, x in expected_entry.items()}  # NaN as 'nan'
+            assert copy(entry).keys() == expected_entry.keys()
+            assert all([key in entry for key in expected_entry])
+
+
+def check_totals(this_ledger, expected):
+    # The totals are summed per account with compensation, so they agree with the entry by entry sums
+    # to rounding rather than to the last bit.
+    for account, this_account in expected.items():
+        for amtt in this_ledger.amount_types:
+            assert this_ledger.data[account][amtt] == pytest.approx(this_account[amtt], abs=1E-6, nan_ok=True)
+    for amtt in this_ledger.amount_types:
+        assert this_ledger.grand_total[amtt] == pytest.approx(sum([this_account[amtt] for this_account in expected.values()]),
+                                                              abs=1E-6, nan_ok=True)
+
+
+def test_entries_match_per_entry_dicts(fixture_ledger):
+    expected = per_entry_ledger(pd.read_csv(LEDGER_FILE))
+    check_entries(fixture_ledger, expected)
+    check_totals(fixture_ledger, expected)
+
+
+def test_messy_amounts_match_per_entry_dicts(tmp_path):
+    this_file = messy_ledger(str(tmp_path / 'FY25_General_Ledger_Detail.csv'))
+    expected = per_entry_ledger(pd.read_csv(this_file))
+    this_ledger = read_ledger(this_file)
+    check_entries(this_ledger, expected)
+    check_totals(this_ledger, expected)
+    entries = [this_ledger.store.get('actual', row) for row in range(len(MESSY))]
+    assert entries[0] == -1234.5 and np.isnan(entries[1]) and entries[2:] == [0.0, 12.5, 7.25, 1000.0]
+    assert np.isnan(this_ledger.grand_total['actual'])
+
+
+def test_mixed_amounts_match_per_entry_dicts(tmp_path, monkeypatch):
+    this_file = messy_ledger(str(tmp_path / 'FY25_General_Ledger_Detail.csv'))
+    mixed = pd.read_csv(this_file)
+    actual = mixed['Actuals Amount'].astype(object)
+    for n in range(len(MESSY), len(actual), 2):  # As pandas reads a large file in chunks:  some floats, some str
+        actual[n] = settings.BaseType().make_amt(actual[n])
+    mixed['Actuals Amount'] = actual
+    expected = per_entry_ledger(mixed)
+    read_csv = pd.read_csv
+    monkeypatch.setattr(pd, 'read_csv', lambda fn, *args, **kwargs: mixed.copy() if fn == this_file else read_csv(fn, *args, **kwargs))
+    this_ledger = read_ledger(this_file)
+    check_entries(this_ledger, expected)
+    check_totals(this_ledger, expected)
@@ -0,0 +1,67 @@
+import datetime
+import pytest
+from ddpm import utils_time as ut
+
+
+def key(year, month, day):
+    return datetime.datetime(year, month, day, 23, 59).astimezone()
+
+
+CADENCE_CASES = [  # date, then its daily, monthly, quarterly, yearly and fiscal (fy_month=7) keys
+    ((2024, 2, 29, 13), key(2024, 2, 29), key(2024, 2, 29), key(2024, 3, 31), key(2024, 12, 31), key(2024, 6, 30)),
+    ((2023, 2, 28, 0), key(2023, 2, 28), key(2023, 2, 28), key(2023, 3, 31), key(2023, 12, 31), key(2023, 6, 30)),
+    ((2024, 6, 30, 23), key(2024, 6, 30), key(2024, 6, 30), key(2024, 6, 30), key(2024, 12, 31), key(2024, 6, 30)),
+    ((2024, 7, 1, 0), key(2024, 7, 1), key(2024, 7, 31), key(2024, 9, 30), key(2024, 12, 31), key(2025, 6, 30)),
+    ((2024, 12, 31, 23), key(2024, 12, 31), key(2024, 12, 31), key(2024, 12, 31), key(2024, 12, 31), key(2025, 6, 30)),
+    ((2025, 1, 1, 0), key(2025, 1, 1), key(2025, 1, 31), key(2025, 3, 31), key(2025, 12, 31), key(2025, 6, 30)),
+]
+
+
+def test_cadence_keys():
+    dates = [datetime.datetime(*date).astimezone() for date, *_keys in CADENCE_CASES]
+    for n, cadence in enumerate(['daily', 'monthly', 'quarterly', 'yearly', 'fiscal']):
+        expected = [keys[n] for _date, *keys in CADENCE_CASES]
+        assert [ut.cadence_keys(cadence, date) for date in dates] == expected, cadence
+        assert ut.period_keys(dates, cadence).tolist() == expected, cadence
+
+
+def test_fiscal_cadence_keys_fy_month():
+    assert ut.cadence_keys('fiscal', datetime.datetime(2024, 9, 30), fy_month=10) == key(2024, 9, 30)
+    assert ut.cadence_keys('fiscal', datetime.datetime(2024, 10, 1), fy_month=10) == key(2025, 9, 30)
+    assert ut.cadence_keys('fiscal', datetime.datetime(2024, 1, 1), fy_month=1) == key(2024, 12, 31)
+    assert ut.period_keys([datetime.datetime(2024, 10, 1)], 'fiscal', fy_month=10).tolist() == [key(2025, 9, 30)]
+
+
+def test_period_keys_edges():
+    stop = datetime.datetime(2025, 3, 14, 12).astimezone()
+    dates = [datetime.datetime(2025, 2, 3).astimezone(), None, datetime.datetime(2025, 3, 1).astimezone()]
+    assert ut.period_keys(dates, 'monthly').tolist() == [key(2025, 2, 28), None, key(2025, 3, 31)]
+    assert ut.period_keys(dates, 'monthly', stop=stop).tolist() == [key(2025, 2, 28), None, stop]
+    assert ut.FiscalCalendar(7).years(dates).tolist() == [2025, 0, 2025]
+    assert ut.period_keys([], 'monthly').tolist() == []
+    with pytest.raises(ValueError):
+        ut.cadence_keys('weekly', dates[0])
+
+
+def test_get_fiscal_year_datetime():
+    assert ut.get_fiscal_year(datetime.datetime(2024, 6, 30)).year == 2024
+    assert ut.get_fiscal_year(datetime.datetime(2024, 7, 1)).year == 2025
+    assert ut.get_fiscal_year(datetime.datetime(2024, 9, 30), fy_month=10).year == 2024
+    assert ut.get_fiscal_year(datetime.datetime(2024, 10, 1), fy_month=10).year == 2025
+    assert ut.get_fiscal_year(datetime.datetime(2024, 1, 1), fy_month=1).year == 2025
+    fy = ut.get_fiscal_year(datetime.datetime(2024, 7, 1))
+    assert fy.start.date() == datetime.date(2024, 7, 1)
+    assert fy.stop.date() == datetime.date(2025, 6, 30)
+
+
+def test_fiscal_calendar_matches_get_fiscal_year():
+    dates = [datetime.datetime(2023, month, day) for month in range(1, 13) for day in (1, 28)]
+    for fy_month in (1, 7, 10):
+        calendar = ut.FiscalCalendar(fy_month)
+        years = calendar.years(dates)
+        for date, year in zip(dates, years):
+            fy = ut.get_fiscal_year(date, fy_month)
+            assert calendar.year(date) == fy.year == year
+            bounds = calendar.bounds(fy.year)
+            assert (bounds.year, bounds.start, bounds.stop) == (fy.year, fy.start, fy.stop)
+            assert bounds.start <= date.astimezone() <= bounds.stop + datetime.timedelta(days=1)